@@ -0,0 +1,93 @@
+"""
+Compares previous hash lookups between a python set of hex strings and the memory mapped VersionHashIndex
+
+    python -m dataPipelines.gc_scrapy.benchmarks.hash_index_benchmark --sizes 1000000 10000000 50000000
+
+Each (variant, size) runs in a fresh process so memory growth is attributable to that variant alone.
+Resident MiB is what stays in memory after building and querying, for the index that is mostly page cache
+of the mmap'd file that the OS can drop under pressure
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from dataPipelines.gc_scrapy.gc_scrapy.hash_index import DIGEST_SIZE, VersionHashIndex
+
+LOOKUPS = 200_000
+
+
+def max_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mib() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def random_digests(count: int, seed: int) -> bytes:
+    return np.random.default_rng(seed).bytes(count * DIGEST_SIZE)
+
+
+def iter_hex(digests: bytes):
+    for i in range(0, len(digests), DIGEST_SIZE):
+        yield digests[i:i + DIGEST_SIZE].hex()
+
+
+def run_variant(variant: str, size: int, index_dir: str) -> dict:
+    hits = list(iter_hex(random_digests(LOOKUPS // 2, seed=size)))
+    misses = list(iter_hex(random_digests(LOOKUPS // 2, seed=size + 1)))
+    start_peak_rss = max_rss_mib()
+    start_rss = current_rss_mib()
+
+    start = perf_counter()
+    if variant == "set":
+        # hits come first from the same seeded stream, so they are present in the structure
+        lookup = set(iter_hex(random_digests(size, seed=size)))
+    else:
+        lookup = VersionHashIndex.build(
+            random_digests(size, seed=size), os.path.join(index_dir, f"{size}.idx"), use_bloom=variant == "index+bloom"
+        )
+    build_seconds = perf_counter() - start
+    build_peak_rss = max_rss_mib() - start_peak_rss
+
+    queries = hits + misses
+    start = perf_counter()
+    found = sum(1 for q in queries if q in lookup)
+    lookup_seconds = perf_counter() - start
+    assert found >= len(hits), f"{variant} lost hashes"
+    resident_rss = current_rss_mib() - start_rss
+
+    return {
+        "variant": variant,
+        "size": size,
+        "build_s": build_seconds,
+        "lookups_per_s": len(queries) / lookup_seconds,
+        "build_peak_mib": build_peak_rss,
+        "resident_mib": resident_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000, 50_000_000])
+    parser.add_argument("--variants", nargs="+", default=["set", "index", "index+bloom"])
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'variant':<12} {'size':>12} {'build s':>9} {'lookups/s':>12} {'build peak MiB':>15} {'resident MiB':>13}")
+    with tempfile.TemporaryDirectory() as index_dir:
+        for size in args.sizes:
+            for variant in args.variants:
+                with ctx.Pool(1) as pool:
+                    r = pool.apply(run_variant, (variant, size, index_dir))
+                print(f"{r['variant']:<12} {r['size']:>12,} {r['build_s']:>9.2f} {r['lookups_per_s']:>12,.0f} {r['build_peak_mib']:>15.1f} {r['resident_mib']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
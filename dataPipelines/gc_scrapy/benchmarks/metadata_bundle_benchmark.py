@@ -0,0 +1,101 @@
+"""
+Compares writing document metadata as one .metadata sidecar per document against metadata bundles (METADATA_SINK)
+
+    python -m dataPipelines.gc_scrapy.benchmarks.metadata_bundle_benchmark --docs 10000 50000
+    python -m dataPipelines.gc_scrapy.benchmarks.metadata_bundle_benchmark --docs 10000 \\
+        --bucket <bucket> [--endpoint-url http://localhost:9000]
+
+Rows are the air_force_pubs output samples with the doc_name made unique, written through
+FileDownloadPipeline.write_metadata. With --bucket the files written are also uploaded with S3Uploader, counting
+the requests sent, and listed back. Without it the S3 requests are what the upload would take: a PUT per file under
+the multipart threshold, and a LIST per 1000 keys
+"""
+import argparse
+import json
+import os
+import tempfile
+from math import ceil
+from pathlib import Path
+from time import perf_counter
+
+from dataPipelines.gc_scrapy.gc_scrapy.metadata_bundle import (
+    METADATA_SINK_BUNDLE, METADATA_SINK_SIDECAR, MetadataBundleWriter,
+)
+from dataPipelines.gc_scrapy.gc_scrapy.pipelines import FileDownloadPipeline
+
+SAMPLES = Path(__file__).parent.parent / "gc_scrapy" / "output_samples" / "air_force_spider.json"
+
+
+def load_samples() -> list:
+    with open(SAMPLES) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def files_under(directory: Path) -> list:
+    return [Path(root, name) for root, _, names in os.walk(directory) for name in names]
+
+
+def write_metadata(sink: str, docs: int, output_dir: Path) -> float:
+    pipeline = FileDownloadPipeline()
+    pipeline.output_dir = output_dir
+    pipeline.write_metadata_sidecars = sink != METADATA_SINK_BUNDLE
+    if sink != METADATA_SINK_SIDECAR:
+        pipeline.metadata_bundle = MetadataBundleWriter(Path(output_dir, "metadata"), "benchmark")
+
+    samples = load_samples()
+    start = perf_counter()
+    for i in range(docs):
+        item = dict(samples[i % len(samples)], doc_name=f"{samples[i % len(samples)]['doc_name']} {i}")
+        pipeline.write_metadata(item, Path(output_dir, f"{item['doc_name']}.pdf.metadata"))
+    if pipeline.metadata_bundle:
+        pipeline.metadata_bundle.close()
+    return perf_counter() - start
+
+
+def upload(files: list, output_dir: Path, bucket: str, prefix: str, endpoint_url: str) -> tuple:
+    from dataPipelines.gc_scrapy.gc_scrapy.s3_upload import S3Uploader, get_s3_client
+
+    client = get_s3_client(endpoint_url)
+    requests = {"count": 0}
+
+    def count(**_):
+        requests["count"] += 1
+
+    client.meta.events.register("before-send.s3", count)
+    uploader = S3Uploader(bucket, output_dir, prefix=prefix, client=client)
+    start = perf_counter()
+    for path in files:
+        uploader.upload(path)
+    uploader.close()
+    for _ in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        pass
+    return perf_counter() - start, requests["count"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--sinks", nargs="+", default=[METADATA_SINK_SIDECAR, METADATA_SINK_BUNDLE])
+    parser.add_argument("--bucket", default=None)
+    parser.add_argument("--endpoint-url", default=None)
+    args = parser.parse_args()
+
+    print(f"{'sink':<8} {'docs':>8} {'write s':>8} {'files':>7} {'disk KiB':>9} {'s3 requests':>12} {'upload s':>9}")
+    for docs in args.docs:
+        for sink in args.sinks:
+            with tempfile.TemporaryDirectory() as output_dir:
+                output_dir = Path(output_dir)
+                write_seconds = write_metadata(sink, docs, output_dir)
+                files = files_under(output_dir)
+                # allocated blocks, small sidecars take a whole block each
+                disk_kib = sum(os.stat(f).st_blocks * 512 for f in files) / 1024
+                upload_seconds = float("nan")
+                requests = len(files) + ceil(len(files) / 1000)
+                if args.bucket:
+                    prefix = f"metadata_bundle_benchmark/{sink}-{docs}"
+                    upload_seconds, requests = upload(files, output_dir, args.bucket, prefix, args.endpoint_url)
+            print(f"{sink:<8} {docs:>8,} {write_seconds:>8.2f} {len(files):>7,} {disk_kib:>9,.0f} {requests:>12,} {upload_seconds:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
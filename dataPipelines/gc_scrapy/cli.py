@@ -1,15 +1,23 @@
 import click
 from textwrap import dedent
 
-from scrapy.crawler import CrawlerRunner
+from scrapy.crawler import Crawler, CrawlerRunner
 import importlib
 import os
+from scrapy.settings import Settings
 from scrapy.utils.project import get_project_settings
 from scrapy.utils.spider import iter_spider_classes
 from twisted.internet import reactor, defer
 from dataPipelines.notification import slack
 import copy
+import multiprocessing
+import shutil
 from pathlib import Path
+from dataPipelines.gc_scrapy.gc_scrapy.utils import get_shard
+from dataPipelines.gc_scrapy.gc_scrapy.manifest import get_previous_manifest
+from dataPipelines.gc_scrapy.gc_scrapy.manifest_store import ManifestStore
+from dataPipelines.gc_scrapy.gc_scrapy.dead_queue import DeadQueueReplaySpider
+from dataPipelines.gc_scrapy.gc_scrapy.metadata_bundle import METADATA_SINKS
 
 ####
 # CLI to run scrapy crawlers
@@ -89,6 +97,150 @@ def cli():
     required=False,
     type=click.BOOL
 )
+@click.option(
+    '--hash-index-dir',
+    help='Directory to build memory mapped previous hash indexes in, instead of holding the hashes in memory',
+    type=click.Path(
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True
+    ),
+    default=None,
+    required=False
+)
+@click.option(
+    '--hash-index-bloom',
+    help='Put a bloom filter in front of the previous hash indexes',
+    default=False,
+    required=False,
+    type=click.BOOL
+)
+@click.option(
+    '--manifest-store-location',
+    help='SQLite manifest store (.db) to also append new manifest rows to',
+    type=click.Path(
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True
+    ),
+    default=None,
+    required=False
+)
+@click.option(
+    '--detail-cache-location',
+    help='SQLite file (.db) to cache detail page results in, spiders skip detail pages of unchanged listing rows',
+    type=click.Path(
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True
+    ),
+    default=None,
+    required=False
+)
+@click.option(
+    '--blob-store-dir',
+    help='Directory to keep each distinct downloaded file in once by sha256, doc paths become hardlinks to it',
+    type=click.Path(
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True
+    ),
+    default=None,
+    required=False
+)
+@click.option(
+    '--partial-download-dir',
+    help='Directory to keep downloads cut short in across crawls, they are resumed with Range requests',
+    type=click.Path(
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True
+    ),
+    default=None,
+    required=False
+)
+@click.option(
+    '--upload-bucket',
+    help='S3 bucket to upload finished files and their metadata to while crawling, needs boto3',
+    type=str,
+    default=None,
+    required=False
+)
+@click.option(
+    '--upload-prefix',
+    help='Key prefix for uploaded files, followed by their path in the download dir',
+    type=str,
+    default=None,
+    required=False
+)
+@click.option(
+    '--upload-endpoint-url',
+    help='Endpoint of an S3 compatible store to upload to instead of AWS, eg minio',
+    type=str,
+    default=None,
+    required=False
+)
+@click.option(
+    '--delete-after-upload',
+    help='Remove downloaded files once their upload is confirmed',
+    default=False,
+    required=False,
+    type=click.BOOL
+)
+@click.option(
+    '--metadata-sink',
+    help='Write document metadata as .metadata sidecars (default), compressed bundles in <download-output-dir>/metadata or both',
+    type=click.Choice(METADATA_SINKS),
+    default=None,
+    required=False
+)
+@click.option(
+    '--keep-selenium-drivers-warm',
+    help='Keep selenium browsers running from one spider to the next, cookies and storage are cleared in between',
+    default=True,
+    required=False,
+    type=click.BOOL
+)
+@click.option(
+    '--response-cache-dir',
+    help='Directory to keep listing and API responses in across crawls, for spiders with http_cache_freshness',
+    type=click.Path(
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True
+    ),
+    default=None,
+    required=False
+)
+@click.option(
+    '--response-cache-max-mb',
+    help='Size of the response cache before least recently used responses are evicted',
+    type=click.IntRange(min=1),
+    default=1024,
+    required=False
+)
+@click.option(
+    '--max-parallel-spiders',
+    help='Number of spiders to crawl at the same time, 1 runs them sequentially',
+    type=click.IntRange(min=1),
+    default=1,
+    required=False
+)
+@click.option(
+    '--workers',
+    help='Number of worker processes to farm spiders out to, each spider crawls in its own process',
+    type=click.IntRange(min=1),
+    default=1,
+    required=False
+)
+@click.option(
+    '--shard',
+    help='Which part of a multi node crawl to run, as i/N with 0 <= i < N',
+    type=str,
+    default=None,
+    required=False,
+    callback=lambda ctx, param, value: parse_shard(value)
+)
 def crawl(
     download_output_dir,
     crawler_output_location,
@@ -97,6 +249,23 @@ def crawl(
     slack_hook_channel_id,
     slack_hook_url,
     dont_filter_previous_hashes,
+    hash_index_dir,
+    hash_index_bloom,
+    manifest_store_location,
+    detail_cache_location,
+    blob_store_dir,
+    partial_download_dir,
+    upload_bucket,
+    upload_prefix,
+    upload_endpoint_url,
+    delete_after_upload,
+    metadata_sink,
+    keep_selenium_drivers_warm,
+    response_cache_dir,
+    response_cache_max_mb,
+    max_parallel_spiders,
+    workers,
+    shard,
 ):
     print(dedent(f"""
     CRAWLING INITIATED
@@ -109,6 +278,23 @@ def crawl(
     slack_hook_channel_id={slack_hook_channel_id}
     slack_hook_url={slack_hook_url}
     dont_filter_previous_hashes={dont_filter_previous_hashes}
+    hash_index_dir={hash_index_dir}
+    hash_index_bloom={hash_index_bloom}
+    manifest_store_location={manifest_store_location}
+    detail_cache_location={detail_cache_location}
+    blob_store_dir={blob_store_dir}
+    partial_download_dir={partial_download_dir}
+    upload_bucket={upload_bucket}
+    upload_prefix={upload_prefix}
+    upload_endpoint_url={upload_endpoint_url}
+    delete_after_upload={delete_after_upload}
+    metadata_sink={metadata_sink}
+    keep_selenium_drivers_warm={keep_selenium_drivers_warm}
+    response_cache_dir={response_cache_dir}
+    response_cache_max_mb={response_cache_max_mb}
+    max_parallel_spiders={max_parallel_spiders}
+    workers={workers}
+    shard={shard}
     """))
 
     current_dir = os.path.dirname(os.path.realpath(__file__))
@@ -139,6 +325,13 @@ def crawl(
 
     settings = get_project_settings()
     settings.set('FEED_URI', crawler_output_location)
+    if metadata_sink:
+        settings.set('METADATA_SINK', metadata_sink)
+    # the spiders share the reactor's process unless they run in workers, each with its own browsers
+    settings.set('SELENIUM_KEEP_DRIVERS_WARM', keep_selenium_drivers_warm and workers == 1)
+    if response_cache_dir:
+        settings.set('RESPONSE_CACHE_DIR', response_cache_dir)
+        settings.set('RESPONSE_CACHE_MAX_BYTES', response_cache_max_mb * 2**20)
     runner = CrawlerRunner(settings)
 
     spider_class_refs = []
@@ -159,16 +352,311 @@ def crawl(
         'download_output_dir': download_output_dir,
         'previous_manifest_location': previous_manifest_location,
         'dont_filter_previous_hashes': dont_filter_previous_hashes,
+        'hash_index_dir': hash_index_dir,
+        'hash_index_bloom': hash_index_bloom,
+        'manifest_store_location': manifest_store_location,
+        'detail_cache_location': detail_cache_location,
+        'blob_store_dir': blob_store_dir,
+        'partial_download_dir': partial_download_dir,
+        'upload_bucket': upload_bucket,
+        'upload_prefix': upload_prefix,
+        'upload_endpoint_url': upload_endpoint_url,
+        'delete_after_upload': delete_after_upload,
         'output': crawler_output_location
     }
 
+    if shard:
+        shard_index, shard_count = shard
+        spider_class_refs = get_shard_spiders(spider_class_refs, shard_index, shard_count)
+        crawl_kwargs.update(shard_index=shard_index, shard_count=shard_count)
+        print(f'Shard {shard_index}/{shard_count} will run', len(spider_class_refs))
+        for s in spider_class_refs:
+            print(' - ', s.name)
+        print()
+
+        if not spider_class_refs:
+            print('No spiders assigned to this shard... EXITING')
+            return
+
+    if workers == 1 and not dont_filter_previous_hashes:
+        # read the previous manifest once up front, every spider's pipeline then shares it
+        get_previous_manifest(previous_manifest_location, hash_index_dir, hash_index_bloom)
+
+    if workers > 1:
+        try:
+            all_stats = run_spiders_in_worker_pool(settings, spider_class_refs, crawl_kwargs, workers)
+            send_stats(all_stats=all_stats, slack_hook_channel_id=slack_hook_channel_id, slack_hook_url=slack_hook_url)
+        except Exception as e:
+            print("ERROR RUNNING SPIDERS IN WORKER POOL", e)
+        return
+
     try:
-        queue_spiders_sequentially(runner, spider_class_refs, crawl_kwargs)
+        if max_parallel_spiders > 1:
+            queue_spiders_concurrently(runner, spider_class_refs, crawl_kwargs, max_parallel_spiders)
+        else:
+            queue_spiders_sequentially(runner, spider_class_refs, crawl_kwargs)
         reactor.run()
         all_stats = copy.deepcopy(spider_class_refs[0].stats)
         send_stats(all_stats=all_stats, slack_hook_channel_id=slack_hook_channel_id, slack_hook_url=slack_hook_url)
     except Exception as e:
-        print("ERROR RUNNING SPIDERS SEQUENTIALLY", e)
+        print("ERROR RUNNING SPIDERS", e)
+
+
+@cli.command(name='merge-manifests')
+@click.option(
+    '--shard-dir',
+    help='Download output dir of a crawl shard, pass once per shard',
+    type=click.Path(
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True
+    ),
+    multiple=True,
+    required=True
+)
+@click.option(
+    '--output-dir',
+    help='Directory to write the merged manifest, dead queue and crawler output to',
+    type=click.Path(
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True
+    ),
+    required=True
+)
+@click.option(
+    '--crawler-output-name',
+    help='File name of the crawler output inside each shard dir',
+    type=str,
+    default='crawler_output.json',
+    required=False
+)
+def merge_manifests(shard_dir, output_dir, crawler_output_name):
+    print(dedent(f"""
+    MERGING SHARD MANIFESTS
+
+    -- ARGS/VARS --
+    shard_dir={shard_dir}
+    output_dir={output_dir}
+    crawler_output_name={crawler_output_name}
+    """))
+
+    for file_name in ('manifest.json', 'dead_queue.json', crawler_output_name):
+        output_location = Path(output_dir, file_name)
+        # a shard dir can be the output dir, its rows are read before the merged file replaces them
+        shards = [Path(d, file_name) for d in shard_dir]
+        merge_shards(shards, output_location, remove_shards=False, replace_output=True)
+        print('Merged', file_name)
+
+
+manifest_store_option = click.option(
+    '--store',
+    help='SQLite manifest store (.db), created if it does not exist',
+    type=click.Path(
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True
+    ),
+    required=True
+)
+
+
+@cli.command(name='import-manifest')
+@manifest_store_option
+@click.option(
+    '--manifest',
+    help='Manifest jsonlines file to append to the store, eg manifest.json or cumulative-manifest.json',
+    type=click.Path(
+        exists=True,
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True
+    ),
+    multiple=True,
+    required=True
+)
+@click.option(
+    '--compact',
+    help='Compact the store after importing',
+    default=False,
+    required=False,
+    type=click.BOOL
+)
+def import_manifest(store, manifest, compact):
+    manifest_store = ManifestStore(store)
+    for manifest_location in manifest:
+        imported = manifest_store.import_jsonl(manifest_location)
+        print(f'Imported {imported} rows from {manifest_location}')
+
+    if compact:
+        print(f'Compacted store, removed {manifest_store.compact()} superseded rows')
+    print(f'{store} has {len(manifest_store)} rows')
+    manifest_store.close()
+
+
+@cli.command(name='export-manifest')
+@manifest_store_option
+@click.option(
+    '--manifest',
+    help='Manifest jsonlines file to write the store to, overwritten if it exists',
+    type=click.Path(
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True
+    ),
+    required=True
+)
+def export_manifest(store, manifest):
+    manifest_store = ManifestStore(store)
+    print(f'Exported {manifest_store.export_jsonl(manifest)} rows to {manifest}')
+    manifest_store.close()
+
+
+@cli.command(name='compact-manifest')
+@manifest_store_option
+def compact_manifest(store):
+    manifest_store = ManifestStore(store)
+    print(f'Compacted store, removed {manifest_store.compact()} superseded rows, {len(manifest_store)} left')
+    manifest_store.close()
+
+
+@cli.command(name='replay-dead-queue')
+@click.option(
+    '--dead-queue',
+    help='dead_queue.json to download the docs of again, pass once per file, oldest first',
+    type=click.Path(
+        exists=True,
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True
+    ),
+    multiple=True,
+    required=True
+)
+@click.option(
+    '--download-output-dir',
+    help='Directory to download the files in to, docs failing again go to its dead_queue.json',
+    type=click.Path(
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True,
+        allow_dash=False
+    ),
+    required=True
+)
+@click.option(
+    '--crawler-output-location',
+    help='File location for the crawler output of the replayed docs to go',
+    type=click.Path(
+        exists=False,
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True
+    ),
+    required=True
+)
+@click.option(
+    '--manifest-store-location',
+    help='SQLite manifest store (.db) to also append new manifest rows to',
+    type=click.Path(
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True
+    ),
+    default=None,
+    required=False
+)
+@click.option(
+    '--blob-store-dir',
+    help='Directory to keep each distinct downloaded file in once by sha256, doc paths become hardlinks to it',
+    type=click.Path(
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True
+    ),
+    default=None,
+    required=False
+)
+def replay_dead_queue(dead_queue, download_output_dir, crawler_output_location, manifest_store_location, blob_store_dir):
+    print(dedent(f"""
+    REPLAYING DEAD QUEUE
+
+    -- ARGS/VARS --
+    dead_queue={dead_queue}
+    download_output_dir={download_output_dir}
+    crawler_output_location={crawler_output_location}
+    manifest_store_location={manifest_store_location}
+    blob_store_dir={blob_store_dir}
+    """))
+
+    output_dead_queue = str(Path(download_output_dir, 'dead_queue.json'))
+    if output_dead_queue in dead_queue:
+        raise click.BadParameter(
+            f'{output_dead_queue} is where docs failing again are written, replay it into another download dir',
+            param_hint='--dead-queue'
+        )
+
+    settings = get_project_settings()
+    settings.set('FEED_URI', crawler_output_location)
+    runner = CrawlerRunner(settings)
+    crawl_kwargs = {
+        'dead_queue_locations': list(dead_queue),
+        'download_output_dir': download_output_dir,
+        'manifest_store_location': manifest_store_location,
+        'blob_store_dir': blob_store_dir,
+        'output': crawler_output_location
+    }
+
+    queue_spiders_sequentially(runner, [DeadQueueReplaySpider], crawl_kwargs)
+    reactor.run()
+    print('Replay stats', DeadQueueReplaySpider.stats.get(DeadQueueReplaySpider.name))
+
+
+def parse_shard(shard: str):
+    """
+    Args:
+        shard: shard string from the cli as i/N
+
+    Returns:
+        tuple of (shard index, shard count) or None if no shard was given
+    """
+
+    if not shard:
+        return None
+
+    try:
+        shard_index, shard_count = (int(part) for part in shard.split('/'))
+    except ValueError:
+        raise click.BadParameter(f'{shard} is not in the form i/N')
+
+    if not 0 <= shard_index < shard_count:
+        raise click.BadParameter(f'{shard} needs 0 <= i < N')
+
+    return shard_index, shard_count
+
+
+def get_shard_spiders(spiders: list, shard_index: int, shard_count: int) -> list:
+    """
+    Args:
+        spiders: list of spider class references to run
+        shard_index: 0 based index of this shard
+        shard_count: total number of shards
+
+    Returns:
+        spiders to run on this shard, spiders with shard_start_urls run on every shard that gets a start url
+    """
+
+    whole_spiders = sorted((s for s in spiders if not s.shard_start_urls), key=lambda s: s.name)
+    assigned = set(get_shard(whole_spiders, shard_index, shard_count))
+    assigned.update(
+        s for s in spiders
+        if s.shard_start_urls and get_shard(s.start_urls, shard_index, shard_count)
+    )
+
+    return [s for s in spiders if s in assigned]
 
 
 def get_git_branch() -> str:
@@ -236,6 +724,164 @@ def queue_spiders_sequentially(runner: CrawlerRunner, spiders: list, crawl_kwarg
             exit(1)
 
 
+@defer.inlineCallbacks
+def queue_spiders_concurrently(runner: CrawlerRunner, spiders: list, crawl_kwargs: dict, max_parallel_spiders: int) -> None:
+    """
+    Args:
+        runner: CrawlerRunner instance
+        spiders: list of spider class references to run
+        crawl_kwargs: dict of args to pass CrawlerRunner
+        max_parallel_spiders: max number of spiders crawling in the reactor at once
+
+    Each spider writes its feed to its own shard file so concurrent exporters don't interleave lines,
+    the shards are merged into crawl_kwargs['output'] in spider order once every spider is done
+    """
+
+    semaphore = defer.DeferredSemaphore(max_parallel_spiders)
+    feed_shards = [get_shard_location(crawl_kwargs['output'], spider.name) for spider in spiders]
+
+    def crawl_spider(spider, feed_shard):
+        settings = runner.settings.copy()
+        settings.set('FEED_URI', feed_shard)
+        d = runner.crawl(Crawler(spider, settings), **crawl_kwargs)
+
+        def log_error(failure):
+            print(f'ERROR RUNNING SPIDER CLASS: {spider}')
+            print(failure.value)
+
+        return d.addErrback(log_error)
+
+    try:
+        yield defer.DeferredList([
+            semaphore.run(crawl_spider, spider, feed_shard)
+            for spider, feed_shard in zip(spiders, feed_shards)
+        ])
+    finally:
+        print("Done running spiders, merging feed shards")
+        try:
+            merge_shards(feed_shards, crawl_kwargs['output'])
+        except Exception as e:
+            print('Error merging feed shards', e)
+
+        print("Stopping twisted.reactor and sending stats")
+        try:
+            reactor.stop()
+        except Exception as e:
+            print(e)
+            exit(1)
+
+
+def run_spiders_in_worker_pool(settings, spiders: list, crawl_kwargs: dict, workers: int) -> dict:
+    """
+    Args:
+        settings: project settings to crawl with
+        spiders: list of spider class references to run
+        crawl_kwargs: dict of args to pass CrawlerRunner
+        workers: number of worker processes
+
+    Returns:
+        stats of every spider run, keyed by spider name
+
+    Every spider runs in a fresh process with its own reactor and writes its own feed, manifest and dead queue
+    shards, which are merged into the files run_job.sh expects in spider order once the pool is done
+    """
+
+    output_dir = crawl_kwargs['download_output_dir']
+    outputs = {
+        'output': crawl_kwargs['output'],
+        'job_manifest_location': Path(output_dir, 'manifest.json'),
+        'dead_queue_location': Path(output_dir, 'dead_queue.json'),
+    }
+
+    tasks = []
+    for spider in spiders:
+        spider_kwargs = {
+            **crawl_kwargs,
+            **{k: str(get_shard_location(v, spider.name)) for k, v in outputs.items()}
+        }
+        tasks.append((settings.copy_to_dict(), spider, spider_kwargs))
+
+    # spawn so each worker imports a clean twisted reactor, one task per child since a reactor can't be restarted
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes=workers, maxtasksperchild=1) as pool:
+        results = pool.starmap(crawl_in_worker, tasks, chunksize=1)
+
+    print("Done running spiders in worker pool, merging shards")
+    for k, location in outputs.items():
+        merge_shards([spider_kwargs[k] for _, _, spider_kwargs in tasks], location)
+
+    all_stats = {}
+    for stats in results:
+        all_stats.update(stats)
+
+    return all_stats
+
+
+def crawl_in_worker(settings_dict: dict, spider, crawl_kwargs: dict) -> dict:
+    """
+    Args:
+        settings_dict: project settings as a dict
+        spider: spider class reference to run
+        crawl_kwargs: dict of args to pass CrawlerRunner, with this spider's shard locations
+
+    Returns:
+        the spider's stats, keyed by spider name
+    """
+
+    settings = Settings(settings_dict)
+    settings.set('FEED_URI', crawl_kwargs['output'])
+    runner = CrawlerRunner(settings)
+
+    try:
+        queue_spiders_sequentially(runner, [spider], crawl_kwargs)
+        reactor.run()
+    except Exception as e:
+        print(f'ERROR RUNNING SPIDER CLASS IN WORKER: {spider}')
+        print(e)
+
+    return {name: dict(stats) for name, stats in spider.stats.items() if name == spider.name}
+
+
+def get_shard_location(output_location, spider_name: str) -> Path:
+    """
+    Args:
+        output_location: final output file location
+        spider_name: name of the spider writing to the shard
+
+    Returns:
+        path of the spider's shard, next to the final output
+    """
+
+    output_path = Path(output_location)
+    return output_path.with_name(f'{output_path.name}.{spider_name}.part')
+
+
+def merge_shards(shards: list, output_location, remove_shards: bool = True, replace_output: bool = False) -> None:
+    """
+    Args:
+        shards: shard files to append to the output, in order
+        output_location: final output file location
+        remove_shards: delete each shard once it is appended
+        replace_output: write the shards to a temp file renamed over the output, instead of appending to it,
+            so merging the same shards again doesn't duplicate rows
+    """
+
+    shards = [shard for shard in shards if os.path.isfile(shard)]
+    if not shards:
+        return
+
+    write_location = f'{output_location}.merging' if replace_output else output_location
+    with open(write_location, 'wb' if replace_output else 'ab') as output:
+        for shard in shards:
+            with open(shard, 'rb') as f:
+                shutil.copyfileobj(f, output)
+            if remove_shards:
+                os.remove(shard)
+
+    if replace_output:
+        os.replace(write_location, output_location)
+
+
 def resolve_spider(spider_path):
     """
     Args:
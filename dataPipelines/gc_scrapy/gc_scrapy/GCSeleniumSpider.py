@@ -1,4 +1,9 @@
 # -*- coding: utf-8 -*-
+import functools
+import json
+from time import monotonic
+from scrapy import Selector
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
@@ -7,6 +12,65 @@ import typing
 from dataPipelines.gc_scrapy.gc_scrapy.runspider_settings import general_settings, selenium_settings
 from dataPipelines.gc_scrapy.gc_scrapy.middleware_utils.selenium_request import SeleniumRequest
 from dataPipelines.gc_scrapy.gc_scrapy.GCSpider import GCSpider
+from dataPipelines.gc_scrapy.gc_scrapy.selenium_pool import SELENIUM_DRIVER_LEASE
+
+
+# returns the rows of a DataTables table, every page of them, as a json array of the display html of their cells.
+# "unavailable" when the page has no such table or no DataTables api, or the table is server side processed (its api
+# only holds the page drawn), "pending" until the table's data is first drawn
+DATATABLE_ROWS_SCRIPT = """
+var table = document.querySelectorAll(arguments[0])[arguments[1]];
+var dt = window.jQuery && jQuery.fn.dataTable;
+if (!table || !dt || !dt.isDataTable(table)) { return "unavailable"; }
+var api = jQuery(table).DataTable();
+var settings = api.settings()[0];
+if (settings.oFeatures && settings.oFeatures.bServerSide) { return "unavailable"; }
+if (!settings._bInitComplete) { return "pending"; }
+var columns = api.columns().indexes().toArray();
+return JSON.stringify(api.rows({order: "applied"}).indexes().toArray().map(function (row) {
+    return columns.map(function (column) {
+        var html = api.cell(row, column).render("display");
+        return html === null || html === undefined ? "" : String(html);
+    });
+}));
+"""
+
+# [readyState, jquery ajax requests in flight, resources loaded so far, end of the latest one], for wait_for_network_idle
+NETWORK_ACTIVITY_SCRIPT = """
+if (performance.setResourceTimingBufferSize) { performance.setResourceTimingBufferSize(10000); }
+var resources = performance.getEntriesByType("resource");
+var last = resources.length ? resources[resources.length - 1].responseEnd : 0;
+return [document.readyState, window.jQuery ? jQuery.active : 0, resources.length, last];
+"""
+
+# true once the table is drawn: a DataTables table has its data and isn't drawing, loading or showing processing
+TABLE_DRAWN_SCRIPT = """
+var table = document.querySelectorAll(arguments[0])[arguments[1]];
+if (!table || document.readyState !== "complete") { return false; }
+var dt = window.jQuery && jQuery.fn.dataTable;
+if (!dt || !dt.isDataTable(table)) { return true; }
+var settings = jQuery(table).DataTable().settings()[0];
+if (!settings._bInitComplete || settings.bDrawing) { return false; }
+if (settings.jqXHR && settings.jqXHR.readyState !== 4) { return false; }
+return jQuery(table).closest(".dataTables_wrapper").find(".dataTables_processing:visible").length === 0;
+"""
+
+
+def driver_callback(callback):
+    """
+        Runs a callback of a selenium response in a thread of the pool its driver came from, off the reactor thread
+
+        The callback's driver calls (page loads, waits, clicks) block, so its output is collected in that thread and
+        the Deferred returned fires with it. Responses without a pooled driver run the callback as is
+    """
+    @functools.wraps(callback)
+    def in_driver_thread(spider, response, *args, **kwargs):
+        lease = response.meta.get(SELENIUM_DRIVER_LEASE)
+        if lease is None:
+            return callback(spider, response, *args, **kwargs)
+        return lease.pool.run(lambda: list(callback(spider, response, *args, **kwargs) or ()))
+
+    return in_driver_thread
 
 
 class GCSeleniumSpider(GCSpider):
@@ -57,3 +121,155 @@ class GCSeleniumSpider(GCSpider):
             EC.presence_of_element_located(
                 (By.CSS_SELECTOR, css_selector)
             ))
+
+    def get_datatable_rows(self, driver, table_selector: str, table_index: int = 0,
+                           wait: typing.Union[int, float] = 10) -> typing.Optional[typing.List[Selector]]:
+        """
+            Every row of a DataTables table, across all its pages, from the DataTables api in one execute_script call
+
+            Rows are rebuilt as <tr> of the cells' display html so they parse like rows of the page source. None when
+            the table isn't a DataTables table, the page doesn't load the api, the table is server side processed
+            (the api only has the drawn page, it has to be paged) or the table isn't drawn within wait
+        """
+        def rows_ready(d):
+            rows_json = d.execute_script(DATATABLE_ROWS_SCRIPT, table_selector, table_index)
+            return rows_json != "pending" and rows_json
+
+        try:
+            rows_json = WebDriverWait(driver, wait).until(rows_ready)
+        except TimeoutException:
+            return None
+        if rows_json == "unavailable":
+            return None
+
+        html = "".join(
+            "<tr>" + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>" for cells in json.loads(rows_json)
+        )
+        return Selector(text=f"<table><tbody>{html}</tbody></table>").css("tbody tr")
+
+    def iter_table_rows(self, driver, table_selector: str, next_page=None, table_index: int = 0,
+                        rows_selector: str = "tbody tr", page_wait: typing.Union[int, float] = 30
+                        ) -> typing.Iterator[Selector]:
+        """
+            Yields every row of a table, all at once from the DataTables api if it has one (get_datatable_rows),
+            otherwise page by page from the page source
+
+            next_page is the css selector of the next page link, or a function of the driver returning the link
+            element or None. Paging stops once there's no link. After each click the table's first row has to go
+            stale, redrawn or reloaded with the page, and the table drawn again within page_wait seconds
+        """
+        stats = getattr(self, "crawler", None) and self.crawler.stats
+
+        rows = self.get_datatable_rows(driver, table_selector, table_index)
+        if rows is not None:
+            if stats:
+                stats.inc_value("selenium_tables/datatables_api", spider=self)
+                stats.inc_value("selenium_tables/rows", len(rows), spider=self)
+            yield from rows
+            return
+
+        while True:
+            rows = Selector(text=driver.page_source).css(table_selector)[table_index].css(rows_selector)
+            if stats:
+                stats.inc_value("selenium_tables/pages", spider=self)
+                stats.inc_value("selenium_tables/rows", len(rows), spider=self)
+            yield from rows
+
+            link = self.find_next_page(driver, next_page)
+            if link is None:
+                return
+            drawn = driver.find_elements(By.CSS_SELECTOR, table_selector)[table_index]
+            try:
+                drawn = drawn.find_element(By.CSS_SELECTOR, rows_selector)
+            except NoSuchElementException:
+                pass
+            driver.execute_script("arguments[0].click();", link)
+            self.wait_for_table_redraw(driver, table_selector, stale=drawn, table_index=table_index, wait=page_wait)
+
+    @staticmethod
+    def find_next_page(driver, next_page):
+        """The next page link for iter_table_rows, None on the last page"""
+        if next_page is None:
+            return None
+        if callable(next_page):
+            return next_page(driver)
+        links = driver.find_elements(By.CSS_SELECTOR, next_page)
+        return links[0] if links else None
+
+    def record_wait(self, kind: str, started: float) -> float:
+        """
+            Adds the time since started to the selenium_wait/seconds and selenium_wait/<kind>_seconds stats
+
+            SeleniumMiddleware sets selenium_wait/work_seconds when the spider closes, the rest of the time drivers
+            were checked out
+        """
+        waited = monotonic() - started
+        stats = getattr(self, "crawler", None) and self.crawler.stats
+        if stats:
+            stats.inc_value("selenium_wait/seconds", waited, spider=self)
+            stats.inc_value(f"selenium_wait/{kind}_seconds", waited, spider=self)
+            stats.inc_value(f"selenium_wait/{kind}_waits", spider=self)
+        return waited
+
+    def wait_for_network_idle(self, driver, idle_seconds: float = 0.5, wait: typing.Union[int, float] = 30,
+                              poll: float = 0.1) -> bool:
+        """
+            Waits until the page is loaded and no resource or jquery request finished for idle_seconds
+
+            Returns False instead of raising once wait runs out, pages that poll the server never go idle
+        """
+        started = monotonic()
+        last = {"activity": None, "since": started}
+
+        def idle(d):
+            ready_state, active, *activity = d.execute_script(NETWORK_ACTIVITY_SCRIPT)
+            now = monotonic()
+            if activity != last["activity"]:
+                last.update(activity=activity, since=now)
+            return ready_state == "complete" and not active and now - last["since"] >= idle_seconds
+
+        try:
+            return WebDriverWait(driver, wait, poll_frequency=poll).until(idle)
+        except TimeoutException:
+            return False
+        finally:
+            self.record_wait("network_idle", started)
+
+    def wait_for_element_count_stable(self, driver, css_selector: str, stable_seconds: float = 0.5,
+                                      min_count: int = 1, wait: typing.Union[int, float] = 30,
+                                      poll: float = 0.1) -> int:
+        """
+            Waits until at least min_count elements match css_selector and their count held for stable_seconds,
+            for lists rendered or filled in bit by bit. Returns the count, raises TimeoutException
+        """
+        started = monotonic()
+        last = {"count": None, "since": started}
+
+        def stable(d):
+            count = d.execute_script("return document.querySelectorAll(arguments[0]).length;", css_selector)
+            now = monotonic()
+            if count != last["count"]:
+                last.update(count=count, since=now)
+            return count >= min_count and now - last["since"] >= stable_seconds
+
+        try:
+            WebDriverWait(driver, wait, poll_frequency=poll).until(stable)
+            return last["count"]
+        finally:
+            self.record_wait("element_count", started)
+
+    def wait_for_table_redraw(self, driver, table_selector: str, stale=None, table_index: int = 0,
+                              wait: typing.Union[int, float] = 30, poll: float = 0.1) -> None:
+        """
+            Waits until a table is drawn, for DataTables tables until they aren't loading, drawing or processing
+
+            stale is an element of the previous draw, eg its first row, that has to go first. Raises TimeoutException
+        """
+        started = monotonic()
+        try:
+            waiter = WebDriverWait(driver, wait, poll_frequency=poll)
+            if stale is not None:
+                waiter.until(EC.staleness_of(stale))
+            waiter.until(lambda d: d.execute_script(TABLE_DRAWN_SCRIPT, table_selector, table_index))
+        finally:
+            self.record_wait("table_redraw", started)
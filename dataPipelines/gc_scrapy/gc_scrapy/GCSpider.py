@@ -7,6 +7,10 @@ from os.path import splitext
 from time import perf_counter
 import urllib
 from dataPipelines.gc_scrapy.gc_scrapy.runspider_settings import general_settings
+from dataPipelines.gc_scrapy.gc_scrapy.utils import get_shard
+from dataPipelines.gc_scrapy.gc_scrapy.detail_cache import DetailPageCache, get_detail_cache, listing_row_fingerprint
+from dataPipelines.gc_scrapy.gc_scrapy.spider_middlewares import DETAIL_CACHE_KEY
+from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
 import copy
 
 url_re = re.compile("((http|https)://)(www.)?" +
@@ -28,6 +32,12 @@ UNKNOWN_FILE_EXTENSION_PLACEHOLDER = "UNKNOWN"
 STATS_BASE = {
     "Required CAC": 0,
     "In Previous Hashes": 0,
+    "Not Modified": 0,
+    "Detail Cache Hits": 0,
+    "Detail Cache Misses": 0,
+    "Duplicate Blobs": 0,
+    "Retried Downloads": 0,
+    "Recovered Downloads": 0,
 }
 
 
@@ -40,6 +50,8 @@ class GCSpider(scrapy.Spider):
         super().__init__(*args, **kwargs)
 
         self.setup_stats()
+        if self.shard_start_urls and int(self.shard_count) > 1:
+            self.start_urls = get_shard(self.start_urls, int(self.shard_index), int(self.shard_count))
         if self.time_lifespan:
             self.start_time = perf_counter()
 
@@ -75,6 +87,40 @@ class GCSpider(scrapy.Spider):
 
     source_page_url = None
     dont_filter_previous_hashes = False
+    # build memory mapped previous hash indexes in this dir instead of holding them in sets, see hash_index.py
+    hash_index_dir = None
+    hash_index_bloom = False
+    # (url regex, seconds) pairs, responses for matching urls are kept across crawls by ResponseCacheMiddleware
+    # and reused without a request for that many seconds, then revalidated. 0 always revalidates, first match wins
+    http_cache_freshness: typing.List[typing.Tuple[str, float]] = []
+    # sqlite file to reuse detail page results from when the listing row is unchanged, see follow_detail_page
+    detail_cache_location = None
+    # cached detail page results older than this are fetched again anyway
+    detail_cache_max_age_days: float = 7
+    # sqlite manifest store the job manifest rows are also appended to, see manifest_store.py
+    manifest_store_location = None
+    # write downloaded documents to disk as they arrive instead of holding their bodies in memory, see streaming_download.py
+    # ignored for spiders overriding download_response_handler, they need the body
+    stream_downloads: bool = True
+    # keep downloads cut short in this dir to resume them with Range requests in later crawls, see streaming_download.py
+    # by default they're kept in <download_output_dir>/.partial/<spider name> until the spider closes
+    partial_download_dir = None
+    # keep each distinct downloaded file once by sha256 in this dir, doc paths become hardlinks, see blob_store.py
+    blob_store_dir = None
+    # upload finished files and their metadata to s3://<upload_bucket>/<upload_prefix> during the crawl, see s3_upload.py
+    # upload_endpoint_url for S3 compatible stores, eg minio. delete_after_upload removes files once they're in the bucket
+    upload_bucket = None
+    upload_prefix = None
+    upload_endpoint_url = None
+    delete_after_upload = False
+    # override default <download_output_dir>/manifest.json and dead_queue.json, eg for cli worker shards
+    job_manifest_location = None
+    dead_queue_location = None
+    # cli crawl --shard, which shard of a multi node crawl this spider runs in
+    shard_index: int = 0
+    shard_count: int = 1
+    # start_urls are independent of each other, so the spider runs on every shard with its own slice of them
+    shard_start_urls: bool = False
     download_request_headers = {}
 
     stats: dict = {}
@@ -97,6 +143,34 @@ class GCSpider(scrapy.Spider):
         except Exception as e:
             print(e)
 
+    @property
+    def detail_cache(self) -> typing.Optional[DetailPageCache]:
+        if not self.detail_cache_location:
+            return None
+        return get_detail_cache(self.detail_cache_location)
+
+    def follow_detail_page(self, request: scrapy.Request, *listing_row) -> typing.Iterator[typing.Union[scrapy.Request, DocItem]]:
+        """
+            yields the DocItems last produced by the detail page request when the listing row is unchanged, else the request
+            listing_row is everything known about the doc before following the request, eg the href and the row's fields
+        """
+        cache = self.detail_cache
+        if cache is None:
+            yield request
+            return
+
+        fingerprint = listing_row_fingerprint(request.url, *listing_row)
+        cached_items = cache.get(self.name, fingerprint, float(self.detail_cache_max_age_days) * 24 * 60 * 60)
+        if cached_items is None:
+            self.increment_detail_cache_misses()
+            request.meta[DETAIL_CACHE_KEY] = fingerprint
+            yield request
+            return
+
+        self.increment_detail_cache_hits()
+        for item in cached_items:
+            yield DocItem(**item)
+
     @staticmethod
     def download_response_handler(response):
         return response.body
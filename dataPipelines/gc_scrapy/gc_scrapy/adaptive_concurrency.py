@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.adaptive_concurrency
+-----------------
+Per download slot controller picking concurrency and timeouts from the latency, throughput and errors the slot shows
+"""
+from collections import deque
+from typing import Deque, Optional
+
+
+# request meta keys
+# set by FileDownloadPipeline, the request's body gets a timeout sized to its Content-Length, see AdaptiveConcurrencyMiddleware
+MEDIA_DOWNLOAD = "media_download"
+
+
+def percentile(values, fraction: float) -> Optional[float]:
+    """Nearest rank percentile, None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class SlotController:
+    """Adjusts a slot's concurrency and timeout once every window finished requests
+
+    Additive increase, multiplicative decrease: a window with an error rate over max_error_rate halves concurrency,
+    one whose p95 latency is over target_latency drops it by one and a healthy one raises it by one.
+    The timeout follows the p95 latency times timeout_factor, and doubles after a window with timeouts in it.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        timeout: float,
+        min_concurrency: int = 1,
+        max_concurrency: int = 16,
+        min_timeout: float = 2.0,
+        max_timeout: float = 30.0,
+        target_latency: float = 2.0,
+        max_error_rate: float = 0.1,
+        timeout_factor: float = 4.0,
+        window: int = 20,
+    ):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(min_concurrency, max_concurrency)
+        self.min_timeout = min_timeout
+        self.max_timeout = max(min_timeout, max_timeout)
+        self.concurrency = self._clamp(concurrency, self.min_concurrency, self.max_concurrency)
+        self.timeout = self._clamp(timeout, self.min_timeout, self.max_timeout)
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.timeout_factor = timeout_factor
+        self.window = window
+
+        # seconds till headers of the window's successful responses
+        self.latencies: Deque[float] = deque(maxlen=window)
+        # bytes per second of successful responses, kept across windows for media timeouts
+        self.throughputs: Deque[float] = deque(maxlen=window)
+        self.finished = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.adjustments = 0
+        # latency percentiles and error rate of the last window adjusted on
+        self.last_window = {}
+
+    @staticmethod
+    def _clamp(value, low, high):
+        return max(low, min(high, value))
+
+    def record_response(self, latency: float, size: int = 0, elapsed: float = 0.0) -> bool:
+        """Records a successful response
+
+        :returns: whether concurrency or timeout were adjusted
+        """
+        self.latencies.append(latency)
+        if size and elapsed > 0:
+            self.throughputs.append(size / elapsed)
+        self.finished += 1
+        return self._maybe_adjust()
+
+    def record_error(self, timeout: bool = False) -> bool:
+        """Records a failed request, an error status or an exception
+
+        :returns: whether concurrency or timeout were adjusted
+        """
+        self.errors += 1
+        self.timeouts += int(timeout)
+        self.finished += 1
+        return self._maybe_adjust()
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.finished if self.finished else 0.0
+
+    @property
+    def latency_p50(self) -> Optional[float]:
+        return percentile(self.latencies, 0.5)
+
+    @property
+    def latency_p95(self) -> Optional[float]:
+        return percentile(self.latencies, 0.95)
+
+    @property
+    def bytes_per_second(self) -> Optional[float]:
+        return percentile(self.throughputs, 0.5)
+
+    def _maybe_adjust(self) -> bool:
+        if self.finished < self.window:
+            return False
+
+        p95 = self.latency_p95
+        self.last_window = {"error_rate": round(self.error_rate, 3)}
+        if p95 is not None:
+            self.last_window.update(latency_p50=round(self.latency_p50, 3), latency_p95=round(p95, 3))
+
+        if self.error_rate > self.max_error_rate:
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+        elif p95 is not None and p95 > self.target_latency:
+            self.concurrency = max(self.min_concurrency, self.concurrency - 1)
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+        if self.timeouts:
+            self.timeout = min(self.max_timeout, self.timeout * 2)
+        elif p95 is not None:
+            self.timeout = self._clamp(p95 * self.timeout_factor, self.min_timeout, self.max_timeout)
+
+        self.latencies.clear()
+        self.finished = self.errors = self.timeouts = 0
+        self.adjustments += 1
+        return True
+
+    def media_bytes_per_second(self, min_bytes_per_second: float, slack: float = 4.0) -> float:
+        """Slowest transfer rate a media download from the slot is given before timing out
+
+        min_bytes_per_second, lowered to the slot's median throughput over slack for slots slower than that.
+        """
+        observed = self.bytes_per_second
+        if observed is None:
+            return min_bytes_per_second
+        return min(min_bytes_per_second, observed / slack)
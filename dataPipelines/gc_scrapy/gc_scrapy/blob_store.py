@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.blob_store
+-----------------
+Content addressed file store, each distinct downloaded file is kept once under its sha256 and linked to its doc paths
+"""
+from pathlib import Path
+from typing import Union
+import hashlib
+import shutil
+import os
+
+
+def file_sha256_hex_digest(path: Union[str, Path], chunk_size: int = 2**20) -> str:
+    """sha256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Files by sha256 hex digest at <root>/<first 2 hex chars>/<digest>
+
+    The store is meant to be kept across crawls, a blob that is already in it was downloaded (and uploaded) before.
+    """
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, digest: str) -> Path:
+        return Path(self.root, digest[:2], digest)
+
+    def contains(self, digest: str) -> bool:
+        return self.path_for(digest).is_file()
+
+    def add_file(self, file_path: Union[str, Path], digest: str) -> bool:
+        """Moves a file into the store, the file is removed instead if its blob is already stored
+        :param file_path: file to store, on the same filesystem as the store so it can be renamed into place
+        :param digest: sha256 hex digest of the file
+
+        :returns: whether the blob is new
+        """
+        blob_path = self.path_for(digest)
+        if blob_path.is_file():
+            os.remove(file_path)
+            return False
+
+        blob_path.parent.mkdir(exist_ok=True)
+        try:
+            os.replace(file_path, blob_path)
+        except OSError:
+            # another filesystem, copy to a temp name first so a half written blob is never visible
+            temp_path = blob_path.with_name(f".{digest}.part")
+            shutil.copyfile(file_path, temp_path)
+            os.replace(temp_path, blob_path)
+            os.remove(file_path)
+
+        return True
+
+    def link(self, digest: str, dest: Union[str, Path]) -> None:
+        """Hardlinks a doc path to a stored blob, copies it if the doc path is on another filesystem"""
+        blob_path = self.path_for(digest)
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            os.link(blob_path, dest)
+        except OSError:
+            shutil.copyfile(blob_path, dest)
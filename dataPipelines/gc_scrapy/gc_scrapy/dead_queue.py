@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.dead_queue
+-----------------
+Reads dead_queue.json files back into documents, and the spider downloading them again through FileDownloadPipeline
+"""
+from pathlib import Path
+from typing import Iterable, List, Union
+import json
+import os
+
+from dataPipelines.gc_scrapy.gc_scrapy.GCSpider import GCSpider
+from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
+from dataPipelines.gc_scrapy.gc_scrapy.runspider_settings import general_settings
+
+
+def read_dead_queue(paths: Iterable[Union[str, Path]]) -> List[dict]:
+    """Documents of the rows in the dead queue files, once per crawler and doc_name, later rows winning
+
+    :param paths: dead_queue.json files, in the order they were written, eg oldest crawl first
+    :returns: the documents, in the order they were first seen
+    """
+    documents = {}
+    for path in paths:
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    document = json.loads(line)["document"]
+                    key = (document["crawler_used"], document["doc_name"])
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Skipping malformed dead queue row {path}:{line_number}", e)
+                    continue
+                documents[key] = document
+
+    return list(documents.values())
+
+
+class DeadQueueReplaySpider(GCSpider):
+    """Yields the documents of dead_queue_locations so FileDownloadPipeline downloads them again
+
+    The docs keep the crawler_used of the spider that first scraped them, the manifest rows written are theirs.
+    Docs failing again are written to the dead queue of this crawl.
+    """
+
+    name = "dead_queue_replay"
+    start_urls = ["data:,dead_queue_replay"]
+    # docs from different crawlers may share a doc_name, read_dead_queue already dedupes by crawler and doc_name
+    custom_settings: dict = {
+        **general_settings,
+        "ITEM_PIPELINES": {
+            path: order for path, order in general_settings["ITEM_PIPELINES"].items()
+            if not path.endswith(".DeduplicaterPipeline")
+        },
+    }
+
+    # set from the cli, dead_queue.json files to download the docs of
+    dead_queue_locations: List[str] = []
+    # every doc is downloaded, it failed the last time it was
+    dont_filter_previous_hashes = True
+    previous_manifest_location = os.devnull
+
+    def parse(self, _):
+        for document in read_dead_queue(self.dead_queue_locations):
+            yield DocItem(**document)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.detail_cache
+-----------------
+Persistent cache of what a spider got out of a detail page, keyed by a fingerprint of the listing row that linked to it
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+from hashlib import sha256
+from time import time
+import threading
+import sqlite3
+import json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detail_pages (
+    crawler_used TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    items TEXT NOT NULL,
+    cached_at REAL NOT NULL,
+    PRIMARY KEY (crawler_used, fingerprint)
+);
+"""
+
+
+def listing_row_fingerprint(*listing_row: Any) -> str:
+    """sha256 hex digest of everything a spider knows about a doc before following its detail page
+
+    Sensitive to the value and order of every part, dicts are compared regardless of key order.
+    """
+    serialized = json.dumps(listing_row, sort_keys=True, default=str, ensure_ascii=True)
+    return sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class DetailPageCache:
+    """Items yielded from detail pages, per crawler and listing row fingerprint, in a sqlite file
+
+    An empty list is a valid entry, the detail page was fetched but produced no items.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+    def get(self, crawler_used: str, fingerprint: str, max_age_seconds: Optional[float] = None) -> Optional[List[dict]]:
+        """Cached items for the listing row, or None if missing or older than max_age_seconds"""
+        with self._lock:
+            found = self.connection.execute(
+                "SELECT items, cached_at FROM detail_pages WHERE crawler_used = ? AND fingerprint = ?",
+                (crawler_used, fingerprint),
+            ).fetchone()
+
+        if not found:
+            return None
+
+        items, cached_at = found
+        if max_age_seconds is not None and time() - cached_at > max_age_seconds:
+            return None
+
+        return json.loads(items)
+
+    def put(self, crawler_used: str, fingerprint: str, items: List[dict]) -> None:
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO detail_pages (crawler_used, fingerprint, items, cached_at) VALUES (?, ?, ?, ?)",
+                (crawler_used, fingerprint, json.dumps(items, default=str), time()),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM detail_pages").fetchone()[0]
+
+
+# open caches, keyed by resolved path, so spiders crawling in the same process share a connection
+_open_caches: Dict[Path, DetailPageCache] = {}
+
+
+def get_detail_cache(path: Union[str, Path]) -> DetailPageCache:
+    """Returns the process wide DetailPageCache for the path, opening (and creating) it on first use"""
+    path = Path(path).resolve()
+    if path not in _open_caches:
+        _open_caches[path] = DetailPageCache(path)
+
+    return _open_caches[path]
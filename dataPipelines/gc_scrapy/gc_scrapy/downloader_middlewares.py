@@ -1,14 +1,35 @@
 from random import choice
-from time import sleep
+from time import monotonic, sleep
+from pathlib import Path
+import re
 
 from scrapy import signals
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet.task import deferLater
 from scrapy.exceptions import NotConfigured
-from scrapy.http import HtmlResponse
+from scrapy.http import HtmlResponse, Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.request import request_fingerprint
 from selenium.webdriver.support.ui import WebDriverWait
 from importlib import import_module
+from functools import partial
 
 from dataPipelines.gc_scrapy.gc_scrapy.middleware_utils.selenium_request import SeleniumRequest
+from dataPipelines.gc_scrapy.gc_scrapy.selenium_pool import (
+    SELENIUM_DRIVER_LEASE,
+    get_webdriver_pool,
+    release_webdriver_pool,
+)
 from selenium.common.exceptions import TimeoutException
+from dataPipelines.gc_scrapy.gc_scrapy.response_cache import CachedResponse, get_response_cache
+from dataPipelines.gc_scrapy.gc_scrapy.adaptive_concurrency import MEDIA_DOWNLOAD, SlotController
+from dataPipelines.gc_scrapy.gc_scrapy.streaming_download import (
+    DOWNLOAD_MAX_TIMEOUT,
+    DOWNLOAD_STARTED,
+    MIN_BYTES_PER_SECOND,
+    STREAMED_BYTES,
+)
+from twisted.internet.error import TimeoutError as TxTimeoutError
 
 
 user_agent_list = (
@@ -54,12 +75,23 @@ user_agent_list = (
 
 
 class SeleniumMiddleware:
-    """Scrapy middleware handling the requests using selenium"""
+    """Scrapy middleware handling the requests using selenium
+
+    Pages load on a pool of SELENIUM_DRIVER_POOL_SIZE drivers, in threads so the reactor keeps crawling meanwhile.
+    A driver stays checked out until the callback of its response is done with it, see SeleniumDriverReleaseMiddleware,
+    and is replaced once it loaded SELENIUM_DRIVER_MAX_PAGES pages. Callbacks decorated with
+    GCSeleniumSpider.driver_callback use it from the pool's threads as well.
+
+    The pool goes from spider to spider of the process with the same driver settings, spiders running at the same
+    time get pools of their own, see get_webdriver_pool. With SELENIUM_KEEP_DRIVERS_WARM,
+    set by cli.py crawl, its drivers outlive the spider and go to the next one with cookies and storage cleared.
+    """
     # Shamelessly taken from https://github.com/clemfromspace/scrapy-selenium
 
     def __init__(self, driver_name, driver_executable_path,
-                 browser_executable_path, command_executor, driver_arguments):
-        """Initialize the selenium webdriver
+                 browser_executable_path, command_executor, driver_arguments,
+                 pool_size=1, max_pages=50, stats=None, keep_warm=False):
+        """Initialize the selenium webdriver pool
 
         Parameters
         ----------
@@ -73,6 +105,14 @@ class SeleniumMiddleware:
             The path of the executable binary of the browser
         command_executor: str
             Selenium remote server endpoint
+        pool_size: int
+            The number of drivers loading pages at the same time
+        max_pages: int
+            The number of pages a driver loads before it's replaced, 0 for never
+        stats: StatsCollector
+            The crawler stats to record pool waits and driver page counts in
+        keep_warm: bool
+            Leave the drivers running for the next spider when the spider closes
         """
 
         webdriver_base_path = f'selenium.webdriver.{driver_name}'
@@ -100,13 +140,16 @@ class SeleniumMiddleware:
             f'{driver_name}_options': driver_options
         }
 
-        # locally installed driver
-        if driver_executable_path is not None:
-            driver_kwargs = {
-                'executable_path': driver_executable_path,
-                f'{driver_name}_options': driver_options
-            }
-            self.driver = driver_class(**driver_kwargs)
+        self.stats = stats
+        self.keep_warm = keep_warm
+        pool_key = (
+            driver_name, driver_executable_path, browser_executable_path, tuple(driver_arguments), pool_size, max_pages
+        )
+        self.driver_pool = get_webdriver_pool(
+            pool_key, partial(driver_class, **driver_kwargs), size=pool_size, max_pages=max_pages
+        )
+        # the pool may have served earlier spiders, their counts are taken off this spider's stats
+        self.pool_stats_at_open = self.driver_pool.get_stats()
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -132,7 +175,11 @@ class SeleniumMiddleware:
             driver_executable_path=driver_executable_path,
             browser_executable_path=browser_executable_path,
             command_executor=command_executor,
-            driver_arguments=driver_arguments
+            driver_arguments=driver_arguments,
+            pool_size=crawler.settings.getint('SELENIUM_DRIVER_POOL_SIZE', 1),
+            max_pages=crawler.settings.getint('SELENIUM_DRIVER_MAX_PAGES', 50),
+            stats=crawler.stats,
+            keep_warm=crawler.settings.getbool('SELENIUM_KEEP_DRIVERS_WARM'),
         )
 
         crawler.signals.connect(
@@ -141,12 +188,42 @@ class SeleniumMiddleware:
         return middleware
 
     def process_request(self, request, spider):
-        """Process a request using the selenium driver if applicable"""
+        """Process a request using a pooled selenium driver if applicable"""
         if not isinstance(request, SeleniumRequest):
             return None
 
+        requested = monotonic()
+        d = self.driver_pool.acquire(owner=spider.name)
+        d.addCallback(self.load_page, request, spider, requested)
+        return d
+
+    def load_page(self, lease, request, spider, requested: float):
+        """Loads the page in a pool thread once a driver is checked out"""
+        waited = monotonic() - requested
+        if self.stats:
+            self.stats.inc_value('selenium_pool/requests', spider=spider)
+            self.stats.inc_value('selenium_pool/wait_seconds', waited, spider=spider)
+            self.stats.max_value('selenium_pool/max_wait_seconds', waited, spider=spider)
+
+        request.meta[SELENIUM_DRIVER_LEASE] = lease
+
+        def loaded(response):
+            if response is None:
+                lease.release()  # falls through to the download handler, no callback will use the driver
+            return response
+
+        def failed(failure):
+            lease.release()
+            return failure
+
+        return self.driver_pool.run(self.get_page, lease, request, spider).addCallbacks(loaded, failed)
+
+    @staticmethod
+    def get_page(lease, request, spider):
+        """Blocking page load on the lease's driver, runs in a pool thread"""
+        driver = lease.driver
         for cookie_name, cookie_value in request.cookies.items():
-            self.driver.add_cookie(
+            driver.add_cookie(
                 {
                     'name': cookie_name,
                     'value': cookie_value
@@ -162,8 +239,10 @@ class SeleniumMiddleware:
             reqs_remaining = retries + 1
             while reqs_remaining:
                 try:
-                    self.driver.get(request.url)
-                    WebDriverWait(self.driver, request.wait_time).until(
+                    lease.pages += 1
+                    lease.add_origin(request.url)
+                    driver.get(request.url)
+                    WebDriverWait(driver, request.wait_time).until(
                         request.wait_until
                     )
                     reqs_remaining = 0
@@ -172,47 +251,90 @@ class SeleniumMiddleware:
                     print(
                         f"{spider.name} : Selenium request timeout, retries remaining = {reqs_remaining}")
                     print(f"Waiting {retry_wait} seconds...")
-                    for _ in range(retry_wait):
-                        sleep(1)
+                    sleep(retry_wait)
                 except Exception as e:
                     print(
                         'SeleniumMiddleware.process_request - unexpected exception', e)
                     return
 
         else:
-            self.driver.get(request.url)
+            lease.pages += 1
+            lease.add_origin(request.url)
+            driver.get(request.url)
 
         if request.screenshot:
-            request.meta['screenshot'] = self.driver.get_screenshot_as_png()
+            request.meta['screenshot'] = driver.get_screenshot_as_png()
 
         if request.script:
-            self.driver.execute_script(request.script)
+            driver.execute_script(request.script)
 
-        body = str.encode(self.driver.page_source)
+        body = str.encode(driver.page_source)
+        lease.add_origin(driver.current_url)
 
         # Expose the driver via the "meta" attribute
-        request.meta.update({'driver': self.driver})
+        request.meta.update({'driver': driver})
 
         return HtmlResponse(
-            self.driver.current_url,
+            driver.current_url,
             body=body,
             encoding='utf-8',
             request=request
         )
 
-    def spider_closed(self):
-        """Shutdown the driver when spider is closed"""
+    def spider_closed(self, spider):
+        """Shutdown the drivers when spider is closed, unless they're kept warm for the next spider"""
+        closed = release_webdriver_pool(self.driver_pool, keep_warm=self.keep_warm)
+        if self.stats:
+            for name, value in self.driver_pool.get_stats().items():
+                if not name.endswith('/pages'):
+                    value = round(value - self.pool_stats_at_open.get(name, 0), 3)
+                self.stats.set_value(f'selenium_pool/{name}', value, spider=spider)
+            # time the spider held drivers outside the GCSeleniumSpider waits, see GCSeleniumSpider.record_wait
+            busy = self.stats.get_value('selenium_pool/driver_busy_seconds', 0, spider=spider)
+            waited = self.stats.get_value('selenium_wait/seconds', 0, spider=spider)
+            self.stats.set_value('selenium_wait/work_seconds', round(max(busy - waited, 0), 3), spider=spider)
 
-        self.driver.quit()
+        return closed
 
 
 class BanEvasionMiddleware:
+    """Rotates user agents and, for spiders with randomly_delay_request, spaces out requests to each download slot
+
+    Delays are scheduled per download slot (the domain, unless the request sets download_slot) and waited on with
+    a deferred, so only requests to that slot wait and the reactor keeps serving every other request meanwhile.
+    """
 
-    def __init__(self):
+    def __init__(self, stats=None, clock=None):
         self.stable_agent = choice(user_agent_list)
+        self.stats = stats
+        if clock is None:
+            # imported here so importing this module doesn't install the default reactor
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        # slot key -> reactor time the next delayed request to the slot may go out at
+        self.slot_next_times = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
 
     delays = range(0, 3)
 
+    @staticmethod
+    def get_slot_key(request):
+        # same key scrapy's downloader groups requests into slots with
+        return request.meta.get("download_slot") or urlparse_cached(request).hostname or ""
+
+    def schedule_delay(self, slot_key, delay) -> float:
+        """Reserves the slot's next send time, delay seconds after the previously reserved one
+
+        :returns: seconds to wait before sending
+        """
+        now = self.clock.seconds()
+        send_at = max(now, self.slot_next_times.get(slot_key, now)) + delay
+        self.slot_next_times[slot_key] = send_at
+        return send_at - now
+
     def process_request(self, request, spider):
         if spider.rotate_user_agent:
             agent = choice(user_agent_list)
@@ -223,11 +345,249 @@ class BanEvasionMiddleware:
         dr = spider.randomly_delay_request
         if dr and not request.meta.get("skip_delay"):
             delay_opts = dr if isinstance(dr, (range, list)) else self.delays
-            delay = choice(delay_opts)
-            # print('delay of', delay)
-            # makes sleep more interruptable
-            for _ in range(delay):
-                try:
-                    sleep(1)
-                except KeyboardInterrupt:
-                    exit(0)
+            wait = self.schedule_delay(self.get_slot_key(request), choice(delay_opts))
+            if self.stats:
+                self.stats.inc_value("ban_evasion/delayed_request_count", spider=spider)
+                self.stats.inc_value("ban_evasion/delay_wait_seconds", wait, spider=spider)
+                self.stats.max_value("ban_evasion/max_delay_wait_seconds", wait, spider=spider)
+            if wait > 0:
+                # fires with None, the request then carries on through the rest of the middlewares
+                return deferLater(self.clock, wait, lambda: None)
+
+
+class AdaptiveConcurrencyMiddleware:
+    """Tunes each download slot's concurrency and download timeout to the latency, throughput and errors it shows
+
+    A SlotController per slot (the domain, unless the request sets download_slot) moves concurrency between
+    ADAPTIVE_CONCURRENCY_MIN and ADAPTIVE_CONCURRENCY_MAX (CONCURRENT_REQUESTS_PER_DOMAIN unless set), never over a
+    CONCURRENT_REQUESTS_PER_DOMAIN the spider sets, and the timeout between DOWNLOAD_TIMEOUT (or a higher
+    ADAPTIVE_TIMEOUT_MIN) and ADAPTIVE_TIMEOUT_MAX, starting from DOWNLOAD_TIMEOUT.
+    Sits after RetryMiddleware so it sees the errors retried there, and after DownloadTimeoutMiddleware so its timeouts win.
+    Media downloads get that timeout until their headers arrive, then ADAPTIVE_MEDIA_MIN_BYTES_PER_SECOND
+    (lowered for slots slower than that) for the body, up to ADAPTIVE_MEDIA_TIMEOUT_MAX seconds.
+    The values picked are kept in the adaptive_concurrency/<slot>/* stats.
+    """
+
+    # responses counted as errors, the server is struggling or asking us to back off
+    error_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured("ADAPTIVE_CONCURRENCY_ENABLED is not set")
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        max_concurrency = settings.getint("ADAPTIVE_CONCURRENCY_MAX", settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN"))
+        if settings.getpriority("CONCURRENT_REQUESTS_PER_DOMAIN") > 0:
+            # set by the spider (or the project) to be polite to the site, never go over it
+            max_concurrency = min(max_concurrency, settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN"))
+        # spiders raise DOWNLOAD_TIMEOUT for slow sites, cutting it would time out every request to them
+        min_timeout = max(settings.getfloat("ADAPTIVE_TIMEOUT_MIN", 0.0), settings.getfloat("DOWNLOAD_TIMEOUT", 180))
+        self.controller_kwargs = dict(
+            min_concurrency=settings.getint("ADAPTIVE_CONCURRENCY_MIN", 1),
+            max_concurrency=max_concurrency,
+            min_timeout=min_timeout,
+            max_timeout=max(min_timeout, settings.getfloat("ADAPTIVE_TIMEOUT_MAX", 30.0)),
+            target_latency=settings.getfloat("ADAPTIVE_TARGET_LATENCY", 2.0),
+            max_error_rate=settings.getfloat("ADAPTIVE_MAX_ERROR_RATE", 0.1),
+            window=settings.getint("ADAPTIVE_WINDOW", 20),
+        )
+        self.start_concurrency = settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN", 8)
+        self.start_timeout = settings.getfloat("DOWNLOAD_TIMEOUT", 180)
+        self.media_min_bytes_per_second = settings.getfloat("ADAPTIVE_MEDIA_MIN_BYTES_PER_SECOND", 64 * 2**10)
+        self.media_max_timeout = settings.getfloat("ADAPTIVE_MEDIA_TIMEOUT_MAX", 600.0)
+        # slot key -> SlotController
+        self.controllers = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def get_downloader_slot(self, slot_key):
+        engine = getattr(self.crawler, "engine", None)
+        return engine.downloader.slots.get(slot_key) if engine else None
+
+    def get_controller(self, request) -> SlotController:
+        slot_key = BanEvasionMiddleware.get_slot_key(request)
+        controller = self.controllers.get(slot_key)
+        if controller is None:
+            # the downloader only makes the slot once the request is through the middlewares
+            slot = self.get_downloader_slot(slot_key)
+            concurrency = slot.concurrency if slot else self.start_concurrency
+            controller = SlotController(concurrency, self.start_timeout, **self.controller_kwargs)
+            self.controllers[slot_key] = controller
+        return controller
+
+    def process_request(self, request, spider):
+        # set again by the download handler, a retry or redirect mustn't count the previous attempt's start
+        request.meta.pop(DOWNLOAD_STARTED, None)
+        controller = self.get_controller(request)
+        # replaces the DOWNLOAD_TIMEOUT DownloadTimeoutMiddleware sets, and the timeout of a retried request's last try
+        request.meta["download_timeout"] = controller.timeout
+        if request.meta.get(MEDIA_DOWNLOAD):
+            request.meta[MIN_BYTES_PER_SECOND] = controller.media_bytes_per_second(self.media_min_bytes_per_second)
+            request.meta[DOWNLOAD_MAX_TIMEOUT] = self.media_max_timeout
+        return None
+
+    def process_response(self, request, response, spider):
+        started = request.meta.get(DOWNLOAD_STARTED)
+        if started is None or "cached" in response.flags:
+            # served without going out to the slot, eg from the response cache or selenium
+            return response
+
+        controller = self.get_controller(request)
+        if response.status in self.error_statuses:
+            adjusted = controller.record_error()
+        else:
+            size = request.meta.get(STREAMED_BYTES) or len(response.body)
+            latency = request.meta.get("download_latency", 0.0)
+            adjusted = controller.record_response(latency, size, monotonic() - started)
+        if adjusted:
+            self.apply(request, controller, spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if request.meta.get(DOWNLOAD_STARTED) is None:
+            return None
+
+        controller = self.get_controller(request)
+        if controller.record_error(timeout=isinstance(exception, TxTimeoutError)):
+            self.apply(request, controller, spider)
+        return None
+
+    def apply(self, request, controller: SlotController, spider) -> None:
+        slot_key = BanEvasionMiddleware.get_slot_key(request)
+        slot = self.get_downloader_slot(slot_key)
+        if slot is not None:
+            slot.concurrency = controller.concurrency
+
+        prefix = f"adaptive_concurrency/{slot_key}"
+        self.stats.inc_value("adaptive_concurrency/adjustments", spider=spider)
+        self.stats.set_value(f"{prefix}/concurrency", controller.concurrency, spider=spider)
+        self.stats.set_value(f"{prefix}/timeout", round(controller.timeout, 3), spider=spider)
+        self.stats.max_value(f"{prefix}/max_concurrency", controller.concurrency, spider=spider)
+        self.stats.min_value(f"{prefix}/min_concurrency", controller.concurrency, spider=spider)
+        for name, value in controller.last_window.items():
+            self.stats.set_value(f"{prefix}/{name}", value, spider=spider)
+        if controller.bytes_per_second is not None:
+            self.stats.set_value(f"{prefix}/bytes_per_second", round(controller.bytes_per_second), spider=spider)
+            self.stats.set_value(
+                f"{prefix}/media_min_bytes_per_second",
+                round(controller.media_bytes_per_second(self.media_min_bytes_per_second)),
+                spider=spider,
+            )
+
+
+class ResponseCacheMiddleware:
+    """Caches responses across crawls for the urls matched by the spider's http_cache_freshness
+
+    Responses younger than the matched freshness are served from the cache without touching the network,
+    older ones are revalidated with If-None-Match / If-Modified-Since and served from the cache on a 304.
+    Sits before HttpCompressionMiddleware so bodies are stored decoded and hits skip decompression.
+    """
+
+    # dropped from stored headers, the stored body is already decoded
+    skip_headers = (b"Content-Encoding", b"Content-Length", b"Transfer-Encoding")
+
+    def __init__(self, cache, stats):
+        self.cache = cache
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        cache_dir = crawler.settings.get("RESPONSE_CACHE_DIR")
+        if not cache_dir:
+            raise NotConfigured("RESPONSE_CACHE_DIR is not set")
+
+        cache = get_response_cache(
+            Path(cache_dir, "responses.db"),
+            max_bytes=crawler.settings.getint("RESPONSE_CACHE_MAX_BYTES", 2**30),
+            compression_level=crawler.settings.getint("RESPONSE_CACHE_COMPRESSION_LEVEL", 6),
+        )
+        return cls(cache, crawler.stats)
+
+    @staticmethod
+    def get_freshness(request, spider):
+        """Seconds a cached response for the request stays fresh, None if the request shouldn't be cached"""
+        for pattern, seconds in getattr(spider, "http_cache_freshness", ()):
+            if re.search(pattern, request.url):
+                return seconds
+        return None
+
+    def process_request(self, request, spider):
+        # redirects copy meta, the redirected request is looked up on its own
+        request.meta.pop("response_cache_fingerprint", None)
+        request.meta.pop("response_cache_stale", None)
+
+        if request.method != "GET" or request.meta.get("dont_cache"):
+            return None
+
+        freshness = self.get_freshness(request, spider)
+        if freshness is None:
+            return None
+
+        fingerprint = request_fingerprint(request)
+        request.meta["response_cache_fingerprint"] = fingerprint
+        request.meta["response_cache_freshness"] = freshness
+        cached = self.cache.get(fingerprint)
+        if cached is None:
+            self.stats.inc_value("response_cache/miss", spider=spider)
+            return None
+
+        if cached.age <= freshness:
+            self.stats.inc_value("response_cache/hit", spider=spider)
+            return self.to_response(cached, request)
+
+        etag = cached.header("ETag")
+        last_modified = cached.header("Last-Modified")
+        if etag:
+            request.headers["If-None-Match"] = etag
+        if last_modified:
+            request.headers["If-Modified-Since"] = last_modified
+        if etag or last_modified:
+            request.meta["response_cache_stale"] = cached
+            self.stats.inc_value("response_cache/revalidate", spider=spider)
+        else:
+            self.stats.inc_value("response_cache/expired", spider=spider)
+
+        return None
+
+    def process_response(self, request, response, spider):
+        fingerprint = request.meta.get("response_cache_fingerprint")
+        if not fingerprint or "cached" in response.flags:
+            return response
+
+        stale = request.meta.pop("response_cache_stale", None)
+        if response.status == 304 and stale:
+            self.stats.inc_value("response_cache/revalidated", spider=spider)
+            self.cache.touch(fingerprint)
+            return self.to_response(stale, request)
+
+        has_validators = b"ETag" in response.headers or b"Last-Modified" in response.headers
+        if response.status == 200 and (has_validators or request.meta.get("response_cache_freshness")):
+            headers = {
+                key.decode("latin-1"): [value.decode("latin-1") for value in values]
+                for key, values in response.headers.items()
+                if key not in self.skip_headers
+            }
+            evicted = self.cache.evicted
+            self.cache.put(fingerprint, response.url, response.status, headers, response.body)
+            self.stats.inc_value("response_cache/store", spider=spider)
+            if self.cache.evicted > evicted:
+                self.stats.inc_value("response_cache/evicted", self.cache.evicted - evicted, spider=spider)
+
+        return response
+
+    @staticmethod
+    def to_response(cached: CachedResponse, request):
+        headers = Headers(cached.headers)
+        response_class = responsetypes.from_args(headers=headers, url=cached.url, body=cached.body)
+        return response_class(
+            url=cached.url,
+            status=cached.status,
+            headers=headers,
+            body=cached.body,
+            flags=["cached"],
+            request=request,
+        )
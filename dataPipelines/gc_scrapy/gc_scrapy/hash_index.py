@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.hash_index
+-----------------
+Compact, memory mapped index of version hashes
+"""
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Optional, Union
+from hashlib import sha256
+
+# numpy isn't a dependency of the crawlers, it's only needed with --hash-index-dir and imported where it's used
+if TYPE_CHECKING:
+    import numpy as np
+
+DIGEST_SIZE = 32
+DIGEST_DTYPE = f"S{DIGEST_SIZE}"
+
+
+def version_hash_to_digest(version_hash: str) -> bytes:
+    """Converts a sha256 hex version hash to its raw 32 byte digest
+    anything that isn't a sha256 hex digest is hashed so it still gets a stable 32 byte key
+    """
+    if len(version_hash) == DIGEST_SIZE * 2:
+        try:
+            return bytes.fromhex(version_hash)
+        except ValueError:
+            pass
+
+    return sha256(version_hash.encode("utf-8")).digest()
+
+
+class BloomFilter:
+    """Bit array bloom filter over raw sha256 digests
+
+    Digests are already uniformly distributed so bit positions come straight from their bytes (double hashing)
+    """
+
+    def __init__(self, bits: bytes, hash_count: int):
+        self.bits = bits
+        self.bit_count = len(bits) * 8
+        self.hash_count = hash_count
+
+    @classmethod
+    def create(cls, digests: "np.ndarray", bits_per_entry: int = 10, hash_count: int = 7) -> "BloomFilter":
+        import numpy as np
+
+        bit_count = max(64, len(digests) * bits_per_entry)
+        bits = np.zeros((bit_count + 7) // 8, dtype=np.uint8)
+        bit_count = len(bits) * 8
+
+        # vectorized over all digests at once, one hash function at a time
+        words = np.frombuffer(digests.tobytes(), dtype="<u8").reshape(-1, DIGEST_SIZE // 8)
+        h1, h2 = words[:, 0], words[:, 1] | np.uint64(1)
+        for i in range(hash_count):
+            positions = (h1 + np.uint64(i) * h2) % np.uint64(bit_count)
+            masks = np.left_shift(np.uint64(1), positions & np.uint64(7)).astype(np.uint8)
+            np.bitwise_or.at(bits, (positions >> np.uint64(3)).astype(np.intp), masks)
+
+        # plain bytes index much faster than numpy scalars for single lookups
+        return cls(bits.tobytes(), hash_count)
+
+    def _positions(self, digest: bytes):
+        h1 = int.from_bytes(digest[0:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % 2**64 % self.bit_count
+
+    def might_contain(self, digest: bytes) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(digest))
+
+
+class VersionHashIndex:
+    """Sorted array of raw sha256 digests stored in a memory mapped file and searched with binary search
+
+    Takes 32 bytes per hash on disk, resident memory is only the pages the OS keeps cached.
+    An optional bloom filter, kept in memory, answers most misses without touching the index file.
+    """
+
+    def __init__(self, index_path: Union[str, Path], bloom: Optional[BloomFilter] = None):
+        import numpy as np
+
+        self.index_path = Path(index_path)
+        self.bloom = bloom
+
+        if self.index_path.stat().st_size:
+            self.digests = np.memmap(self.index_path, dtype=DIGEST_DTYPE, mode="r")
+        else:
+            # can't mmap an empty file
+            self.digests = np.empty(0, dtype=DIGEST_DTYPE)
+
+    @classmethod
+    def build(cls, digests: Union[bytes, bytearray], index_path: Union[str, Path], use_bloom: bool = False) -> "VersionHashIndex":
+        """Sorts, dedupes and writes raw digests to the index file
+        :param digests: concatenated raw 32 byte digests
+        :param index_path: file to write the index to, overwritten if it exists
+        :param use_bloom: whether to put a bloom filter in front of the index
+
+        :returns: VersionHashIndex for the written file
+        """
+        if len(digests) % DIGEST_SIZE:
+            raise ValueError(f"digests length should be a multiple of {DIGEST_SIZE}")
+
+        import numpy as np
+
+        sorted_digests = np.unique(np.frombuffer(digests, dtype=DIGEST_DTYPE))
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+        sorted_digests.tofile(index_path)
+
+        bloom = BloomFilter.create(sorted_digests) if use_bloom else None
+        return cls(index_path, bloom)
+
+    @classmethod
+    def from_version_hashes(cls, version_hashes: Iterable[str], index_path: Union[str, Path], use_bloom: bool = False) -> "VersionHashIndex":
+        digests = bytearray()
+        for version_hash in version_hashes:
+            digests += version_hash_to_digest(version_hash)
+
+        return cls.build(digests, index_path, use_bloom)
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+    def __contains__(self, version_hash: str) -> bool:
+        return self.contains_digest(version_hash_to_digest(version_hash))
+
+    def contains_digest(self, digest: bytes) -> bool:
+        if self.bloom and not self.bloom.might_contain(digest):
+            return False
+
+        i = int(self.digests.searchsorted(digest))
+        # items of numpy S arrays come back with trailing null bytes dropped
+        return i < len(self.digests) and self.digests[i] == digest.rstrip(b"\x00")
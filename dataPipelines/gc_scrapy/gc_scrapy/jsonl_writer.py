@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.jsonl_writer
+-----------------
+Long lived, buffered jsonlines writers for manifest.json and dead_queue.json, shared by every pipeline writing a path
+"""
+from pathlib import Path
+from typing import Dict, Optional, TextIO, Union
+from time import monotonic
+import threading
+import atexit
+import signal
+import json
+import os
+
+# when rows are fsynced to disk, on top of being flushed to the os
+FSYNC_NEVER = "never"
+FSYNC_FLUSH = "flush"
+FSYNC_CLOSE = "close"
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_FLUSH, FSYNC_CLOSE)
+
+
+class JsonLinesWriter:
+    """Appends rows to a jsonlines file through one open, buffered file object
+
+    Rows are flushed once flush_rows rows or flush_seconds seconds have built up since the last flush, and on close.
+    The file is only opened (and created) by the first row, like the per row appends it replaces.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        flush_rows: int = 1000,
+        flush_seconds: float = 5,
+        fsync: str = FSYNC_CLOSE,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, got {fsync!r}")
+
+        self.path = Path(path)
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        # pipelines write from pool threads, one lock serializes use of the file
+        self._lock = threading.Lock()
+        self._file: Optional[TextIO] = None
+        self._closed = False
+        self._pending = 0
+        self._last_flush = monotonic()
+        # number of pipelines using the writer, see get_jsonl_writer and release_jsonl_writer
+        self._users = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def write(self, row: dict) -> int:
+        """Appends a row, flushing if one is due
+
+        :returns: number of bytes written
+        """
+        line = json.dumps(row) + "\n"
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"write to closed JsonLinesWriter for {self.path}")
+            if self._file is None:
+                self._file = open(self.path, "a", buffering=2**16)
+
+            self._file.write(line)
+            self._pending += 1
+            if self._pending >= self.flush_rows or monotonic() - self._last_flush >= self.flush_seconds:
+                self._flush()
+
+        return len(line)
+
+    def flush(self, blocking: bool = True) -> bool:
+        """Flushes buffered rows
+
+        :param blocking: if False, gives up rather than wait for a write in progress, eg from a signal handler
+        :returns: whether the rows were flushed
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        try:
+            if self._pending:
+                self._flush()
+            return True
+        finally:
+            self._lock.release()
+
+    def flush_if_due(self) -> None:
+        """Flushes rows that have waited flush_seconds, for a periodic call while no rows are written"""
+        with self._lock:
+            if self._pending and monotonic() - self._last_flush >= self.flush_seconds:
+                self._flush()
+
+    def _flush(self) -> None:
+        # called holding the lock
+        self._file.flush()
+        if self.fsync == FSYNC_FLUSH:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_flush = monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            if self._file is None:
+                return
+
+            self._file.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+
+# open writers, keyed by resolved path, so spiders crawling in the same process append through one file object
+_open_writers: Dict[Path, JsonLinesWriter] = {}
+_open_writers_lock = threading.Lock()
+
+
+def get_jsonl_writer(
+    path: Union[str, Path], flush_rows: int = 1000, flush_seconds: float = 5, fsync: str = FSYNC_CLOSE
+) -> JsonLinesWriter:
+    """Returns the process wide JsonLinesWriter for the path, opening it on first use
+
+    Every call must be paired with a release_jsonl_writer, the file is closed once the last user releases it.
+    """
+    path = Path(path).resolve()
+    with _open_writers_lock:
+        if path not in _open_writers:
+            _open_writers[path] = JsonLinesWriter(path, flush_rows, flush_seconds, fsync)
+            _flush_on_sigterm()
+
+        writer = _open_writers[path]
+        writer._users += 1
+        return writer
+
+
+def release_jsonl_writer(writer: JsonLinesWriter) -> None:
+    """Releases a writer from get_jsonl_writer, closing it if no one else uses it"""
+    with _open_writers_lock:
+        writer._users -= 1
+        if writer._users > 0:
+            return
+
+        _open_writers.pop(writer.path, None)
+    writer.close()
+
+
+def flush_jsonl_writers(blocking: bool = True) -> None:
+    # copying the values is atomic, no lock so a signal handler can't deadlock on one its thread holds
+    for writer in list(_open_writers.values()):
+        writer.flush(blocking)
+
+
+_sigterm_handler_installed = False
+
+
+def _flush_on_sigterm() -> None:
+    """Flushes every writer on SIGTERM before the previous handler runs, eg scrapy's graceful shutdown or the default exit"""
+    global _sigterm_handler_installed
+    if _sigterm_handler_installed or threading.current_thread() is not threading.main_thread():
+        return
+
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handler(signum, frame):
+        # the interrupted thread may be mid write, its writer is then flushed by whoever closes it
+        flush_jsonl_writers(blocking=False)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, handler)
+    _sigterm_handler_installed = True
+
+
+@atexit.register
+def close_jsonl_writers() -> None:
+    """Closes every open writer, rows buffered when the process exits without closing its spiders are kept"""
+    with _open_writers_lock:
+        writers = list(_open_writers.values())
+        _open_writers.clear()
+
+    for writer in writers:
+        writer.close()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.manifest
+-----------------
+Previous manifest loading, shared by every pipeline in the process
+"""
+from pathlib import Path
+from typing import Collection, Dict, Optional, Tuple, Union
+from collections import defaultdict
+from time import perf_counter
+import threading
+import resource
+import tempfile
+import sqlite3
+import atexit
+import json
+import os
+
+from .hash_index import VersionHashIndex, version_hash_to_digest
+from .manifest_store import VALIDATOR_FIELDS, ManifestStore, get_manifest_store, get_row_validators, is_manifest_store
+
+
+class ValidatorIndex:
+    """(crawler_used, doc_name) -> validators in a sqlite file, so the manifest's validators don't grow the process
+
+    Without a path the file is a temp file, removed on close or at exit. Writes are batched and committed by commit,
+    once the manifest is read. sqlite's page cache, at most CACHE_KIB, is all of it that is held in memory.
+    """
+
+    CACHE_KIB = 8 * 1024
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, batch_size: int = 10_000):
+        self.temporary = path is None
+        if self.temporary:
+            fd, path = tempfile.mkstemp(prefix="gc_validators_", suffix=".db")
+            os.close(fd)
+            atexit.register(self.close)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # rebuilt from the manifest on every load
+        self.path.unlink(missing_ok=True)
+        self._lock = threading.Lock()
+        # key -> validators row, or None to delete, written batch_size at a time with executemany
+        self._pending: Dict[Tuple[str, str], Optional[tuple]] = {}
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute(f"PRAGMA cache_size=-{self.CACHE_KIB}")
+        # no crawler is stored as '', NULLs are never equal in a primary key
+        self.connection.execute(
+            f"CREATE TABLE validators (crawler_used TEXT, doc_name TEXT, {', '.join(VALIDATOR_FIELDS)}, "
+            "PRIMARY KEY (crawler_used, doc_name)) WITHOUT ROWID"
+        )
+
+    def __setitem__(self, key: Tuple[Optional[str], str], validators: dict) -> None:
+        crawler_used, doc_name = key
+        with self._lock:
+            self._pending[(crawler_used or "", doc_name)] = tuple(map(validators.get, VALIDATOR_FIELDS))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def get(self, key: Tuple[Optional[str], str], default=None) -> Optional[dict]:
+        crawler_used, doc_name = key
+        with self._lock:
+            self._flush()
+            found = self.connection.execute(
+                f"SELECT {', '.join(VALIDATOR_FIELDS)} FROM validators WHERE crawler_used = ? AND doc_name = ?",
+                (crawler_used or "", doc_name),
+            ).fetchone()
+        return dict(zip(VALIDATOR_FIELDS, found)) if found else default
+
+    def discard(self, key: Tuple[Optional[str], str]) -> None:
+        crawler_used, doc_name = key
+        with self._lock:
+            self._pending[(crawler_used or "", doc_name)] = None
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO validators VALUES (?, ?{', ?' * len(VALIDATOR_FIELDS)})",
+            (key + row for key, row in self._pending.items() if row is not None),
+        )
+        self.connection.executemany(
+            "DELETE FROM validators WHERE crawler_used = ? AND doc_name = ?",
+            (key for key, row in self._pending.items() if row is None),
+        )
+        self._pending.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._flush()
+            return self.connection.execute("SELECT COUNT(*) FROM validators").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        return self.path.stat().st_size if self.path.exists() else 0
+
+    def commit(self) -> None:
+        with self._lock:
+            self._flush()
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+        if self.temporary:
+            self.path.unlink(missing_ok=True)
+
+
+class PreviousManifest:
+    """Version hashes from a previous (cumulative) manifest, indexed by the crawler that produced them
+
+    Old manifest rows have no crawler_used, their hashes are filtered for every crawler.
+    Hashes are kept in python sets, or with an index_dir, in a memory mapped VersionHashIndex per crawler.
+    The validators of the latest row per doc are kept for conditional GETs in a ValidatorIndex file, in the index_dir
+    if there is one, a temp file otherwise.
+    """
+
+    def __init__(self, validators_path: Optional[Union[str, Path]] = None):
+        self.hashes_by_crawler: Dict[Optional[str], Collection[str]] = defaultdict(set)
+        self.validators_by_doc = ValidatorIndex(validators_path)
+        self.line_count = 0
+        self.load_seconds = 0.0
+        self.memory_bytes = 0
+
+    @classmethod
+    def load(
+        cls, manifest_path: Union[str, Path], index_dir: Optional[Union[str, Path]] = None, use_bloom: bool = False
+    ) -> "PreviousManifest":
+        """Streams the manifest jsonlines file once
+        :param manifest_path: path to previous manifest
+        :param index_dir: if given, build compact hash index files here instead of holding hashes in sets
+        :param use_bloom: put a bloom filter in front of each hash index
+
+        :returns: loaded PreviousManifest
+        """
+        manifest = cls(Path(index_dir, "validators.db") if index_dir else None)
+        start = perf_counter()
+        start_rss = _max_rss_bytes()
+        # raw 32 byte digests per crawler, only used when building hash index files
+        digests_by_crawler: Dict[Optional[str], bytearray] = defaultdict(bytearray)
+
+        print("Reading in previous manifest", manifest_path)
+        with Path(manifest_path).open(mode="r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                manifest.line_count += 1
+                if manifest.line_count % 100_000 == 0:
+                    print(f"{manifest.line_count} lines read in")
+
+                jdoc = json.loads(line)
+                manifest.set_validators(jdoc)
+                if index_dir:
+                    digests_by_crawler[jdoc.get("crawler_used") or None] += version_hash_to_digest(jdoc["version_hash"])
+                else:
+                    manifest.add(jdoc.get("crawler_used"), jdoc["version_hash"])
+
+        manifest.validators_by_doc.commit()
+
+        for crawler_used in list(digests_by_crawler):
+            index_path = Path(index_dir, f"{crawler_used or '_no_crawler'}.idx")
+            # pop so each crawler's raw digests can be freed as soon as its index is written
+            digests = digests_by_crawler.pop(crawler_used)
+            manifest.hashes_by_crawler[crawler_used] = VersionHashIndex.build(digests, index_path, use_bloom)
+
+        manifest.load_seconds = perf_counter() - start
+        manifest.memory_bytes = _max_rss_bytes() - start_rss
+        print(
+            f"Previous manifest loaded, {manifest.line_count} lines, {manifest.hash_count} hashes "
+            f"for {len(manifest.hashes_by_crawler)} crawlers in {manifest.load_seconds:.2f}s "
+            f"using ~{manifest.memory_bytes / 2**20:.1f} MiB, validators of {len(manifest.validators_by_doc)} docs "
+            f"in {manifest.validators_by_doc.size_bytes / 2**20:.1f} MiB on disk "
+            f"(up to {ValidatorIndex.CACHE_KIB / 1024:.0f} MiB of it cached in memory)"
+        )
+
+        return manifest
+
+    @property
+    def hash_count(self) -> int:
+        return sum(len(hashes) for hashes in self.hashes_by_crawler.values())
+
+    def add(self, crawler_used: Optional[str], version_hash: str) -> None:
+        self.hashes_by_crawler[crawler_used or None].add(version_hash)
+
+    def set_validators(self, row: dict) -> None:
+        """Keeps the validators of the row's doc, later rows replace earlier ones"""
+        if not row.get("doc_name"):
+            return
+
+        key = (row.get("crawler_used") or None, row["doc_name"])
+        validators = get_row_validators(row)
+        if validators:
+            self.validators_by_doc[key] = validators
+        else:
+            self.validators_by_doc.discard(key)
+
+    def validators_for(self, crawler_used: str, doc_name: str) -> Optional[dict]:
+        """Validators from the latest previous download of the doc, see manifest_store.VALIDATOR_FIELDS
+
+        Like contains, docs from rows without a crawler_used are found for every crawler
+        """
+        for key in (crawler_used, None):
+            validators = self.validators_by_doc.get((key, doc_name))
+            if validators:
+                return validators
+
+        return None
+
+    def contains(self, crawler_used: str, version_hash: str) -> bool:
+        """Whether the version hash was in the previous manifest for the crawler, or for no crawler in particular"""
+        for key in (crawler_used, None):
+            hashes = self.hashes_by_crawler.get(key)
+            if hashes and version_hash in hashes:
+                return True
+
+        return False
+
+    def count_for(self, crawler_used: str) -> int:
+        """Number of hashes that will be filtered for the crawler"""
+        return sum(len(self.hashes_by_crawler.get(key, ())) for key in (crawler_used, None))
+
+
+# loaded manifests, keyed by resolved path, so a cli run with many spiders reads each file once
+_loaded_manifests: Dict[Path, PreviousManifest] = {}
+
+
+def get_previous_manifest(
+    manifest_path: Union[str, Path], index_dir: Optional[Union[str, Path]] = None, use_bloom: bool = False
+) -> Union[PreviousManifest, ManifestStore]:
+    """Returns the process wide PreviousManifest for the path, loading it on first use
+    sqlite manifest stores (.db, .sqlite) are queried in place instead of being loaded
+    :param manifest_path: path to previous manifest
+    :param index_dir: see PreviousManifest.load, only used on first load
+    :param use_bloom: see PreviousManifest.load, only used on first load
+
+    :returns: loaded PreviousManifest or ManifestStore
+    """
+    if is_manifest_store(manifest_path):
+        return get_manifest_store(manifest_path)
+
+    path = Path(manifest_path).resolve()
+    if path not in _loaded_manifests:
+        _loaded_manifests[path] = PreviousManifest.load(path, index_dir, use_bloom)
+
+    return _loaded_manifests[path]
+
+
+def _max_rss_bytes() -> int:
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
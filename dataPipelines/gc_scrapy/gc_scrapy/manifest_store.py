@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.manifest_store
+-----------------
+Indexed SQLite manifest store, replaces the ever growing cumulative manifest jsonlines file
+"""
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+import threading
+import sqlite3
+import json
+
+# manifest.json fields that get their own column, anything else in a row is kept in extra
+MANIFEST_FIELDS = ("version_hash", "doc_name", "crawler_used", "access_timestamp")
+STORE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+# manifest row fields recording the http validators of a downloaded file, for conditional GETs next crawl
+VALIDATOR_FIELDS = ("download_url", "etag", "last_modified", "content_length")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    version_hash TEXT NOT NULL,
+    doc_name TEXT,
+    crawler_used TEXT,
+    access_timestamp TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS manifest_crawler_version_hash ON manifest (crawler_used, version_hash);
+CREATE INDEX IF NOT EXISTS manifest_crawler_doc_name ON manifest (crawler_used, doc_name);
+"""
+
+
+def get_row_validators(row: dict) -> Optional[dict]:
+    """The validator fields of a manifest row, or None if it has nothing a server can revalidate against"""
+    if not (row.get("etag") or row.get("last_modified")):
+        return None
+    return {field: row.get(field) for field in VALIDATOR_FIELDS}
+
+
+def is_manifest_store(path: Union[str, Path]) -> bool:
+    """Whether a manifest location points at a sqlite store rather than a jsonlines file"""
+    return Path(path).suffix.lower() in STORE_SUFFIXES
+
+
+class ManifestStore:
+    """Append only manifest rows in sqlite, indexed on (crawler_used, version_hash) and (crawler_used, doc_name)
+
+    Answers the same contains/count_for queries as manifest.PreviousManifest, so it can be used to filter previous hashes.
+    Rows without crawler_used are stored with a NULL crawler and filtered for every crawler.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # pipelines may write from threads other than the reactor's, one lock serializes use of the connection
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False)
+        # WAL lets worker processes insert while others read, and makes per row commits cheap
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+    @staticmethod
+    def _to_params(row: dict) -> tuple:
+        extra = {k: v for k, v in row.items() if k not in MANIFEST_FIELDS}
+        return (
+            row["version_hash"],
+            row.get("doc_name"),
+            row.get("crawler_used") or None,
+            row.get("access_timestamp"),
+            json.dumps(extra) if extra else None,
+        )
+
+    def add(self, row: dict) -> None:
+        """Appends one manifest row"""
+        self.add_many([row])
+
+    def add_many(self, rows: Iterable[dict]) -> int:
+        """Appends manifest rows in one transaction
+        :param rows: manifest rows, need at least version_hash
+
+        :returns: number of rows inserted
+        """
+        with self._lock, self.connection:
+            cursor = self.connection.executemany(
+                "INSERT INTO manifest (version_hash, doc_name, crawler_used, access_timestamp, extra) VALUES (?, ?, ?, ?, ?)",
+                (self._to_params(row) for row in rows),
+            )
+            return cursor.rowcount
+
+    def contains(self, crawler_used: str, version_hash: str) -> bool:
+        """Whether the version hash is stored for the crawler, or for no crawler in particular"""
+        with self._lock:
+            cursor = self.connection.execute(
+                "SELECT EXISTS (SELECT 1 FROM manifest WHERE crawler_used = ? AND version_hash = ?) "
+                "OR EXISTS (SELECT 1 FROM manifest WHERE crawler_used IS NULL AND version_hash = ?)",
+                (crawler_used, version_hash, version_hash),
+            )
+            return bool(cursor.fetchone()[0])
+
+    def count_for(self, crawler_used: str) -> int:
+        """Number of hashes that will be filtered for the crawler"""
+        with self._lock:
+            cursor = self.connection.execute(
+                "SELECT (SELECT COUNT(*) FROM manifest WHERE crawler_used = ?) "
+                "+ (SELECT COUNT(*) FROM manifest WHERE crawler_used IS NULL)",
+                (crawler_used,),
+            )
+            return cursor.fetchone()[0]
+
+    def latest_for_doc(self, crawler_used: Optional[str], doc_name: str) -> Optional[dict]:
+        """Most recently added row for a doc, or None"""
+        with self._lock:
+            cursor = self.connection.execute(
+                "SELECT version_hash, doc_name, crawler_used, access_timestamp, extra FROM manifest "
+                "WHERE crawler_used IS ? AND doc_name = ? ORDER BY id DESC LIMIT 1",
+                (crawler_used or None, doc_name),
+            )
+            found = cursor.fetchone()
+
+        return self._to_row(found) if found else None
+
+    def validators_for(self, crawler_used: str, doc_name: str) -> Optional[dict]:
+        """Validators from the latest row of the doc, see VALIDATOR_FIELDS, or of rows without a crawler"""
+        for crawler in (crawler_used, None):
+            row = self.latest_for_doc(crawler, doc_name)
+            validators = get_row_validators(row) if row else None
+            if validators:
+                return validators
+
+        return None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM manifest").fetchone()[0]
+
+    @staticmethod
+    def _to_row(values: tuple) -> dict:
+        # columns a row didn't have are NULL, left out so rows export the way they were imported
+        row = {field: value for field, value in zip(MANIFEST_FIELDS, values) if value is not None}
+        extra = values[len(MANIFEST_FIELDS)]
+        if extra:
+            row.update(json.loads(extra))
+
+        return row
+
+    def compact(self) -> int:
+        """Keeps only the latest row per (crawler_used, doc_name), rows without a doc_name are left alone
+
+        :returns: number of rows removed
+        """
+        with self._lock:
+            with self.connection:
+                cursor = self.connection.execute(
+                    "DELETE FROM manifest WHERE doc_name IS NOT NULL AND id NOT IN "
+                    "(SELECT MAX(id) FROM manifest WHERE doc_name IS NOT NULL GROUP BY crawler_used, doc_name)"
+                )
+                removed = cursor.rowcount
+            # give the freed pages back, otherwise the file never shrinks
+            self.connection.execute("VACUUM")
+
+        return removed
+
+    def import_jsonl(self, jsonl_path: Union[str, Path], batch_size: int = 10_000) -> int:
+        """Appends the rows of a manifest jsonlines file, in file order
+        :param jsonl_path: manifest.json or cumulative-manifest.json
+        :param batch_size: rows inserted per transaction
+
+        :returns: number of rows imported
+        """
+        imported = 0
+        batch = []
+        with Path(jsonl_path).open(mode="r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    imported += self.add_many(batch)
+                    batch = []
+
+        if batch:
+            imported += self.add_many(batch)
+
+        return imported
+
+    def export_jsonl(self, jsonl_path: Union[str, Path]) -> int:
+        """Writes every row, in insertion order, in the manifest jsonlines format
+        :param jsonl_path: file to write, overwritten if it exists
+
+        :returns: number of rows exported
+        """
+        exported = 0
+        with self._lock, Path(jsonl_path).open(mode="w") as f:
+            cursor = self.connection.execute(
+                "SELECT version_hash, doc_name, crawler_used, access_timestamp, extra FROM manifest ORDER BY id"
+            )
+            for values in cursor:
+                row = self._to_row(values)
+                f.write(json.dumps(row))
+                f.write("\n")
+                exported += 1
+
+        return exported
+
+
+# open stores, keyed by resolved path, so spiders crawling in the same process share a connection
+_open_stores: Dict[Path, ManifestStore] = {}
+
+
+def get_manifest_store(path: Union[str, Path]) -> ManifestStore:
+    """Returns the process wide ManifestStore for the path, opening (and creating) it on first use"""
+    path = Path(path).resolve()
+    if path not in _open_stores:
+        _open_stores[path] = ManifestStore(path)
+
+    return _open_stores[path]
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.metadata_bundle
+-----------------
+Gzip compressed jsonlines bundles of document metadata with an offset index, instead of a .metadata file per document
+"""
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional, TextIO, Tuple, Union
+from time import monotonic
+import gzip
+import json
+import threading
+
+# where FileDownloadPipeline writes document metadata, see METADATA_SINK
+METADATA_SINK_SIDECAR = "sidecar"
+METADATA_SINK_BUNDLE = "bundle"
+METADATA_SINK_BOTH = "both"
+METADATA_SINKS = (METADATA_SINK_SIDECAR, METADATA_SINK_BUNDLE, METADATA_SINK_BOTH)
+
+
+class MetadataBundleWriter:
+    """Appends metadata rows to <directory>/<name>-<n>.jsonl.gz bundles, indexed by doc_name in <directory>/<name>.index.jsonl
+
+    Rows are compressed block_rows (or flush_seconds worth) at a time into one gzip member each, a bundle is an ordinary
+    multi member gzip file (zcat, gzip.open) and a single row is read back by decompressing only its member.
+    Index rows are {"doc_name", "metadata_name", "bundle", "offset", "length", "line"}: the sidecar path the row stands
+    in for, the bundle's file name, the byte offset and length of the member and the row's line in it.
+    Once a bundle reaches max_bundle_bytes the next one is started and on_bundle_finished is called with its path.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        name: str,
+        block_rows: int = 500,
+        flush_seconds: float = 5,
+        max_bundle_bytes: int = 256 * 2**20,
+        compresslevel: int = 6,
+        on_bundle_finished: Optional[Callable[[Path], None]] = None,
+    ):
+        self.directory = Path(directory)
+        self.name = name
+        self.block_rows = block_rows
+        self.flush_seconds = flush_seconds
+        self.max_bundle_bytes = max_bundle_bytes
+        self.compresslevel = compresslevel
+        self.on_bundle_finished = on_bundle_finished
+        self.index_path = Path(self.directory, f"{name}.index.jsonl")
+        # pipelines write from pool threads, one lock serializes the buffered rows and both files
+        self._lock = threading.Lock()
+        # (doc_name, metadata_name, json line) not compressed yet
+        self._rows: List[Tuple[str, str, bytes]] = []
+        self._bundle_number = 0
+        self._bundle: Optional[BinaryIO] = None
+        self._index: Optional[TextIO] = None
+        self._last_flush = monotonic()
+        self._closed = False
+
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.bundles_written = 0
+
+    @property
+    def bundle_path(self) -> Path:
+        return Path(self.directory, f"{self.name}-{self._bundle_number:04d}.jsonl.gz")
+
+    def write(self, doc_name: str, metadata_name: str, metadata: dict) -> None:
+        """Buffers a row, compressing the buffered rows into the bundle once a block is due"""
+        line = (json.dumps(metadata) + "\n").encode()
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"write to closed MetadataBundleWriter for {self.index_path}")
+            self._rows.append((doc_name, metadata_name, line))
+            finished = None
+            if len(self._rows) >= self.block_rows or monotonic() - self._last_flush >= self.flush_seconds:
+                finished = self._write_block()
+        self._bundle_finished(finished)
+
+    def flush_if_due(self) -> None:
+        """Writes rows that have waited flush_seconds, for a periodic call while no rows are written"""
+        with self._lock:
+            finished = None
+            if self._rows and monotonic() - self._last_flush >= self.flush_seconds:
+                finished = self._write_block()
+        self._bundle_finished(finished)
+
+    def _bundle_finished(self, path: Optional[Path]) -> None:
+        # outside the lock, the callback may take a while, eg waiting for an upload slot
+        if path and self.on_bundle_finished:
+            self.on_bundle_finished(path)
+
+    def _write_block(self) -> Optional[Path]:
+        # called holding the lock, returns the bundle finished by the block if there is one
+        self._last_flush = monotonic()
+        if not self._rows:
+            return None
+
+        if self._bundle is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._bundle = open(self.bundle_path, "ab")
+            self.bundles_written += 1
+            if self._index is None:
+                self._index = open(self.index_path, "a")
+
+        offset = self._bundle.tell()
+        member = gzip.compress(b"".join(line for _, _, line in self._rows), self.compresslevel, mtime=0)
+        self._bundle.write(member)
+        self._bundle.flush()
+        # index rows only after the member they point to is written
+        bundle = self.bundle_path.name
+        self._index.write("".join(
+            json.dumps({
+                "doc_name": doc_name, "metadata_name": metadata_name, "bundle": bundle,
+                "offset": offset, "length": len(member), "line": line_number,
+            }) + "\n"
+            for line_number, (doc_name, metadata_name, _) in enumerate(self._rows)
+        ))
+        self._index.flush()
+        self.rows_written += len(self._rows)
+        self.bytes_written += len(member)
+        self._rows = []
+
+        if self._bundle.tell() < self.max_bundle_bytes:
+            return None
+        finished = self.bundle_path
+        self._bundle.close()
+        self._bundle = None
+        self._bundle_number += 1
+        return finished
+
+    def close(self) -> List[Path]:
+        """Writes the buffered rows and closes the files
+
+        :returns: the bundle still open, if any, and the index, the files not passed to on_bundle_finished
+        """
+        with self._lock:
+            if self._closed:
+                return []
+            self._closed = True
+            finished = self._write_block()
+
+            remaining = []
+            if self._bundle is not None:
+                remaining.append(self.bundle_path)
+                self._bundle.close()
+                self._bundle = None
+            if self._index is not None:
+                remaining.append(self.index_path)
+                self._index.close()
+                self._index = None
+        self._bundle_finished(finished)
+        return remaining
+
+
+class MetadataBundleIndex:
+    """Looks up the metadata of a doc in the bundles of a MetadataBundleWriter, from its index"""
+
+    def __init__(self, index_path: Union[str, Path]):
+        self.index_path = Path(index_path)
+        # doc_name -> index row, later rows winning like re-downloads overwriting a sidecar
+        self.entries: Dict[str, dict] = {}
+        with open(self.index_path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry["doc_name"]] = entry
+
+    def __contains__(self, doc_name: str) -> bool:
+        return doc_name in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, doc_name: str) -> Optional[dict]:
+        """The doc's metadata, decompressing only the gzip member holding it"""
+        entry = self.entries.get(doc_name)
+        if entry is None:
+            return None
+
+        with open(Path(self.index_path.parent, entry["bundle"]), "rb") as f:
+            f.seek(entry["offset"])
+            member = f.read(entry["length"])
+        return json.loads(gzip.decompress(member).splitlines()[entry["line"]])
@@ -9,20 +9,39 @@
 ##########################################################################################
 
 import copy
-from typing import Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 from itemadapter import ItemAdapter
 from datetime import datetime
+from time import perf_counter
+import threading
 import os
+import shutil
 from pathlib import Path
 import json
 from jsonschema.exceptions import ValidationError
 
 import scrapy
+from scrapy import signals
 from scrapy.pipelines.media import MediaPipeline
-from scrapy.exceptions import DropItem
+from scrapy.exceptions import DontCloseSpider, DropItem
+from scrapy.utils.misc import arg_to_iter
+from scrapy.utils.request import request_fingerprint
+from twisted.internet import defer, threads
+from twisted.internet.task import deferLater
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
 
 from dataPipelines.gc_scrapy.gc_scrapy.utils import unzip_docs_as_needed
 from .validators import DefaultOutputSchemaValidator, SchemaValidator
+from .manifest import PreviousManifest, get_previous_manifest
+from .manifest_store import ManifestStore, get_manifest_store
+from .adaptive_concurrency import MEDIA_DOWNLOAD
+from .streaming_download import PARTIAL_DIR, STREAM_TO_DIR, STREAMED_PATH, STREAMED_BYTES, STREAMED_SHA256
+from .blob_store import BlobStore, file_sha256_hex_digest
+from .jsonl_writer import JsonLinesWriter, get_jsonl_writer, release_jsonl_writer
+from .s3_upload import S3Uploader
+from .metadata_bundle import METADATA_SINK_BUNDLE, METADATA_SINK_SIDECAR, METADATA_SINKS, MetadataBundleWriter
+from .GCSpider import GCSpider
 from . import OUTPUT_FOLDER_NAME
 from .utils import dict_to_sha256_hex_digest, get_fqdn_from_web_url
 
@@ -40,55 +59,344 @@ class FileDownloadPipeline(MediaPipeline):
         settings = dict(settings) if settings else {}
         settings.setdefault("MEDIA_ALLOW_REDIRECTS", True)
         super().__init__(download_func, settings)
-
-    previous_hashes = set()
+        # item_completed runs in pool threads, serializes the spider stats and other shared pipeline state
+        self._lock = threading.Lock()
+
+    # disk and cpu work of item_completed (writes, metadata, unzipping) runs here, off the reactor thread
+    # sized by FILE_PIPELINE_POOL_SIZE, 0 does the work on the reactor thread, or the reactor's threads when uploading
+    pool: Optional[ThreadPool] = None
+
+    previous_manifest: Optional[Union[PreviousManifest, ManifestStore]] = None
+    manifest_store: Optional[ManifestStore] = None
+    # downloaded files are kept once per sha256 here and hardlinked to their doc paths, see blob_store.py
+    blob_store: Optional[BlobStore] = None
+    blob_duplicates_path: Path
+    # finished files and their metadata are uploaded from here while the crawl goes on, see s3_upload.py
+    uploader: Optional[S3Uploader] = None
+    # METADATA_SINK, document metadata goes to .metadata sidecars, this bundle of the spider's metadata or both
+    write_metadata_sidecars: bool = True
+    metadata_bundle: Optional[MetadataBundleWriter] = None
     output_dir: Path
     previous_manifest_path: Path
     job_manifest_path: Path
+    dead_queue_path: Path
+    # buffered, shared with other pipelines appending to the same paths, see jsonl_writer.py
+    manifest_writer: JsonLinesWriter
+    dead_queue_writer: JsonLinesWriter
+    hash_index_dir: Optional[str]
+    hash_index_bloom: bool
     dont_filter_previous_hashes: bool
+    # temp file of a streamed response -> where it was moved to
+    streamed_files_moved: Dict[str, Path]
+    # downloads cut short are kept here to be resumed with a Range request, see streaming_download.PartialDownloads
+    partial_download_dir: Path
+    # the spider didn't set a partial_download_dir, the default one only lives as long as the spider
+    remove_partial_downloads: bool
+    # downloads that failed with a retryable error are held here as (item, reason) instead of going to the dead queue,
+    # and downloaded again in passes once the spider is otherwise done, see retry_failed_downloads
+    retry_queue: List[Tuple[dict, Union[int, str]]]
+    retry_passes: int = 0
+    retry_times: int = 0
+    # a pass is waiting out its backoff or running
+    retry_pass_running: bool = False
+    # ids of the items a pass is downloading again
+    retrying_items: Set[int]
 
     def open_spider(self, spider):
         super().open_spider(spider)
         print("++ Initiating downloader for", spider.name)
 
         self.output_dir = Path(spider.download_output_dir).resolve()
-        self.job_manifest_path = Path(self.output_dir, "manifest.json").resolve()
+        self.streamed_files_moved = {}
+        self.remove_partial_downloads = not spider.partial_download_dir
+        self.partial_download_dir = Path(
+            spider.partial_download_dir or Path(self.output_dir, ".partial", spider.name)
+        ).resolve()
+        self.retry_queue = []
+        self.retrying_items = set()
+
+        settings = getattr(self, "crawler", None) and self.crawler.settings
+        pool_size = settings.getint("FILE_PIPELINE_POOL_SIZE", 4) if settings else 0
+        if pool_size > 0:
+            self.pool = ThreadPool(minthreads=1, maxthreads=pool_size, name=f"{spider.name}-FileDownloadPipeline")
+            self.pool.start()
+        self.job_manifest_path = Path(
+            spider.job_manifest_location or Path(self.output_dir, "manifest.json")
+        ).resolve()
+        self.dead_queue_path = Path(
+            spider.dead_queue_location or Path(self.output_dir, "dead_queue.json")
+        ).resolve()
+        self.open_jsonl_writers(settings)
+        # zip bomb guards for unzip_docs_as_needed
+        self.unzip_limits = {}
+        if settings:
+            self.unzip_limits = {
+                "max_depth": settings.getint("UNZIP_MAX_DEPTH", 5),
+                "max_bytes": settings.getint("UNZIP_MAX_BYTES", 10 * 2**30),
+            }
+
+        if settings:
+            self.open_retry_passes(settings)
+
+        if spider.manifest_store_location:
+            self.manifest_store = get_manifest_store(spider.manifest_store_location)
+
+        if spider.blob_store_dir:
+            self.blob_store = BlobStore(spider.blob_store_dir)
+            # doc paths whose bytes were already stored, they don't need uploading again, see run_job.sh
+            self.blob_duplicates_path = Path(self.output_dir, "blob_duplicates.txt")
+
+        if spider.upload_bucket:
+            self.open_uploader(spider, settings)
+
+        if settings:
+            self.open_metadata_sink(spider, settings)
 
         self.previous_manifest_path = Path(spider.previous_manifest_location).resolve()
 
+        self.hash_index_dir = spider.hash_index_dir
+        self.hash_index_bloom = bool(spider.hash_index_bloom)
+
         if not spider.dont_filter_previous_hashes:
-            self.load_hashes_from_cumulative_manifest(self.previous_manifest_path, spider.name)
+            self.load_previous_manifest(self.previous_manifest_path, spider.name)
+
+    def close_spider(self, spider):
+        if self.pool:
+            self.pool.stop()
+            self.pool = None
+
+        # closed before the retry passes were done, eg on shutdown
+        for item, reason in self.retry_queue:
+            self.add_to_dead_queue(item, reason)
+        self.retry_queue = []
+
+        if self.remove_partial_downloads:
+            shutil.rmtree(self.partial_download_dir, ignore_errors=True)
+            try:
+                self.partial_download_dir.parent.rmdir()
+            except OSError:
+                pass  # other spiders' partial downloads are still in there
+
+        self.close_jsonl_writers(spider)
+
+        if self.metadata_bundle:
+            self.close_metadata_sink(spider)
+
+        if self.uploader:
+            # pool threads are done queueing uploads, wait for the queue to drain off the reactor thread
+            return threads.deferToThread(self.close_uploader, spider)
+
+    def open_uploader(self, spider, settings) -> None:
+        """Starts uploading finished files to s3://<upload_bucket>/<upload_prefix>, keyed by their path in output_dir"""
+        options = {}
+        if settings:
+            options = {
+                "max_workers": settings.getint("S3_UPLOAD_MAX_WORKERS", 4),
+                "max_pending": settings.getint("S3_UPLOAD_MAX_PENDING", 64),
+                "multipart_threshold": settings.getint("S3_UPLOAD_MULTIPART_THRESHOLD", 64 * 2**20),
+                "multipart_chunksize": settings.getint("S3_UPLOAD_MULTIPART_CHUNKSIZE", 16 * 2**20),
+            }
+        self.uploader = S3Uploader(
+            spider.upload_bucket,
+            self.output_dir,
+            prefix=spider.upload_prefix or "",
+            endpoint_url=spider.upload_endpoint_url,
+            delete_after_upload=bool(spider.delete_after_upload),
+            **options,
+        )
+
+    def open_metadata_sink(self, spider, settings) -> None:
+        """Bundles the spider's metadata in <output_dir>/metadata unless METADATA_SINK is sidecar, see metadata_bundle.py"""
+        sink = settings.get("METADATA_SINK", METADATA_SINK_SIDECAR)
+        if sink not in METADATA_SINKS:
+            raise ValueError(f"METADATA_SINK must be one of {METADATA_SINKS}, got {sink!r}")
+
+        self.write_metadata_sidecars = sink != METADATA_SINK_BUNDLE
+        if sink == METADATA_SINK_SIDECAR:
+            return
+        self.metadata_bundle = MetadataBundleWriter(
+            Path(self.output_dir, "metadata"),
+            spider.name,
+            block_rows=settings.getint("METADATA_BUNDLE_BLOCK_ROWS", 500),
+            flush_seconds=settings.getfloat("JSONL_WRITER_FLUSH_SECONDS", 5),
+            max_bundle_bytes=settings.getint("METADATA_BUNDLE_MAX_BYTES", 256 * 2**20),
+            on_bundle_finished=self.upload_finished_bundle,
+        )
+
+    def upload_finished_bundle(self, path: Path) -> None:
+        if self.uploader:
+            self.uploader.upload(path)
+
+    def close_metadata_sink(self, spider) -> None:
+        bundle, self.metadata_bundle = self.metadata_bundle, None
+        remaining = bundle.close()
+        if self.uploader:
+            self.upload_files(remaining)
+
+        stats = getattr(self, "crawler", None) and self.crawler.stats
+        if stats:
+            stats.set_value("metadata_bundle/rows", bundle.rows_written, spider=spider)
+            stats.set_value("metadata_bundle/bytes", bundle.bytes_written, spider=spider)
+            stats.set_value("metadata_bundle/bundles", bundle.bundles_written, spider=spider)
+
+    def upload_files(self, paths: List[Path]) -> None:
+        """Queues finished files for upload, blocks while the upload queue is full"""
+        for path in paths:
+            self.uploader.upload(path)
+
+    def close_uploader(self, spider) -> None:
+        self.uploader.close()
+        stats = getattr(self, "crawler", None) and self.crawler.stats
+        if stats:
+            for name, value in self.uploader.get_stats().items():
+                stats.set_value(f"s3_upload/{name}", value, spider=spider)
+        for path, reason in self.uploader.failures.items():
+            print("Not uploaded, left in place:", path, reason)
+        self.uploader = None
+
+    def open_retry_passes(self, settings) -> None:
+        """Downloads failing with a retryable error are tried again by up to DEAD_QUEUE_RETRY_TIMES end of spider passes
+
+        Each pass waits DEAD_QUEUE_RETRY_DELAY seconds, doubled for every pass before it, and downloads
+        DEAD_QUEUE_RETRY_CONCURRENCY items at a time, so a briefly flaky host gets time and little load to recover.
+        """
+        self.retry_times = settings.getint("DEAD_QUEUE_RETRY_TIMES", 2)
+        self.retry_delay = settings.getfloat("DEAD_QUEUE_RETRY_DELAY", 30)
+        self.retry_concurrency = max(1, settings.getint("DEAD_QUEUE_RETRY_CONCURRENCY", 2))
+        self.retry_http_codes = {int(code) for code in settings.getlist("RETRY_HTTP_CODES")}
+        if self.retry_times > 0:
+            self.crawler.signals.connect(self.retry_failed_downloads, signal=signals.spider_idle)
+
+    def is_retryable(self, response) -> bool:
+        """Whether a failed download might succeed later, download errors, truncated bodies and statuses in RETRY_HTTP_CODES"""
+        if isinstance(response, Failure) or "dataloss" in response.flags:
+            return True
+        return response.status in self.retry_http_codes
+
+    def handle_failed_download(self, item, response, reason) -> None:
+        """Holds a retryable failure for the next retry pass, adds the rest to the dead queue"""
+        if self.is_retryable(response):
+            with self._lock:
+                if self.retry_passes < self.retry_times:
+                    self.retry_queue.append((item, reason))
+                    return
+
+        self.add_to_dead_queue(item, reason)
+
+    def retry_failed_downloads(self, spider) -> None:
+        """spider_idle handler, keeps the spider open while a retry pass is waiting or running"""
+        if self.retry_pass_running:
+            raise DontCloseSpider
+
+        with self._lock:
+            if not self.retry_queue or self.retry_passes >= self.retry_times:
+                return
+            queued, self.retry_queue = self.retry_queue, []
+            self.retry_passes += 1
+            delay = self.retry_delay * 2 ** (self.retry_passes - 1)
+
+        print(f"Retrying {len(queued)} failed downloads for {spider.name} in {delay}s, pass {self.retry_passes}/{self.retry_times}")
+        stats = self.crawler.stats
+        stats.inc_value("dead_queue_retry/passes", spider=spider)
+        stats.inc_value("dead_queue_retry/items", len(queued), spider=spider)
+
+        from twisted.internet import reactor
+        self.retry_pass_running = True
+        d = deferLater(reactor, delay, self.run_retry_pass, queued, spider)
+        d.addErrback(lambda failure: print("Retry pass failed", failure))
+        d.addBoth(lambda _: setattr(self, "retry_pass_running", False))
+        raise DontCloseSpider
+
+    def run_retry_pass(self, queued: list, spider) -> defer.Deferred:
+        semaphore = defer.DeferredSemaphore(self.retry_concurrency)
+        return defer.DeferredList(
+            [semaphore.run(self.retry_item, item, spider) for item, _ in queued], consumeErrors=True
+        )
+
+    def retry_item(self, item, spider) -> defer.Deferred:
+        """Downloads an item's media again through process_item, as if the spider had just scraped it"""
+        info = self.spiderinfo
+        # the failed result is cached by request fingerprint, drop it so the request goes out again
+        for request in arg_to_iter(self.get_media_requests(item, info)):
+            info.downloaded.pop(request_fingerprint(request), None)
+
+        spider.increment_retried_downloads()
+        with self._lock:
+            self.retrying_items.add(id(item))
+
+        def done(result):
+            with self._lock:
+                self.retrying_items.discard(id(item))
+            return result
+
+        return self.process_item(item, spider).addBoth(done)
+
+    def open_jsonl_writers(self, settings) -> None:
+        writer_settings = {}
+        if settings:
+            writer_settings = {
+                "flush_rows": settings.getint("JSONL_WRITER_FLUSH_ROWS", 1000),
+                "flush_seconds": settings.getfloat("JSONL_WRITER_FLUSH_SECONDS", 5),
+                "fsync": settings.get("JSONL_WRITER_FSYNC", "close"),
+            }
+        self.manifest_writer = get_jsonl_writer(self.job_manifest_path, **writer_settings)
+        self.dead_queue_writer = get_jsonl_writer(self.dead_queue_path, **writer_settings)
+        self.jsonl_write_seconds = 0.0
+        self.jsonl_bytes_written = 0
+
+        # rows written shortly before a quiet spell would otherwise wait for the next row to be flushed
+        from twisted.internet import task
+        self.jsonl_flush_loop = task.LoopingCall(self.flush_jsonl_writers_if_due)
+        self.jsonl_flush_loop.start(self.manifest_writer.flush_seconds, now=False)
+
+    def flush_jsonl_writers_if_due(self) -> None:
+        self.manifest_writer.flush_if_due()
+        self.dead_queue_writer.flush_if_due()
+        if self.metadata_bundle:
+            self.metadata_bundle.flush_if_due()
+
+    def close_jsonl_writers(self, spider) -> None:
+        if self.jsonl_flush_loop.running:
+            self.jsonl_flush_loop.stop()
+
+        release_jsonl_writer(self.manifest_writer)
+        release_jsonl_writer(self.dead_queue_writer)
+
+        stats = getattr(self, "crawler", None) and self.crawler.stats
+        if stats and self.jsonl_write_seconds:
+            stats.set_value(
+                "jsonl_writer/bytes_per_second", self.jsonl_bytes_written / self.jsonl_write_seconds, spider=spider
+            )
 
-    def load_hashes_from_cumulative_manifest(self, previous_manifest_path, spider_name):
+    def write_jsonl(self, writer: JsonLinesWriter, row: dict) -> None:
+        """Appends a manifest or dead queue row, counting rows, bytes and time spent for the write throughput stats"""
+        started = perf_counter()
+        written = writer.write(row)
+        elapsed = perf_counter() - started
+
+        stats = getattr(self, "crawler", None) and self.crawler.stats
+        with self._lock:
+            self.jsonl_write_seconds += elapsed
+            self.jsonl_bytes_written += written
+            if stats:
+                spider = self.spiderinfo.spider
+                stats.inc_value("jsonl_writer/rows", spider=spider)
+                stats.inc_value("jsonl_writer/bytes", written, spider=spider)
+                stats.inc_value("jsonl_writer/write_seconds", elapsed, spider=spider)
+
+    def load_previous_manifest(self, previous_manifest_path, spider_name):
         file_location = Path(previous_manifest_path).resolve() if previous_manifest_path else None
 
         if not file_location or not os.path.isfile(file_location):
             print(f"\n\nPrevious manifest at {file_location} is not a file! Nothing will be filtered!\n\n")
-            if self.dont_filter_previous_hashes:
-                return
-            else:
-                exit(1)
-
-        print("Reading in previous manifest")
-        count = 0
-        with file_location.open(mode="r") as f:
-            for line in f.readlines():
-                count += 1
-                if count % 1000 == 0:
-                    print(f"{count} lines read in")
-                if not line.strip():
-                    continue
+            exit(1)
 
-                jdoc = json.loads(line)
-                crawler_used = jdoc.get("crawler_used")
-                # covers old manifest items with no crawler info
-                if not crawler_used:
-                    self.previous_hashes.add(jdoc["version_hash"])
-                # skips adding hashes for other spiders for combined manifest files with that info
-                elif crawler_used == spider_name:
-                    self.previous_hashes.add(jdoc["version_hash"])
+        # shared by every pipeline in the process, only the first spider actually reads the file
+        self.previous_manifest = get_previous_manifest(
+            file_location, self.hash_index_dir, self.hash_index_bloom
+        )
 
-        num_hashes = len(self.previous_hashes)
+        num_hashes = self.previous_manifest.count_for(spider_name)
         print(f"Previous manifest loaded, will filter {num_hashes} hashes")
 
     @staticmethod
@@ -106,6 +414,36 @@ class FileDownloadPipeline(MediaPipeline):
             )
             yield new_item
 
+    @staticmethod
+    def streams_downloads(spider) -> bool:
+        """Whether document bodies are streamed to disk, not for spiders that transform the body in download_response_handler"""
+        return (
+            bool(getattr(spider, "stream_downloads", False))
+            and getattr(type(spider), "download_response_handler", None) is GCSpider.download_response_handler
+        )
+
+    def get_download_paths(self, output_file_name: str, compression_type: Optional[str]) -> tuple:
+        """Paths of the downloaded file, the unzipped files (None if not compressed) and the metadata file"""
+        if compression_type:
+            file_download_path = Path(self.output_dir, output_file_name).with_suffix(f".{compression_type}") # Path for downloaded zipped file
+            file_unzipped_path = Path(self.output_dir, output_file_name)
+            # Path for unzipped files
+            metadata_download_path = f"{file_unzipped_path}.metadata" # Path for the accompanying metadata file
+        else:
+            file_unzipped_path = None
+            # If it is a jbook crawler (and needs a different file output style)
+            if 'rdte;' in output_file_name or 'procurement;' in output_file_name:
+                jbook_output_file_path = output_file_name.replace(';', '/')
+                # self.output_dir is set when the crawler is crawled and is the high level directory information
+                # Should point to bronze/jbook/pdfs instead of bronze/gamechanger/pdf
+                # jbook_output_file_path is type/year/filename
+                file_download_path = Path(self.output_dir, jbook_output_file_path)
+            else:
+                file_download_path = Path(self.output_dir, output_file_name)  # Path for downloaded file
+            metadata_download_path = f"{file_download_path}.metadata"  # Path for the accompanying metadata file
+
+        return file_download_path, file_unzipped_path, metadata_download_path
+
     @staticmethod
     def get_first_supported_downloadable_item(downloadable_items: list) -> Union[dict, None]:
         """Get first supported downloadable item corresponding to doc, has correct type and is not cac blocked"""
@@ -122,7 +460,7 @@ class FileDownloadPipeline(MediaPipeline):
         # self.waiting = defaultdict(list)
 
         doc_name = item["doc_name"]
-        if item["version_hash"] in self.previous_hashes:
+        if self.previous_manifest and self.previous_manifest.contains(info.spider.name, item["version_hash"]):
             # dont download anything just send item to crawl output
             print(f"Skipping download of {item.get('doc_name')} because it was in previous_hashes")
             info.spider.increment_in_previous_hashes()
@@ -145,11 +483,27 @@ class FileDownloadPipeline(MediaPipeline):
                 "output_file_name": output_file_name,
                 "doc_type": file_item["doc_type"],
                 "compression_type": file_item["compression_type"],
+                # documents are revalidated against the manifest, not the response cache
+                "dont_cache": True,
+                # timed out by size rather than like a page, see AdaptiveConcurrencyMiddleware
+                MEDIA_DOWNLOAD: True,
             }
+            if self.streams_downloads(info.spider):
+                # written to a temp file in the output dir as it arrives, renamed into place in item_completed
+                meta[STREAM_TO_DIR] = str(self.output_dir)
+                # a body cut short is kept there and resumed by the next try
+                meta[PARTIAL_DIR] = str(self.partial_download_dir)
+            headers = dict(info.spider.download_request_headers or {})
+
+            # revalidate against the last download of this doc, a 304 means only the metadata changed
+            validators = self.get_previous_validators(item, url) if not file_item["compression_type"] else None
+            if validators:
+                meta["previous_validators"] = validators
+                headers.update(self.get_conditional_headers(validators))
 
             try:
-                if info.spider.download_request_headers:
-                    yield scrapy.Request(url, headers=info.spider.download_request_headers, meta=meta)
+                if headers:
+                    yield scrapy.Request(url, headers=headers, meta=meta)
                 else:
                     yield scrapy.Request(url, meta=meta)
             except Exception as probably_url_error:
@@ -158,11 +512,50 @@ class FileDownloadPipeline(MediaPipeline):
             print(f"No supported downloadable item for {item['doc_name']}")
             return item
 
+    def get_previous_validators(self, item, url: str) -> Optional[dict]:
+        """Validators from the previous download of the doc, only if it was downloaded from the same url"""
+        if not self.previous_manifest:
+            return None
+
+        validators = self.previous_manifest.validators_for(item["crawler_used"], item["doc_name"])
+        if not validators or validators.get("download_url") != url:
+            return None
+
+        return validators
+
+    @staticmethod
+    def get_conditional_headers(validators: dict) -> dict:
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    @staticmethod
+    def get_response_validators(response) -> dict:
+        """Validators of a downloaded file to keep in the manifest, see manifest_store.VALIDATOR_FIELDS"""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        return {
+            # the url the request was made for, validators are matched against it before following any redirects
+            "download_url": response.meta.get("redirect_urls", [response.url])[0],
+            "etag": etag.decode("latin-1") if etag else None,
+            "last_modified": last_modified.decode("latin-1") if last_modified else None,
+            "content_length": response.meta.get(STREAMED_BYTES, len(response.body)),
+        }
+
     def media_downloaded(self, response, request, info):
         """Called for each completed response from get_media_requests, returned to item_completed"""
         # I dont know why this isnt being handled automatically here
         # Just filtering by response code
-        if 200 <= response.status < 300:
+        if "dataloss" in response.flags:
+            # shorter than its Content-Length, left out of the manifest and downloaded again (resumed if it could be)
+            return (False, response, f"Truncated download, got {response.meta.get(STREAMED_BYTES, len(response.body))} bytes")
+        elif response.status == 304 and request.meta.get("previous_validators"):
+            # file is unchanged since the previous download, nothing to write but the metadata
+            return (True, response, None)
+        elif 200 <= response.status < 300:
             return (True, response, None)
         elif not len(response.body):
             return (False, response, "Response has empty body")
@@ -177,7 +570,7 @@ class FileDownloadPipeline(MediaPipeline):
         return (False, failure, "Pipeline Media Request Failed")
 
     def add_to_dead_queue(self, item, reason):
-        path = Path(self.output_dir, "dead_queue.json").resolve() if self.output_dir else None
+        path = self.dead_queue_path
         if isinstance(reason, int):
             reason_text = f"HTTP Response Code {reason}"
         elif isinstance(reason, str):
@@ -185,82 +578,200 @@ class FileDownloadPipeline(MediaPipeline):
         else:
             reason_text = "Unknown failure"
 
-        with open(path, "a+") as f:
-            dead_dict = {"document": dict(item), "failure_reason": reason_text}
-            try:
-                f.write(json.dumps(dead_dict))
-                f.write("\n")
+        dead_dict = {"document": dict(item), "failure_reason": reason_text}
+        try:
+            self.write_jsonl(self.dead_queue_writer, dead_dict)
 
-            except Exception as e:
-                print("Failed to write to dead_queue file", path, e)
+        except Exception as e:
+            print("Failed to write to dead_queue file", path, e)
 
-    def add_to_manifest(self, item):
+    def add_to_manifest(self, item, validators: Optional[dict] = None, sha256: Optional[str] = None):
         path = self.job_manifest_path
-        with open(self.job_manifest_path, "a") as f:
+        row = {
+            "version_hash": item["version_hash"],
+            "doc_name": item["doc_name"],
+            "crawler_used": item["crawler_used"],
+            "access_timestamp": item["access_timestamp"],
+        }
+        if validators:
+            row.update(validators)
+        if sha256:
+            row["sha256"] = sha256
+        try:
+            self.write_jsonl(self.manifest_writer, row)
+
+        except Exception as e:
+            print("Failed to write to manifest file", path, e)
+
+        if self.manifest_store is not None:
+            try:
+                self.manifest_store.add(row)
+            except Exception as e:
+                print("Failed to add to manifest store", self.manifest_store.path, e)
+
+    def move_streamed_file(self, response, file_download_path: Path) -> None:
+        """Renames the temp file of a streamed response to the download path"""
+        streamed_path = response.meta[STREAMED_PATH]
+        with self._lock:
+            moved_to = self.streamed_files_moved.get(streamed_path)
+            if not moved_to:
+                os.replace(streamed_path, file_download_path)
+                self.streamed_files_moved[streamed_path] = file_download_path
+        if moved_to:
+            # media requests are deduplicated, docs sharing a url get the same response once the first has moved it
+            try:
+                shutil.copyfile(moved_to, file_download_path)
+            except FileNotFoundError:
+                if not (self.uploader and self.uploader.delete_after_upload):
+                    raise
+                self.uploader.download(moved_to, file_download_path)  # deleted once the first doc's upload finished
+
+    def store_blob(self, response, file_download_path: Path, spider) -> Tuple[str, bool]:
+        """Moves a downloaded file into the blob store and hardlinks its doc path to the blob
+
+        :returns: sha256 hex digest of the file, and whether its bytes weren't stored before
+        """
+        digest = response.meta.get(STREAMED_SHA256) or file_sha256_hex_digest(file_download_path)
+        size = file_download_path.stat().st_size
+        with self._lock:
+            is_new = self.blob_store.add_file(file_download_path, digest)
+        self.blob_store.link(digest, file_download_path)
+
+        if not is_new:
+            with self._lock, open(self.blob_duplicates_path, "a") as f:
+                spider.increment_duplicate_blobs()
+                stats = getattr(self, "crawler", None) and self.crawler.stats
+                if stats:
+                    stats.inc_value("blob_store/duplicate_bytes", size, spider=spider)
+                f.write(f"{file_download_path.relative_to(self.output_dir)}\n")
+
+        return digest, is_new
+
+    def write_metadata(self, item, metadata_download_path: Union[str, Path], sha256: Optional[str] = None) -> List[Path]:
+        """Writes an item's metadata as a .metadata sidecar, a row of the spider's metadata bundle or both, per METADATA_SINK
+        :param sha256: blob store digest of the downloaded file, recorded so docs that aren't uploaded can be found by it
+
+        :returns: the sidecar, if one was written
+        """
+        metadata_download_path = Path(metadata_download_path)
+        metadata = dict(item)
+        if sha256:
+            metadata["sha256"] = sha256
+        if self.metadata_bundle:
             try:
-                f.write(
-                    json.dumps(
-                        {
-                            "version_hash": item["version_hash"],
-                            "doc_name": item["doc_name"],
-                            "crawler_used": item["crawler_used"],
-                            "access_timestamp": item["access_timestamp"],
-                        }
-                    )
+                self.metadata_bundle.write(
+                    item["doc_name"], metadata_download_path.relative_to(self.output_dir).as_posix(), metadata
                 )
-                f.write("\n")
+            except Exception as e:
+                print("Failed to add metadata to bundle", metadata_download_path, e)
 
+        if not self.write_metadata_sidecars:
+            return []
+        with open(metadata_download_path, "w") as f:
+            try:
+                f.write(json.dumps(metadata))
             except Exception as e:
-                print("Failed to write to manifest file", path, e)
+                print("Failed to write metadata", metadata_download_path, e)
+                return []
+        return [metadata_download_path]
+
+    @staticmethod
+    def remove_streamed_file(response) -> None:
+        """Removes the temp file of a streamed response that won't be moved into place"""
+        streamed_path = getattr(response, "meta", {}).get(STREAMED_PATH)
+        if streamed_path and os.path.exists(streamed_path):
+            os.remove(streamed_path)
 
     def item_completed(self, results, item, info):
         """The function is called for each item after all media requests have been processed"""
         
-        if not info.downloaded:
+        if not info.downloaded or not results:
             return item # return item for crawler output if download was skipped
 
+        if not self.pool:
+            if self.uploader:
+                # a full upload queue blocks, as does fetching back a file deleted after its upload, not on the reactor
+                return threads.deferToThread(self.complete_item, results, item, info)
+            return self.complete_item(results, item, info)
+
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(
+            reactor, self.pool, self.complete_item_in_pool, perf_counter(), results, item, info
+        )
+
+    def complete_item_in_pool(self, submitted: float, results, item, info):
+        self.record_pool_wait(perf_counter() - submitted, info.spider)
+        return self.complete_item(results, item, info)
+
+    def record_pool_wait(self, waited: float, spider) -> None:
+        """Stats for how long items queued for a pool thread, a growing wait means FILE_PIPELINE_POOL_SIZE is too small"""
+        stats = getattr(self, "crawler", None) and self.crawler.stats
+        if not stats:
+            return
+
+        with self._lock:
+            stats.inc_value("file_pipeline/pool_items", spider=spider)
+            stats.inc_value("file_pipeline/pool_wait_seconds", waited, spider=spider)
+            stats.max_value("file_pipeline/pool_max_wait_seconds", waited, spider=spider)
+
+    def complete_item(self, results, item, info):
+        """Writes the downloaded files, their metadata and manifest rows, runs in a pool thread if there is a pool"""
         ### first in results is supposed to be 'ok' status but it always returns true b/c 404 doesnt cause failure for some reason :(
         ### so added to the media_downloaded function as a sub-tuple in return
         file_downloads = []
         unzipped_items = []
+        # written files and metadata to upload once the item is done
+        finished_paths = []
+        validators = None
+        sha256 = None
         for (_, (okay, response, reason)) in results: # Loop over results of requests made during crawling
             if not okay:
-                self.add_to_dead_queue(item, reason if reason else int(response.status))
+                self.handle_failed_download(item, response, reason if reason else int(response.status))
+                self.remove_streamed_file(response)
             else:
+                with self._lock:
+                    if id(item) in self.retrying_items:
+                        info.spider.increment_recovered_downloads()
+                        self.crawler.stats.inc_value("dead_queue_retry/recovered", spider=info.spider)
+
                 # Get values from metadata:
                 output_file_name = response.meta["output_file_name"] # Assigned to metadata above in get_media_requests function
                 doc_type = response.meta["doc_type"]
                 compression_type = response.meta["compression_type"]
                 # Build a path to each file associated with an item:
-                if compression_type:
-                    file_download_path = Path(self.output_dir, output_file_name).with_suffix(f".{compression_type}") # Path for downloaded zipped file
-                    file_unzipped_path = Path(self.output_dir, output_file_name)
-                    # Path for unzipped files
-                    metadata_download_path = f"{file_unzipped_path}.metadata" # Path for the accompanying metadata file
-                else:
-                    # If it is a jbook crawler (and needs a different file output style)
-                    if 'rdte;' in output_file_name or 'procurement;' in output_file_name:
-                        jbook_output_file_path = output_file_name.replace(';', '/')
-                        # self.output_dir is set when the crawler is crawled and is the high level directory information
-                        # Should point to bronze/jbook/pdfs instead of bronze/gamechanger/pdf
-                        # jbook_output_file_path is type/year/filename
-                        file_download_path = Path(self.output_dir, jbook_output_file_path)
-                    else:
-                        file_download_path = Path(self.output_dir, output_file_name)  # Path for downloaded file
-                    metadata_download_path = f"{file_download_path}.metadata"  # Path for the accompanying metadata file
-
-                with open(file_download_path, "wb") as f: # Download each file to it's download path
+                file_download_path, file_unzipped_path, metadata_download_path = self.get_download_paths(
+                    output_file_name, compression_type
+                )
+
+                if response.status == 304: # Unchanged since the previous download, only refresh the metadata
+                    with self._lock:
+                        info.spider.increment_not_modified()
+                    finished_paths.extend(self.write_metadata(item, metadata_download_path))
+
+                    # carried forward so the next crawl can revalidate again
+                    validators = response.meta["previous_validators"]
+                    file_downloads.append(file_download_path)
+                    continue
+
+                if "streamed" in response.flags: # Body is already on disk, move it to the download path
                     try:
-                        to_write = info.spider.download_response_handler(response)
-                        f.write(to_write)
-                        f.close()
+                        self.move_streamed_file(response, file_download_path)
                     except Exception as e:
-                        print("Failed to write file to", file_download_path, "Error:", e)
+                        print("Failed to move file to", file_download_path, "Error:", e)
                         return item
+                else:
+                    with open(file_download_path, "wb") as f: # Download each file to it's download path
+                        try:
+                            to_write = info.spider.download_response_handler(response)
+                            f.write(to_write)
+                            f.close()
+                        except Exception as e:
+                            print("Failed to write file to", file_download_path, "Error:", e)
+                            return item
 
                 if compression_type:
                     if compression_type.lower() == "zip":
-                        unzipped_files = unzip_docs_as_needed(file_download_path, file_unzipped_path, doc_type) # Unzip downloaded zip documents
+                        unzipped_files = unzip_docs_as_needed(file_download_path, file_unzipped_path, doc_type, **self.unzip_limits) # Unzip downloaded zip documents
 
                         if unzipped_files: # If files have been unzipped...
                             for unzipped_item in self.create_items_from_nested_zip(unzipped_files, item): # Create new DocItem for each unzipped file
@@ -273,25 +784,31 @@ class FileDownloadPipeline(MediaPipeline):
                                 # periods in filename. will mess up metadata names otherwise
                                 metadata_download_path = metadata_download_path.with_suffix(metadata_download_path.suffix + f'.{suffix_doc_type}.metadata')
 
-                                with open(metadata_download_path, "w") as f: # Write the metadata for each unzipped file
-                                    try:
-                                        f.write(json.dumps(dict(unzipped_item)))
-
-                                    except Exception as e:
-                                        print("Failed to write metadata", metadata_download_path, e)
+                                # Write the metadata for each unzipped file
+                                finished_paths.extend(self.write_metadata(unzipped_item, metadata_download_path))
 
                                 unzipped_items.append(unzipped_item)
+                            finished_paths.extend(unzipped_files)
                 else: # If original download is not a compressed file...
-                    with open(metadata_download_path, "w") as f: # Write the metadata for each file
+                    validators = self.get_response_validators(response)
+                    # files whose bytes are already in the blob store aren't uploaded again
+                    is_new_blob = True
+                    if self.blob_store:
                         try:
-                            f.write(json.dumps(dict(item)))
+                            sha256, is_new_blob = self.store_blob(response, file_download_path, info.spider)
                         except Exception as e:
-                            print("Failed to write metadata", file_download_path, e)
+                            print("Failed to add file to blob store", file_download_path, e)
+                    if is_new_blob:
+                        finished_paths.append(file_download_path)
+                    finished_paths.extend(self.write_metadata(item, metadata_download_path, sha256)) # Write the metadata for each file
 
                 file_downloads.append(file_download_path)
 
         if file_downloads: # If file was downloaded, add to manifest
-            self.add_to_manifest(item)
+            self.add_to_manifest(item, validators, sha256)
+
+        if self.uploader and finished_paths:
+            self.upload_files(finished_paths)
 
         if len(unzipped_items) > 1: # If there were unzipped files, return each as item in list 'unzipped_items'
             return unzipped_items
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.response_cache
+-----------------
+Size bounded, compressed on disk store of http responses kept across crawls, see downloader_middlewares.ResponseCacheMiddleware
+"""
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Union
+from time import time
+import threading
+import sqlite3
+import zlib
+import json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    fingerprint TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+
+class CachedResponse(NamedTuple):
+    url: str
+    status: int
+    # header name -> list of values, as strings
+    headers: Dict[str, list]
+    # decoded (content-encoding removed) body
+    body: bytes
+    stored_at: float
+
+    @property
+    def age(self) -> float:
+        return time() - self.stored_at
+
+    def header(self, name: str) -> Optional[str]:
+        for key, values in self.headers.items():
+            if key.lower() == name.lower() and values:
+                return values[0]
+        return None
+
+
+class ResponseCache:
+    """Responses by request fingerprint in a sqlite file, bodies zlib compressed
+
+    Once the compressed bodies add up to more than max_bytes, the least recently used responses are evicted.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 2**30, compression_level: int = 6):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+    def get(self, fingerprint: str) -> Optional[CachedResponse]:
+        with self._lock, self.connection:
+            found = self.connection.execute(
+                "SELECT url, status, headers, body, stored_at FROM responses WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+            if not found:
+                return None
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE fingerprint = ?", (time(), fingerprint))
+
+        url, status, headers, body, stored_at = found
+        return CachedResponse(url, status, json.loads(headers), zlib.decompress(body), stored_at)
+
+    def put(self, fingerprint: str, url: str, status: int, headers: Dict[str, list], body: bytes) -> None:
+        compressed = zlib.compress(body, self.compression_level)
+        now = time()
+        with self._lock, self.connection:
+            replaced = self.connection.execute(
+                "SELECT size FROM responses WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (fingerprint, url, status, headers, body, size, stored_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint, url, status, json.dumps(headers), compressed, len(compressed), now, now),
+            )
+            self.total_bytes += len(compressed) - (replaced[0] if replaced else 0)
+            self._evict()
+
+    def touch(self, fingerprint: str) -> None:
+        """Marks a response as fresh again, eg after the server answered a revalidation with 304"""
+        now = time()
+        with self._lock, self.connection:
+            self.connection.execute(
+                "UPDATE responses SET stored_at = ?, last_access = ? WHERE fingerprint = ?", (now, now, fingerprint)
+            )
+
+    def _evict(self) -> None:
+        # called holding the lock inside a transaction
+        while self.total_bytes > self.max_bytes:
+            oldest = self.connection.execute(
+                "SELECT fingerprint, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not oldest:
+                self.total_bytes = 0
+                return
+
+            for fingerprint, size in oldest:
+                if self.total_bytes <= self.max_bytes:
+                    return
+                self.connection.execute("DELETE FROM responses WHERE fingerprint = ?", (fingerprint,))
+                self.total_bytes -= size
+                self.evicted += 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+# open caches, keyed by resolved path, so spiders crawling in the same process share a connection
+_open_caches: Dict[Path, ResponseCache] = {}
+
+
+def get_response_cache(path: Union[str, Path], max_bytes: int = 2**30, compression_level: int = 6) -> ResponseCache:
+    """Returns the process wide ResponseCache for the path, opening (and creating) it on first use"""
+    path = Path(path).resolve()
+    if path not in _open_caches:
+        _open_caches[path] = ResponseCache(path, max_bytes, compression_level)
+
+    return _open_caches[path]
@@ -10,8 +10,57 @@ general_settings = {
         "jsonlines": "dataPipelines.gc_scrapy.gc_scrapy.exporters.JsonLinesAsJsonItemExporter",
     },
     "DOWNLOADER_MIDDLEWARES": {
+        # before BanEvasionMiddleware so cache hits aren't delayed, and HttpCompressionMiddleware so bodies are stored decoded
+        "dataPipelines.gc_scrapy.gc_scrapy.downloader_middlewares.ResponseCacheMiddleware": 50,
         "dataPipelines.gc_scrapy.gc_scrapy.downloader_middlewares.BanEvasionMiddleware": 100,
+        # between RetryMiddleware (550) and AjaxCrawlMiddleware (560), see AdaptiveConcurrencyMiddleware
+        "dataPipelines.gc_scrapy.gc_scrapy.downloader_middlewares.AdaptiveConcurrencyMiddleware": 555,
     },
+    "SPIDER_MIDDLEWARES": {
+        "dataPipelines.gc_scrapy.gc_scrapy.spider_middlewares.DetailCacheMiddleware": 100,
+    },
+    # streams document downloads to disk, see streaming_download.py
+    "DOWNLOAD_HANDLERS": {
+        "http": "dataPipelines.gc_scrapy.gc_scrapy.streaming_download.StreamingDownloadHandler",
+        "https": "dataPipelines.gc_scrapy.gc_scrapy.streaming_download.StreamingDownloadHandler",
+    },
+    "DOWNLOAD_STREAM_CHUNK_SIZE": 2**20,  # Bytes buffered per download before they're written
+    "DOWNLOAD_STREAM_MAX_BYTES_IN_FLIGHT": 16 * 2**20,  # Cap on bytes buffered across all downloads, a download going over it writes its buffer straight away
+    "FILE_PIPELINE_POOL_SIZE": 4,  # Threads writing and unzipping downloads off the reactor thread, 0 for none
+    "UNZIP_MAX_DEPTH": 5,  # Levels of nested zips opened when unzipping a download
+    "UNZIP_MAX_BYTES": 10 * 2**30,  # Uncompressed bytes extracted from one download before unzipping fails
+    # manifest.json and dead_queue.json rows are buffered, flushed every JSONL_WRITER_FLUSH_ROWS rows or
+    # JSONL_WRITER_FLUSH_SECONDS seconds and when the spider closes. JSONL_WRITER_FSYNC is never, flush or close
+    "JSONL_WRITER_FLUSH_ROWS": 1000,
+    "JSONL_WRITER_FLUSH_SECONDS": 5,
+    "JSONL_WRITER_FSYNC": "close",
+    # downloads failing with an error in RETRY_HTTP_CODES or an exception are tried again once the spider is otherwise done,
+    # in up to DEAD_QUEUE_RETRY_TIMES passes, instead of going straight to dead_queue.json
+    "DEAD_QUEUE_RETRY_TIMES": 2,
+    "DEAD_QUEUE_RETRY_DELAY": 30,  # Seconds before the first pass, doubled for each pass after it
+    "DEAD_QUEUE_RETRY_CONCURRENCY": 2,  # Items downloaded at a time in a pass
+    # METADATA_SINK sidecar (default) writes a .metadata file next to each document, bundle writes the spider's metadata to
+    # gzip compressed <download dir>/metadata/<spider name>-<n>.jsonl.gz bundles with an index instead, both does both,
+    # see metadata_bundle.py. It isn't set here so it can come from the cli (crawl --metadata-sink)
+    "METADATA_BUNDLE_BLOCK_ROWS": 500,  # Rows compressed together, a lookup decompresses this many rows at most
+    "METADATA_BUNDLE_MAX_BYTES": 256 * 2**20,  # Size a bundle is finished at and the next one started
+    # with a spider upload_bucket (cli crawl --upload-bucket), finished files are uploaded during the crawl, see s3_upload.py
+    "S3_UPLOAD_MAX_WORKERS": 4,  # Files uploaded at a time per spider
+    "S3_UPLOAD_MAX_PENDING": 64,  # Files queued or uploading before the pipeline waits for uploads to catch up
+    "S3_UPLOAD_MULTIPART_THRESHOLD": 64 * 2**20,  # Files at least this big go up as multipart uploads
+    "S3_UPLOAD_MULTIPART_CHUNKSIZE": 16 * 2**20,
+    # per slot concurrency and timeouts follow the latency, throughput and errors seen, see AdaptiveConcurrencyMiddleware.
+    # ADAPTIVE_CONCURRENCY_MAX defaults to CONCURRENT_REQUESTS_PER_DOMAIN, and a spider setting
+    # CONCURRENT_REQUESTS_PER_DOMAIN caps its slots' concurrency at it. Timeouts start from DOWNLOAD_TIMEOUT and never
+    # go under it, ADAPTIVE_TIMEOUT_MIN can only raise that floor
+    "ADAPTIVE_CONCURRENCY_ENABLED": True,
+    "ADAPTIVE_CONCURRENCY_MIN": 1,
+    "ADAPTIVE_TIMEOUT_MAX": 30.0,
+    "ADAPTIVE_TARGET_LATENCY": 2.0,  # Slots whose p95 seconds till headers go over it drop a request
+    "ADAPTIVE_MAX_ERROR_RATE": 0.1,  # Slots with more errors (429, 5xx, timeouts, connection errors) halve their requests
+    "ADAPTIVE_WINDOW": 20,  # Requests finished between adjustments
+    "ADAPTIVE_MEDIA_MIN_BYTES_PER_SECOND": 64 * 2**10,  # Slowest document download allowed once its size is known
+    "ADAPTIVE_MEDIA_TIMEOUT_MAX": 600.0,
     # 'STATS_DUMP': False,
     "ROBOTSTXT_OBEY": False,
     "LOG_LEVEL": "INFO",
@@ -22,7 +71,10 @@ general_settings = {
     "DOWNLOAD_TIMEOUT": 3.5,  # Time till skip
     "RETRY_ENABLE": True,
     "RETRY_TIMES": 2,
-    "CONCURRENT_REQUESTS": 10,
+    "CONCURRENT_REQUESTS": 10,  # Overall cap, each slot's share is picked by AdaptiveConcurrencyMiddleware
+
+    # ResponseCacheMiddleware is off unless RESPONSE_CACHE_DIR is set (cli crawl --response-cache-dir), it isn't set
+    # here so it can come from the cli along with RESPONSE_CACHE_MAX_BYTES and RESPONSE_CACHE_COMPRESSION_LEVEL
 }
 selenium_settings = {
     "SELENIUM_DRIVER_NAME": "chrome",
@@ -36,6 +88,16 @@ selenium_settings = {
         "--disable-setuid-sandbox",
         "--enable-javascript",
     ],
+    # drivers loading pages at the same time, each in its own thread, see selenium_pool.py
+    "SELENIUM_DRIVER_POOL_SIZE": 1,
+    "SELENIUM_DRIVER_MAX_PAGES": 50,  # Pages a driver loads before it's quit and replaced, 0 for never
+    # SELENIUM_KEEP_DRIVERS_WARM leaves the drivers running for the next spider of the process, with cookies and storage
+    # cleared in between. It isn't set here so it can come from the cli (crawl --keep-selenium-drivers-warm)
+    "SPIDER_MIDDLEWARES": {
+        **general_settings["SPIDER_MIDDLEWARES"],
+        # before any other spider middleware so the driver is released after the whole callback output is consumed
+        "dataPipelines.gc_scrapy.gc_scrapy.spider_middlewares.SeleniumDriverReleaseMiddleware": 10,
+    },
     "DOWNLOADER_MIDDLEWARES": {
         **general_settings["DOWNLOADER_MIDDLEWARES"],
         "dataPipelines.gc_scrapy.gc_scrapy.downloader_middlewares.SeleniumMiddleware": max(
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.s3_upload
+-----------------
+Uploads downloaded files to an S3 compatible bucket from a bounded pool of threads while the crawl goes on
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Optional, Union
+import os
+import threading
+
+
+class UploadNotConfirmed(Exception):
+    pass
+
+
+def get_s3_client(endpoint_url: Optional[str] = None):
+    """boto3 s3 client, credentials and region come from the usual AWS env vars and config files
+
+    boto3 is only needed when uploading during the crawl, it's imported here rather than with the module
+    """
+    import boto3
+
+    return boto3.client("s3", endpoint_url=endpoint_url or None)
+
+
+class S3Uploader:
+    """Uploads files under root to bucket, keyed by prefix and their path relative to root like `aws s3 cp --recursive`
+
+    upload blocks while max_pending files are queued or uploading, so a crawl outrunning its uploads waits instead of
+    filling the disk. Files of multipart_threshold bytes or more go up as multipart uploads of multipart_chunksize parts.
+    With delete_after_upload a file is removed once the bucket has an object of the file's size under its key.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        root: Union[str, Path],
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        client=None,
+        max_workers: int = 4,
+        max_pending: int = 64,
+        multipart_threshold: int = 64 * 2**20,
+        multipart_chunksize: int = 16 * 2**20,
+        delete_after_upload: bool = False,
+    ):
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.root = Path(root).resolve()
+        self.prefix = prefix.strip("/")
+        self.client = client or get_s3_client(endpoint_url)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize
+        )
+        self.delete_after_upload = delete_after_upload
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="S3Uploader")
+        # one slot per queued or running upload
+        self._slots = threading.BoundedSemaphore(max(max_pending, max_workers))
+        self._lock = threading.Lock()
+
+        self.uploaded_files = 0
+        self.uploaded_bytes = 0
+        self.deleted_files = 0
+        self.failed_files = 0
+        # seconds upload spent waiting for a slot, ie the crawl was held up by uploads
+        self.wait_seconds = 0.0
+        # path -> why its upload failed, the file is left in place
+        self.failures: Dict[str, str] = {}
+
+    def key_for(self, path: Union[str, Path]) -> str:
+        relative = Path(path).resolve().relative_to(self.root).as_posix()
+        return f"{self.prefix}/{relative}" if self.prefix else relative
+
+    def upload(self, path: Union[str, Path]) -> Future:
+        """Queues a file for upload, waiting for a slot if max_pending are already queued or uploading
+
+        :returns: future of whether the upload succeeded
+        """
+        started = perf_counter()
+        self._slots.acquire()
+        waited = perf_counter() - started
+        with self._lock:
+            self.wait_seconds += waited
+
+        try:
+            future = self.executor.submit(self._upload, Path(path))
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _upload(self, path: Path) -> bool:
+        try:
+            key = self.key_for(path)
+            size = path.stat().st_size
+            self.client.upload_file(str(path), self.bucket, key, Config=self.transfer_config)
+            if self.delete_after_upload:
+                uploaded_size = self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+                if uploaded_size != size:
+                    raise UploadNotConfirmed(f"s3://{self.bucket}/{key} has {uploaded_size} bytes, expected {size}")
+                os.remove(path)
+        except Exception as e:
+            print("Failed to upload", path, "to", self.bucket, e)
+            with self._lock:
+                self.failed_files += 1
+                self.failures[str(path)] = repr(e)
+            return False
+
+        with self._lock:
+            self.uploaded_files += 1
+            self.uploaded_bytes += size
+            self.deleted_files += int(self.delete_after_upload)
+        return True
+
+    def download(self, path: Union[str, Path], destination: Union[str, Path]) -> None:
+        """Downloads the object uploaded from path, eg to copy a file deleted after its upload"""
+        self.client.download_file(self.bucket, self.key_for(path), str(destination), Config=self.transfer_config)
+
+    def close(self) -> None:
+        """Waits for the queued uploads to finish"""
+        self.executor.shutdown(wait=True)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": self.uploaded_files,
+                "bytes": self.uploaded_bytes,
+                "deleted": self.deleted_files,
+                "failed": self.failed_files,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
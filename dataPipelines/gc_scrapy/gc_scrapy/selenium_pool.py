@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.selenium_pool
+-----------------
+Pool of WebDriver instances for SeleniumMiddleware, drivers start and load pages in threads off the reactor
+"""
+from collections import deque
+from time import monotonic
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+
+
+# request meta key, the DriverLease of the driver that loaded the page, released once the response is parsed
+SELENIUM_DRIVER_LEASE = "selenium_driver_lease"
+
+
+class PooledDriver:
+    def __init__(self, driver, number: int):
+        self.driver = driver
+        # numbered in start order, for the per driver stats
+        self.number = number
+        # pages loaded by the driver since it started
+        self.pages = 0
+        # spider the driver last loaded pages for, its cookies and storage are cleared before another spider uses it
+        self.owner: Optional[str] = None
+        # scheme://host of every page loaded since the last reset, to clear their storage
+        self.origins: Set[str] = set()
+
+    def add_origin(self, url: str) -> None:
+        parts = urlsplit(url or "")
+        if parts.scheme in ("http", "https") and parts.netloc:
+            self.origins.add(f"{parts.scheme}://{parts.netloc}")
+
+
+def reset_driver(pooled: PooledDriver) -> None:
+    """Clears the cookies, local and session storage, cache storage and IndexedDB the driver's pages left behind
+
+    Blocking, run it in the pool's threads. Chrome clears through the devtools protocol, other drivers through
+    webdriver cookies and the storage of the current page only.
+    """
+    driver = pooled.driver
+    if hasattr(driver, "execute_cdp_cmd"):
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origin in sorted(pooled.origins):
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+    else:
+        driver.delete_all_cookies()
+        driver.execute_script("window.localStorage && localStorage.clear(); window.sessionStorage && sessionStorage.clear();")
+    driver.get("about:blank")
+    pooled.origins.clear()
+
+
+class DriverLease:
+    """A driver checked out of a WebDriverPool, for one request and the parsing of its response
+
+    Each checkout gets its own lease, releasing one twice can't hand back a driver already checked out again.
+    """
+
+    def __init__(self, pool: "WebDriverPool", pooled: PooledDriver):
+        self.pool = pool
+        self.pooled = pooled
+        self.released = False
+        self.checked_out = monotonic()
+
+    @property
+    def driver(self):
+        return self.pooled.driver
+
+    @property
+    def number(self) -> int:
+        return self.pooled.number
+
+    @property
+    def pages(self) -> int:
+        return self.pooled.pages
+
+    @pages.setter
+    def pages(self, pages: int):
+        self.pooled.pages = pages
+
+    def add_origin(self, url: str) -> None:
+        """Records a site the driver loaded, its storage is cleared before the driver goes to another spider"""
+        self.pooled.add_origin(url)
+
+    def release(self) -> None:
+        """Returns the driver to the pool, safe to call more than once"""
+        if not self.released:
+            self.released = True
+            self.pool.busy_seconds += monotonic() - self.checked_out
+            self.pool.release(self.pooled)
+
+
+class WebDriverPool:
+    """Up to size drivers, handed out one request at a time
+
+    acquire and release are called on the reactor thread. Drivers are started, and should be used for blocking calls,
+    through run, on a thread pool of size threads. A driver that loaded max_pages pages is quit on release and a new
+    one is started the next time it's needed, containing browser memory growth. 0 never replaces drivers.
+
+    Drivers are acquired for an owner, the spider name. A warm driver last used by another owner is reset first, see
+    reset_driver, so pools passed from spider to spider with get_webdriver_pool don't leak sessions between them.
+    """
+
+    def __init__(self, create_driver: Callable, size: int = 1, max_pages: int = 50, name: str = "WebDriverPool"):
+        self.create_driver = create_driver
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.threadpool = ThreadPool(minthreads=0, maxthreads=self.size, name=name)
+        self.threadpool.start()
+
+        self.idle: List[PooledDriver] = []
+        # every started driver, idle or checked out, quit on close
+        self.drivers: Set[PooledDriver] = set()
+        # drivers started or starting, never more than size
+        self.live = 0
+        # (deferred, owner) of acquires waiting for a driver
+        self.waiting: Deque[Tuple[defer.Deferred, Optional[str]]] = deque()
+        self.closed = False
+        # get_webdriver_pool callers not released yet, at most one
+        self.users = 0
+
+        self.drivers_started = 0
+        self.drivers_recycled = 0
+        self.start_seconds = 0.0
+        # drivers handed to a different owner than the one that started them, each skipping a driver start
+        self.warm_reuses = 0
+        self.startup_seconds_saved = 0.0
+        # time drivers were checked out, loading pages and in callbacks
+        self.busy_seconds = 0.0
+        # driver number -> pages it loaded, kept after it's quit
+        self.driver_pages: Dict[int, int] = {}
+
+    def run(self, func, *args, **kwargs) -> defer.Deferred:
+        """Runs a blocking call, eg on a driver, in the pool's threads"""
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self.threadpool, func, *args, **kwargs)
+
+    def acquire(self, owner: Optional[str] = None) -> defer.Deferred:
+        """Deferred firing with a DriverLease once a driver is free, starting one if fewer than size are live"""
+        if self.closed:
+            return defer.fail(RuntimeError("WebDriverPool is closed"))
+
+        if self.idle:
+            d = self._hand_over(self.idle.pop(), owner)
+        elif self.live < self.size:
+            d = self._start_driver().addCallback(self._hand_over, owner)
+        else:
+            d = defer.Deferred()
+            self.waiting.append((d, owner))
+        return d.addCallback(lambda pooled: DriverLease(self, pooled))
+
+    def _hand_over(self, pooled: PooledDriver, owner: Optional[str]) -> defer.Deferred:
+        """Fires with pooled once it's clean for owner, replaced with a new driver if the reset fails"""
+        previous, pooled.owner = pooled.owner, owner
+        if previous is None or previous == owner:
+            return defer.succeed(pooled)
+
+        self.warm_reuses += 1
+        self.startup_seconds_saved += self.start_seconds / self.drivers_started
+
+        def reset_failed(failure):
+            print("Failed to reset WebDriver", pooled.number, failure.value, "starting a new one")
+            self._quit(pooled)
+            return self._start_driver().addCallback(self._hand_over, owner)
+
+        return self.run(reset_driver, pooled).addCallbacks(lambda _: pooled, reset_failed)
+
+    def _start_driver(self) -> defer.Deferred:
+        self.live += 1
+        self.drivers_started += 1
+        number = self.drivers_started
+
+        def create():
+            started = monotonic()
+            driver = self.create_driver()
+            return driver, monotonic() - started
+
+        def started(result):
+            driver, seconds = result
+            self.start_seconds += seconds
+            if self.closed:
+                driver.quit()  # closed while it started, the threads are stopped
+                raise RuntimeError("WebDriverPool closed")
+            pooled = PooledDriver(driver, number)
+            self.drivers.add(pooled)
+            return pooled
+
+        def failed(failure):
+            self.live -= 1
+            return failure
+
+        return self.run(create).addCallbacks(started, failed)
+
+    def release(self, pooled: PooledDriver) -> None:
+        """Takes back a driver, use DriverLease.release"""
+        self.driver_pages[pooled.number] = pooled.pages
+        if self.closed:
+            return
+
+        if self.max_pages and pooled.pages >= self.max_pages:
+            self.drivers_recycled += 1
+            self._quit(pooled)
+            pooled = None
+
+        if self.waiting:
+            d, owner = self.waiting.popleft()
+            if pooled:
+                self._hand_over(pooled, owner).chainDeferred(d)
+            else:
+                self._start_driver().addCallback(self._hand_over, owner).chainDeferred(d)
+        elif pooled:
+            self.idle.append(pooled)
+
+    def _quit(self, pooled: PooledDriver) -> defer.Deferred:
+        self.drivers.discard(pooled)
+        self.live -= 1
+        return self.run(pooled.driver.quit).addErrback(
+            lambda failure: print("Failed to quit WebDriver", pooled.number, failure.value)
+        )
+
+    def close(self) -> defer.Deferred:
+        """Quits every driver, checked out or not, and stops the threads"""
+        self.closed = True
+        for d, _ in self.waiting:
+            d.errback(RuntimeError("WebDriverPool closed"))
+        self.waiting.clear()
+        self.idle = []
+
+        quitting = []
+        for pooled in list(self.drivers):
+            self.driver_pages[pooled.number] = pooled.pages
+            quitting.append(self._quit(pooled))
+        return defer.DeferredList(quitting).addBoth(lambda _: self.threadpool.stop())
+
+    def get_stats(self) -> dict:
+        stats = {
+            "drivers_started": self.drivers_started,
+            "drivers_recycled": self.drivers_recycled,
+            "driver_start_seconds": round(self.start_seconds, 3),
+            "warm_drivers_reused": self.warm_reuses,
+            "startup_seconds_saved": round(self.startup_seconds_saved, 3),
+            "driver_busy_seconds": round(self.busy_seconds, 3),
+        }
+        for number, pages in sorted(self.driver_pages.items()):
+            stats[f"driver_{number}/pages"] = pages
+        return stats
+
+
+# pools kept across the spiders of a process, by driver settings, see get_webdriver_pool. Only touched on the reactor
+# thread
+_shared_pools: Dict[Hashable, List[WebDriverPool]] = {}
+_close_on_shutdown = False
+
+
+def get_webdriver_pool(key: Hashable, create_driver: Callable, size: int = 1, max_pages: int = 50) -> WebDriverPool:
+    """A pool for the driver settings in key, reusing one released by a spider that closed, or a new one
+
+    A pool has one user at a time, spiders running at the same time (crawl --max-parallel-spiders) get pools of their
+    own, so a driver is only reset for a new spider once the spider it worked for has closed. Call
+    release_webdriver_pool when the spider closes, with keep_warm the drivers stay up for the next spider and are quit
+    when the reactor shuts down.
+    """
+    global _close_on_shutdown
+    pools = _shared_pools.setdefault(key, [])
+    pools[:] = [pool for pool in pools if not pool.closed]
+    pool = next((pool for pool in pools if pool.users == 0), None)
+    if pool is None:
+        pool = WebDriverPool(create_driver, size=size, max_pages=max_pages, name="SharedWebDriverPool")
+        pools.append(pool)
+        if not _close_on_shutdown:
+            from twisted.internet import reactor
+            reactor.addSystemEventTrigger("before", "shutdown", close_webdriver_pools)
+            _close_on_shutdown = True
+    pool.users += 1
+    return pool
+
+
+def release_webdriver_pool(pool: WebDriverPool, keep_warm: bool = False) -> defer.Deferred:
+    """Releases a get_webdriver_pool pool, closing it unless keep_warm"""
+    pool.users -= 1
+    if pool.users > 0 or keep_warm:
+        return defer.succeed(None)
+    for pools in _shared_pools.values():
+        if pool in pools:
+            pools.remove(pool)
+    return pool.close()
+
+
+def close_webdriver_pools() -> defer.Deferred:
+    """Closes every shared pool, reporting the driver startup time warm drivers saved"""
+    pools = [pool for shared in _shared_pools.values() for pool in shared]
+    _shared_pools.clear()
+    reuses = sum(pool.warm_reuses for pool in pools)
+    if reuses:
+        saved = sum(pool.startup_seconds_saved for pool in pools)
+        print(f"Reused warm WebDrivers {reuses} times across spiders, saving ~{saved:.1f}s of browser startup")
+    return defer.DeferredList([pool.close() for pool in pools])
@@ -0,0 +1,60 @@
+import copy
+
+from scrapy import Request
+
+from dataPipelines.gc_scrapy.gc_scrapy.selenium_pool import SELENIUM_DRIVER_LEASE
+
+
+DETAIL_CACHE_KEY = "detail_cache_key"
+
+
+class DetailCacheMiddleware:
+    """Records the items produced from detail pages requested through GCSpider.follow_detail_page
+
+    Requests yielded while handling a keyed response inherit its key (eg pdf redirect pages),
+    the items are cached once a response in the chain yields no further requests.
+    """
+
+    def process_spider_output(self, response, result, spider):
+        fingerprint = response.meta.get(DETAIL_CACHE_KEY)
+        cache = getattr(spider, "detail_cache", None)
+        if not fingerprint or cache is None:
+            yield from result
+            return
+
+        items = []
+        followed = False
+        for output in result:
+            if isinstance(output, Request):
+                followed = True
+                output.meta.setdefault(DETAIL_CACHE_KEY, fingerprint)
+            else:
+                # snapshot now, item pipelines change items after they leave the spider
+                items.append(copy.deepcopy(dict(output)))
+            yield output
+
+        if not followed:
+            cache.put(spider.name, fingerprint, items)
+
+
+class SeleniumDriverReleaseMiddleware:
+    """Returns the driver that loaded a selenium response to SeleniumMiddleware's pool once the callback is done with it
+
+    Callbacks keep using response.meta["driver"] while their output is consumed, so the driver is held until then.
+    """
+
+    def process_spider_output(self, response, result, spider):
+        lease = response.meta.get(SELENIUM_DRIVER_LEASE)
+        if lease is None:
+            yield from result
+            return
+
+        try:
+            yield from result
+        finally:
+            lease.release()
+
+    def process_spider_exception(self, response, exception, spider):
+        lease = response.meta.get(SELENIUM_DRIVER_LEASE)
+        if lease is not None:
+            lease.release()
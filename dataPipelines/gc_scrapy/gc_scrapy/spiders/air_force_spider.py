@@ -7,11 +7,10 @@ from selenium.webdriver.support.ui import Select, WebDriverWait
 from selenium.webdriver import Chrome
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
 import re
-import time
 
 from dataPipelines.gc_scrapy.gc_scrapy.middleware_utils.selenium_request import SeleniumRequest
 from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
-from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider
+from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider, driver_callback
 
 from urllib.parse import urljoin, urlparse
 from datetime import datetime
@@ -50,6 +49,8 @@ class AirForcePubsSpider(GCSeleniumSpider):
 
     ] # URL where the spider begins crawling
 
+    shard_start_urls = True # Each start url is crawled independently, split them across cli crawl shards
+
     file_type = "pdf" # Define filetype for the spider to identify.
 
     cac_required_options = ['physical.pdf', 'PKI certificate required', 'placeholder', 'FOUO', 
@@ -58,6 +59,7 @@ class AirForcePubsSpider(GCSeleniumSpider):
 
     item_count_dropdown_selector = 'label select[name="data_length"]' # Count of a given dropdown's selection options
     table_selector = "table.epubs-table.dataTable.no-footer.dtr-inline" # Define CSS selector for tables
+    next_page_selector = "div.dataTables_paginate.paging_simple_numbers a.paginate_button.current + a" # Next page button element
     
     def select_dropdown(self, driver):
         dropdown = WebDriverWait(driver, 5).until(
@@ -65,6 +67,19 @@ class AirForcePubsSpider(GCSeleniumSpider):
         
         Select(dropdown).select_by_value("100")
 
+    def load_category_page(self, driver, page_url, cat_id):
+        '''
+        Opens a category of the "Product Index" and waits until its requests are done and its list of organizations
+        stopped growing, instead of a fixed sleep.
+        '''
+        driver.get(page_url)
+        self.wait_for_network_idle(driver)
+        try:
+            self.wait_for_element_count_stable(driver, f'#{cat_id} > div > ul > li a', wait=10)
+        except TimeoutException:
+            print(f"No organizations listed at {page_url}")
+
+    @driver_callback
     def parse(self, response):
         '''
         This function finds the the "Product Index" table at the end of each of the "dropdown" (or element tree) pathways.
@@ -73,13 +88,11 @@ class AirForcePubsSpider(GCSeleniumSpider):
         driver: Chrome = response.meta["driver"] # Assign Chrome as the WebDriver instance to perform "user" actions  ##(**What is .meta['driver']?)
         
         for page_url in self.start_urls:
-            driver.get(page_url)
-            time.sleep(5)
-            
-            init_webpage = Selector(text=driver.page_source)
-            
             cat_id_raw = re.search('(catID=\d*)', page_url, re.IGNORECASE) # Find Category ID from URL
             cat_id = str(cat_id_raw.group(0)).replace("ID=", "-").lower()
+
+            self.load_category_page(driver, page_url, cat_id)
+            init_webpage = Selector(text=driver.page_source)
             
             organizations = init_webpage.css(f'#{cat_id} > div > ul > li a::text').getall() # List of organizations in specified category
             
@@ -99,43 +112,25 @@ class AirForcePubsSpider(GCSeleniumSpider):
                     continue
                 
                 all_pubs.click()
- 
-                anchor_after_current_selector = "div.dataTables_paginate.paging_simple_numbers a.paginate_button.current + a" # Next page button element
-                
-                self.select_dropdown(driver)
-                
-                for item in self.parse_table(driver):
+
+                self.select_dropdown(driver) # 100 rows a page if the table has to be paged
+                self.wait_for_table_redraw(driver, self.table_selector)
+                rows = self.iter_table_rows(driver, self.table_selector, next_page=self.next_page_selector)
+                for item in self.parse_table(driver, rows):
                     yield item
-                            
-                try:
-                    last_page_raw = driver.find_element(By.CSS_SELECTOR, '#data_paginate > span > a:last-child')
-                    last_page = int(last_page_raw.text)
-                except:
-                    driver.back()
-                    print(f"Failed to find last page: {org} at {page_url}")
-                    continue
-                
-                while last_page > 1:
-                    driver.execute_script("arguments[0].click();", WebDriverWait(driver, 5).until(
-                        EC.element_to_be_clickable((By.CSS_SELECTOR, anchor_after_current_selector))))
-                    for item in self.parse_table(driver):
-                        yield item
-                    last_page -= 1
-                
-                driver.get(page_url)
-                time.sleep(5)
+
+                self.load_category_page(driver, page_url, cat_id)
                 
 
-    def parse_table(self, driver):
+    def parse_table(self, driver, rows):
         '''
         This function generates a link and metadata for each document in the "Product Index" table on the Air Force E-Publishing 
-        site for download.
+        site for download. rows are the table rows from iter_table_rows, every page of the table.
         '''
-        webpage = Selector(text=driver.page_source) # Raw HTML of webpage
-        row_selector = f'{self.table_selector} tbody tr ' # Define list of table rows
+        source_page_url = driver.current_url
 
         ## Iterate through each row in table get column values as metadata for each downloadable document
-        for row in webpage.css(row_selector):
+        for row in rows:
             product_number_raw = row.xpath('td//text()')[0].extract()
             ## If the table contains no entries then skip
             if product_number_raw == "No data available in table":
@@ -220,8 +215,6 @@ class AirForcePubsSpider(GCSeleniumSpider):
                 or any(x in doc_title for x in self.cac_required_options) \
                 or '-S' in prod_num else False
 
-            source_page_url = driver.current_url
-
             fields = {
                 'doc_name': doc_name,
                 'doc_num': doc_num,
@@ -58,7 +58,7 @@ class ArmySpider(GCSpider):
         This function grabs links from the raw html for the table on page, calling the parse_detail_page function for the 
         list of table links.
         '''
-        table_links = response.css('table td a::attr(href)').extract() # Extract all links in the html table
+        table_links = response.css('table td a[href]') # All links in the html table
 
         # CAC Gate Eval
         registration_required = response.xpath('//div//text()').getall() # Evaluates if 'registration is required' is in the source page
@@ -68,7 +68,10 @@ class ArmySpider(GCSpider):
                 cac_login_required = True
                 break
 
-        yield from response.follow_all([self.pub_url+link for link in table_links], self.parse_detail_page, cb_kwargs={'cac_login_required': cac_login_required}) # Call parse_detail_page function for each link and pass cac_login_required as an argument
+        for link in table_links: # Call parse_detail_page function for each link and pass cac_login_required as an argument
+            row_text = [text.strip() for text in link.xpath('ancestor::tr[1]//text()').getall() if text.strip()]
+            request = response.follow(self.pub_url+link.attrib['href'], self.parse_detail_page, cb_kwargs={'cac_login_required': cac_login_required})
+            yield from self.follow_detail_page(request, row_text, cac_login_required) # Reuses last crawl's item if the table row is unchanged
 
     def parse_detail_page(self, response, cac_login_required):
         '''
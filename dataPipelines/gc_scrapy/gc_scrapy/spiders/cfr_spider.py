@@ -12,6 +12,11 @@ class CFRSpider(GCSpider):
     # the years to grab documents from
     # TODO: Grab only Title 35 from 2000, don't grab all docs
     years = ["2000", "2021", "2022"]
+    # the 2000 edition doesn't change anymore, the rest of the listings are revalidated every crawl
+    http_cache_freshness = [
+        (r"/wssearch/rb//cfr/2000\b", 30 * 24 * 60 * 60),
+        (r"/wssearch/rb/", 0),
+    ]
 
     start_urls = [
         "https://www.govinfo.gov/wssearch/rb/cfr?fetchChildrenOnly=0"
@@ -59,7 +64,8 @@ class CFRSpider(GCSpider):
 
     @staticmethod
     def get_nested_values(data, key='value') -> list:
-        return [cnode.get('nodeValue').get(key) for cnode in data.get('childNodes', [])]
+        """nodeValue[key] of each child node, or the whole nodeValue if key is None"""
+        return [cnode.get('nodeValue') if key is None else cnode.get('nodeValue').get(key) for cnode in data.get('childNodes', [])]
 
     def parse(self, response):
         for year in self.years:
@@ -83,10 +89,12 @@ class CFRSpider(GCSpider):
         if not len(packages):
             return
 
-        for package_id in packages:
+        for package_id, package_node in zip(packages, self.get_nested_values(data, key=None)):
             detail_url = self.get_api_detail_url(package_id)
-            yield response.follow(url=detail_url, callback=self.parse_detail_data, meta={"offset": 0, "year": year},
-                                  headers=self.headers)
+            request = response.follow(url=detail_url, callback=self.parse_detail_data, meta={"offset": 0, "year": year},
+                                      headers=self.headers)
+            # skipped when the package's browse listing entry is unchanged since the last crawl
+            yield from self.follow_detail_page(request, package_node, year)
 
     def parse_detail_data(self, response):
         data = json.loads(response.body)
@@ -1,14 +1,12 @@
 # -*- coding: utf-8 -*-
-from scrapy import Selector
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver import Chrome
-from selenium.common.exceptions import NoSuchElementException
 from datetime import datetime
 from dataPipelines.gc_scrapy.gc_scrapy.utils import parse_timestamp, dict_to_sha256_hex_digest
 from urllib.parse import urlparse
 
 from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
-from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider
+from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider, driver_callback
 
 
 class CoastGuardSpider(GCSeleniumSpider):
@@ -30,7 +28,7 @@ class CoastGuardSpider(GCSeleniumSpider):
     ]
     current_page_selector = 'div.numericDiv ul li.active a.Page'
     next_page_selector = 'div.numericDiv ul li.active + li a'
-    rows_selector = "table.Dashboard tbody tr"
+    table_selector = "table.Dashboard"
 
 
     @staticmethod
@@ -64,6 +62,7 @@ class CoastGuardSpider(GCSeleniumSpider):
         else:
             return None
 
+    @driver_callback
     def parse(self, response):
         driver: Chrome = response.meta["driver"]
 
@@ -74,28 +73,14 @@ class CoastGuardSpider(GCSeleniumSpider):
             self.wait_until_css_clickable(
                 driver, css_selector=self.current_page_selector)
 
-            has_next_page = True
-            while(has_next_page):
-                try:
-                    el = driver.find_element_by_css_selector(
-                        self.next_page_selector)
+            rows = self.iter_table_rows(driver, self.table_selector, next_page=self.next_page_selector)
+            for item in self.parse_table(driver, rows):
+                yield item
 
-                except NoSuchElementException:
-                    # expected when on last page, set exit condition then parse table
-                    has_next_page = False
+    def parse_table(self, driver, rows):
+        source_page_url = driver.current_url
 
-                for item in self.parse_table(driver):
-                    yield item
-
-                if has_next_page:
-                    el.click()
-                    self.wait_until_css_clickable(
-                        driver, css_selector=self.rows_selector)
-
-    def parse_table(self, driver):
-        webpage = Selector(text=driver.page_source)
-
-        for row in webpage.css(self.rows_selector):
+        for row in rows:
             doc_type_num_raw = row.css('td:nth-child(1)::text').get()
 
             if '_' in doc_type_num_raw:
@@ -111,7 +96,6 @@ class CoastGuardSpider(GCSeleniumSpider):
             doc_title_raw = row.css('td:nth-child(2) a::text').get()
             office_primary_resp_raw = row.css('td:nth-child(3)::text').get()
             href_raw = row.css('td:nth-child(2) a::attr(href)').get()
-            source_page_url = driver.current_url
             download_url = self.ensure_full_href_url(href_raw, source_page_url)
             publication_date = row.css('td:nth-child(5)::text').get()
 
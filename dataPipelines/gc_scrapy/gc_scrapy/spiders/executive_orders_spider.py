@@ -21,6 +21,8 @@ class ExecutiveOrdersSpider(GCSpider):
 
     rotate_user_agent = True
     randomly_delay_request = True
+    # the all orders json is large, revalidate it rather than fetching it every crawl
+    http_cache_freshness = [(r"federalregister\.gov", 0)]
 
     @staticmethod
     def get_pub_date(publication_date):
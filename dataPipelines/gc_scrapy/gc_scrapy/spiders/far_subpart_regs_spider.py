@@ -2,7 +2,7 @@ from typing import Iterator, List
 
 from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
 from dataPipelines.gc_scrapy.gc_scrapy.GCSpider import GCSpider
-from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider
+from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider, driver_callback
 from dataPipelines.gc_scrapy.gc_scrapy.utils import parse_timestamp, dict_to_sha256_hex_digest
 from urllib.parse import urlparse
 
@@ -37,6 +37,7 @@ class FarSubpartSpider(GCSeleniumSpider):
             publication_date = ""
         return publication_date
 
+    @driver_callback
     def parse(self, response: TextResponse):
         pub_date = self.parse_pub_date(response)
         yield from self.parse_parts(response, pub_date)
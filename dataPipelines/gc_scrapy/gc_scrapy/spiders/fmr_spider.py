@@ -16,6 +16,7 @@ class FmrSpider(GCSpider):
     download_base_url = 'https://comptroller.defense.gov/'
     doc_type = "DoDFMR"
     rotate_user_agent = True
+    http_cache_freshness = [(r"comptroller\.defense\.gov/FMR/", 0)] # static volume pages, revalidated every crawl
 
     seen = set({})
 
@@ -1,10 +1,10 @@
 import re
 import bs4
-import time
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver import Chrome
 
 from dataPipelines.gc_scrapy.gc_scrapy.doc_item_fields import DocItemFields
-from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider
+from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider, driver_callback
 from dataPipelines.gc_scrapy.gc_scrapy.utils import abs_url, parse_timestamp
 
 
@@ -37,6 +37,8 @@ class IcPoliciesSpider(GCSeleniumSpider):
         f"{base_url}/index.php/who-we-are/organizations/ogc/ogc-related-menus/ogc-related-content/ic-legal-reference-book",
     ]
 
+    shard_start_urls = True # Each start url is crawled independently, split them across cli crawl shards
+
     rotate_user_agent = True
     randomly_delay_request = True
     headers = {
@@ -114,13 +116,18 @@ class IcPoliciesSpider(GCSeleniumSpider):
             else False
         )
 
+    @driver_callback
     def parse(self, response):
         """Parses doc items out of IC Policies and Directives site"""
         driver: Chrome = response.meta["driver"]
 
         for page_url in self.start_urls:
             driver.get(page_url)
-            time.sleep(5)
+            self.wait_for_network_idle(driver)
+            try:
+                self.wait_for_element_count_stable(driver, 'div[itemprop="articleBody"] p a', wait=10)
+            except TimeoutException:
+                print(f"No publications listed at {page_url}")
 
             # parse html response
             div = bs4.BeautifulSoup(driver.page_source, features="html.parser").find(
@@ -18,6 +18,7 @@ class JcsPubsSpider(GCSpider):
     cac_required_options = [
         'CAC', 'PKI certificate required', 'placeholder', 'FOUO']
     rotate_user_agent = True
+    http_cache_freshness = [(r"jcs\.mil/Library", 0)] # static library pages, revalidated every crawl
 
     @staticmethod
     def get_display_doc_type(doc_type):
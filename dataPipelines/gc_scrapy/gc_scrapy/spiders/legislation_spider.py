@@ -19,6 +19,13 @@ class LegislationSpider(GCSpider):
         "https://www.govinfo.gov/wssearch/rb/bills?fetchChildrenOnly=0"
     ]
 
+    shard_start_urls = True # Each start url is crawled independently, split them across cli crawl shards
+    # listings of congresses before the 117th don't change anymore, the rest are revalidated every crawl
+    http_cache_freshness = [
+        (r"/wssearch/rb//(plaw|bills)/(10[3-9]|11[0-6])\b", 7 * 24 * 60 * 60),
+        (r"/wssearch/rb/", 0),
+    ]
+
     headers = {
         "accept": "application/json",
         "accept-language": "en-US,en;q=0.9",
@@ -72,7 +79,8 @@ class LegislationSpider(GCSpider):
 
     @staticmethod
     def get_nested_values(data, key='value') -> list:
-        return [cnode.get('nodeValue').get(key) for cnode in data.get('childNodes', [])]
+        """nodeValue[key] of each child node, or the whole nodeValue if key is None"""
+        return [cnode.get('nodeValue') if key is None else cnode.get('nodeValue').get(key) for cnode in data.get('childNodes', [])]
 
     def populate_public_law(self, data) -> dict:
         package_id = data['documentincontext']['packageId']
@@ -223,9 +231,11 @@ class LegislationSpider(GCSpider):
         if not len(packages):
             return
 
-        for package_id in packages:
+        for package_id, package_node in zip(packages, self.get_nested_values(data, key=None)):
             detail_url = self.get_api_detail_url(package_id)
-            yield response.follow(url=detail_url, callback=self.parse_detail_data, headers=self.headers)
+            request = response.follow(url=detail_url, callback=self.parse_detail_data, headers=self.headers)
+            # skipped when the package's browse listing entry is unchanged since the last crawl
+            yield from self.follow_detail_page(request, package_node)
 
         # iterate offset
         next_offset = current_offset + 1
@@ -1,14 +1,13 @@
 import re
-import time
+from time import monotonic
 from scrapy.http import TextResponse
 from scrapy.selector import Selector
-from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver import Chrome
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
-from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider
+from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider, driver_callback
 from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
 from selenium.webdriver.common.keys import Keys
 
@@ -23,26 +22,34 @@ class MARADMINSpider(GCSeleniumSpider):
     start_urls = ['https://www.marines.mil/News/Messages/MARADMINS/']
     allowed_domains = ['marines.mil/']
 
+    rows_selector = '.items.alist-more-here > *' # first row is the header
+    next_page_selector = 'a.fas.fa.fa-angle-right.da_next_pager'
+
+    @driver_callback
     def parse(self, response: TextResponse):
         driver: Chrome = response.meta["driver"]
+        started = monotonic()
+        pages = 0
 
         while True:
             try:
                 self.wait_until_css_located(driver, '#Form')
-                doc_rows: list = driver.find_elements_by_class_name('items.alist-more-here > *')
+                self.wait_until_css_located(driver, self.rows_selector)
+                # the whole page in one call, the rows are parsed locally instead of 6 driver calls each
+                webpage = Selector(text=driver.page_source)
+                page_url = driver.current_url
             except Exception as e:
-                print('error in grabbing table: ' + e)
+                print('error in grabbing table: ' + str(e))
                 return
 
-            time.sleep(2)  # wait between pages to disencourage getting banned. adds ~16 minutes to runtime
-            for doc_row in doc_rows[1:]:
+            for doc_row in webpage.css(self.rows_selector)[1:]:
                 try:
                     doc_type = "MARADMIN"
-                    doc_title = doc_row.find_element_by_class_name('msg-title.msg-col a').get_attribute("textContent")
-                    doc_num = doc_row.find_element_by_class_name('msg-num.msg-col a').get_attribute("textContent")
-                    publication_date = doc_row.find_element_by_class_name('msg-pub-date.msg-col').get_attribute("textContent")
-                    web_url = doc_row.find_element_by_class_name('msg-title.msg-col a').get_attribute('href')
-                    doc_status = doc_row.find_element_by_class_name('msg-status.msg-col').get_attribute('textContent').strip()
+                    doc_title = doc_row.css('.msg-title.msg-col a').xpath('string()').get()
+                    doc_num = doc_row.css('.msg-num.msg-col a').xpath('string()').get()
+                    publication_date = doc_row.css('.msg-pub-date.msg-col').xpath('string()').get()
+                    web_url = urljoin(page_url, doc_row.css('.msg-title.msg-col a::attr(href)').get())
+                    doc_status = doc_row.css('.msg-status.msg-col').xpath('string()').get().strip()
                     doc_name = doc_type + " " + doc_num.replace("/", "-") + " " + doc_title
 
                     is_revoked = doc_status != 'Active'
@@ -64,22 +71,24 @@ class MARADMINSpider(GCSeleniumSpider):
                 except Exception as e:
                     print('error in processing row: ' + str(e))
 
-            try:
-                table: WebElement = driver.find_element_by_css_selector('#Form')
-                next_btn: WebElement = driver.find_element_by_css_selector('a.fas.fa.fa-angle-right.da_next_pager')
-                try:
-                    next_btn.send_keys(Keys.ENTER)
-                    WebDriverWait(driver, 20).until(EC.staleness_of(table))
-                except Exception as e:
-                    print("Error with loading next page: " + str(e))
-                    break
-            except NoSuchElementException:
+            pages += 1
+            self.crawler.stats.set_value('maradmin/pages', pages, spider=self)
+            self.crawler.stats.set_value(
+                'maradmin/seconds_per_page', round((monotonic() - started) / pages, 3), spider=self)
+
+            next_btns = driver.find_elements_by_css_selector(self.next_page_selector)
+            if not next_btns:
                 print("Last button encountered. Ending crawler")
                 break
-            
-            
-        
 
+            table: WebElement = driver.find_element_by_css_selector('#Form')
+            try:
+                next_btns[0].send_keys(Keys.ENTER)
+                # the form is replaced by the next page's, the rows are waited for at the top of the loop
+                WebDriverWait(driver, 20).until(EC.staleness_of(table))
+            except Exception as e:
+                print("Error with loading next page: " + str(e))
+                break
 
     def populate_doc_item(self, fields):
         '''
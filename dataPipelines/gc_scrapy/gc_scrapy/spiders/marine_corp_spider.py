@@ -354,8 +354,10 @@ class MarineCorpSpider(GCSpider):
                 }
 
                 # follow href to get downloadable item link, pass in incomplete item
-                yield scrapy.Request(
-                    follow_href, callback=self.parse_download_page, meta=incomplete_item)
+                # skipped when this listing row is unchanged since the last crawl, see GCSpider.follow_detail_page
+                yield from self.follow_detail_page(
+                    scrapy.Request(follow_href, callback=self.parse_download_page, meta=incomplete_item),
+                    doc_type_raw, doc_type_num_raw, doc_title_raw, doc_status_raw)
 
             except Exception as e:
                 print('ERROR', type(e), e)
@@ -1,15 +1,14 @@
 from typing import Any, Generator
-import time
 import bs4
 from scrapy.http import Response
 
 from selenium.webdriver import Chrome
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 
 from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
 from dataPipelines.gc_scrapy.gc_scrapy.doc_item_fields import DocItemFields
-from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider
+from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider, driver_callback
 from dataPipelines.gc_scrapy.gc_scrapy.utils import parse_timestamp
 
 
@@ -73,6 +72,7 @@ class NavyMedSpider(GCSeleniumSpider):
         except Exception as exc:
             raise NoSuchElementException from exc
 
+    @driver_callback
     def parse(self, response: Response) -> Generator[DocItem, Any, None]:
         """Parse doc items out of navy med pubs site"""
         driver: Chrome = response.meta["driver"]
@@ -82,7 +82,14 @@ class NavyMedSpider(GCSeleniumSpider):
             driver.get(
                 self.start_urls[0]
             )  # navigating to the homepage again to reset the page (because refresh doesn't work)
-            time.sleep(8)  # waiting to be sure that it loaded
+            # waiting to be sure that it loaded, requests done and every tab rendered
+            self.wait_for_network_idle(driver)
+            try:
+                self.wait_for_element_count_stable(
+                    driver, f"{self.tabs_ul_selector} li a", min_count=len(self.tabs_doc_type_dict)
+                )
+            except TimeoutException:
+                print("Tabs did not finish loading: " + self.tabs_ul_selector)
             try:
                 button = self.get_tab_button_els(driver)[i]
             except Exception as e:
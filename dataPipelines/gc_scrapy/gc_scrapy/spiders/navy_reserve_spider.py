@@ -5,15 +5,13 @@ from datetime import datetime
 from dataPipelines.gc_scrapy.gc_scrapy.utils import parse_timestamp, dict_to_sha256_hex_digest
 from urllib.parse import urlparse
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import Select, WebDriverWait
+from selenium.webdriver.support.ui import Select
 from selenium.webdriver import Chrome
-from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
-from itertools import zip_longest
+from functools import partial
 import re
 
 from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
-from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider
+from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import GCSeleniumSpider, driver_callback
 
 from time import sleep
 
@@ -39,6 +37,7 @@ class NavyReserveSpider(GCSeleniumSpider):
         else:
             return "Document"
 
+    @driver_callback
     def parse(self, response):
         driver: Chrome = response.meta["driver"]
 
@@ -66,94 +65,85 @@ class NavyReserveSpider(GCSeleniumSpider):
         table_headers_raw = init_webpage.css(
             'div.base-container.blue-header2 h2.title span.Head::text').getall()
 
+        source_page_url = driver.current_url
+
         # associate a table header with a table index
         for table_index, header_text_raw in enumerate(table_headers_raw):
 
             doc_type = header_text_raw.strip()
 
-            has_next_page = True
-            while has_next_page:
-                # have to reselect page source each loop b/c it refreshes on page change
-                webpage = Selector(text=driver.page_source)
-
-                # grab associated tables again each page
-                data_table = webpage.css(self.tables_selector)[table_index]
-                paging_table = driver.find_elements_by_css_selector('table.PagingTable')[
-                    table_index]
-
-                # check has next page link
-                try:
-                    el = paging_table.find_element_by_xpath(
-                        "//a[contains(text(), 'Next')]")
-                except (StaleElementReferenceException, NoSuchElementException):
-                    # expected when one page or on last page, set exit condition then parse table
-                    has_next_page = False
-                except Exception as e:
-                    # other exceptions not expected, dont page this table and try to continue
-                    print(
-                        f'Unexpected Exception - attempting to continue: {e}')
-                    has_next_page = False
-
+            # every page of the table, paging reloads it so wait until it's stale from page load, can be slow
+            rows = self.iter_table_rows(
+                driver,
+                self.tables_selector,
+                next_page=partial(self.find_next_page_link, table_index=table_index),
+                table_index=table_index,
+                rows_selector='tbody tr:not(.dnnGridHeader)',
+                page_wait=100
+            )
+            for tr in rows:
                 # parse data table
                 try:
-                    for tr in data_table.css('tbody tr:not(.dnnGridHeader)'):
-                        doc_num_raw = tr.css('td:nth-child(1)::text').get()
-                        doc_title_raw = tr.css('td:nth-child(2)::text').get()
-                        href_raw = tr.css(
-                            'td:nth-child(3) a::attr(href)').get()
-
-                        doc_num = doc_num_raw.strip().replace(" ", "_").replace(u'\u200b', '')
-                        if not bool(re.search(r'\d', doc_num)):
-                            continue
-                        if "RESPERSMAN" in driver.current_url:
-                            type_suffix = ""
-                        elif '.' in doc_num:
-                            type_suffix = "INST"
-                        else:
-                            type_suffix = "NOTE"
-
-                        doc_title = doc_title_raw.strip()
-
-                        doc_type = type_prefix + type_suffix
-                        doc_name = doc_type + " " + doc_num
-                        if re.search(r'\(\d\)', doc_title):
-                            doc_name_suffix = re.split('\(', doc_title)
-                            doc_name_suffix = re.split(
-                                '\)', doc_name_suffix[1])
-                            if doc_name_suffix[0].strip() != "":
-                                doc_name = doc_name + '_' + doc_name_suffix[0]
-                            if len(doc_name_suffix) > 1 and doc_name_suffix[1].strip() != "":
-                                doc_name = doc_name + '_' + \
-                                    doc_name_suffix[1].strip().replace(
-                                        " ", "_")
-
-                        web_url = self.ensure_full_href_url(
-                            href_raw, driver.current_url)
-
-                        doc_title = self.ascii_clean(doc_title_raw)
-
-                        fields = {
-                            "doc_name": doc_name.strip(),
-                            "doc_title": doc_title.strip(),
-                            "doc_num": doc_num.strip(),
-                            "doc_type": doc_type.strip(),
-                            "source_page_url": driver.current_url,
-                            "href_raw": href_raw,
-                            "download_url": web_url.replace(' ', '%20')
-                            }
-                        yield self.populate_doc_item(fields)
-
-                except:
+                    doc_num_raw = tr.css('td:nth-child(1)::text').get()
+                    doc_title_raw = tr.css('td:nth-child(2)::text').get()
+                    href_raw = tr.css(
+                        'td:nth-child(3) a::attr(href)').get()
+
+                    doc_num = doc_num_raw.strip().replace(" ", "_").replace(u'\u200b', '')
+                    if not bool(re.search(r'\d', doc_num)):
+                        continue
+                    if "RESPERSMAN" in source_page_url:
+                        type_suffix = ""
+                    elif '.' in doc_num:
+                        type_suffix = "INST"
+                    else:
+                        type_suffix = "NOTE"
+
+                    doc_title = doc_title_raw.strip()
+
+                    doc_type = type_prefix + type_suffix
+                    doc_name = doc_type + " " + doc_num
+                    if re.search(r'\(\d\)', doc_title):
+                        doc_name_suffix = re.split('\(', doc_title)
+                        doc_name_suffix = re.split(
+                            '\)', doc_name_suffix[1])
+                        if doc_name_suffix[0].strip() != "":
+                            doc_name = doc_name + '_' + doc_name_suffix[0]
+                        if len(doc_name_suffix) > 1 and doc_name_suffix[1].strip() != "":
+                            doc_name = doc_name + '_' + \
+                                doc_name_suffix[1].strip().replace(
+                                    " ", "_")
+
+                    web_url = self.ensure_full_href_url(
+                        href_raw, source_page_url)
+
+                    doc_title = self.ascii_clean(doc_title_raw)
+
+                    fields = {
+                        "doc_name": doc_name.strip(),
+                        "doc_title": doc_title.strip(),
+                        "doc_num": doc_num.strip(),
+                        "doc_type": doc_type.strip(),
+                        "source_page_url": source_page_url,
+                        "href_raw": href_raw,
+                        "download_url": web_url.replace(' ', '%20')
+                        }
+                except Exception as e:
                     print(
                         f'Unexpected Parsing Exception - attempting to continue: {e}')
-                    pass
+                    continue
 
-                if has_next_page:
-                    el.click()
-                    # wait until paging table is stale from page load, can be slow
-                    WebDriverWait(driver, 100).until(
-                        EC.staleness_of(paging_table))
+                yield self.populate_doc_item(fields)
 
+    @staticmethod
+    def find_next_page_link(driver, table_index):
+        """Next link of the table's paging table, None when it has one page or is on its last page"""
+        paging_tables = driver.find_elements_by_css_selector('table.PagingTable')
+        if table_index >= len(paging_tables):
+            return None
+        links = paging_tables[table_index].find_elements_by_xpath(
+            ".//a[contains(text(), 'Next')]")
+        return links[0] if links else None
 
     def populate_doc_item(self, fields:dict) -> DocItem:
         display_org = 'US Navy Reserve'  # Level 1: GC app 'Source' filter for docs from this crawler
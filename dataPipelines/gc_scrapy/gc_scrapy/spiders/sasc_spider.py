@@ -139,7 +139,10 @@ class SASCSpider(GCSpider):
                     ## Instantiate DocItem class and assign document's metadata values
                     aside_doc = self.populate_doc_item(fields)
 
-                    yield scrapy.Request(aside_href, callback=self.follow_pdf_redirect, meta={'doc': aside_doc})
+                    # the redirect page and pdf are only requested to find the final url, skipped if this link is unchanged
+                    yield from self.follow_detail_page(
+                        scrapy.Request(aside_href, callback=self.follow_pdf_redirect, meta={'doc': aside_doc}),
+                        aside_doc['version_hash_raw_data'])
 
             #########################################################
             # Get pdfs of each witness APQ and testimony
@@ -193,7 +196,9 @@ class SASCSpider(GCSpider):
 
                         witness_doc = self.populate_doc_item(fields)
 
-                        yield scrapy.Request(witness_href, callback=self.follow_pdf_redirect, meta={'doc': witness_doc})
+                        yield from self.follow_detail_page(
+                            scrapy.Request(witness_href, callback=self.follow_pdf_redirect, meta={'doc': witness_doc}),
+                            witness_doc['version_hash_raw_data'])
         except Exception as e:
             print(e)
 
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+gc_crawler.streaming_download
+-----------------
+HTTP download handler that writes document bodies to a temp file as they arrive instead of buffering them in memory
+"""
+from pathlib import Path
+from typing import Optional, Tuple, Union
+from time import monotonic
+import tempfile
+import hashlib
+import inspect
+import json
+import os
+import re
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler, ScrapyAgent, _ResponseReader
+from twisted.internet import defer
+
+
+# request meta keys
+# directory to stream the body to, set by FileDownloadPipeline for document downloads
+STREAM_TO_DIR = "download_stream_dir"
+# set on the response meta, the temp file holding the body, its size and sha256 hex digest, the response body is empty
+STREAMED_PATH = "download_streamed_path"
+STREAMED_BYTES = "download_streamed_bytes"
+STREAMED_SHA256 = "download_streamed_sha256"
+# set by the handler, the time.monotonic() the download went out at, for throughput
+DOWNLOAD_STARTED = "download_started"
+# once the Content-Length is known the download timeout is extended to give the body this many bytes per second,
+# up to DOWNLOAD_MAX_TIMEOUT seconds, see AdaptiveConcurrencyMiddleware
+MIN_BYTES_PER_SECOND = "download_min_bytes_per_second"
+DOWNLOAD_MAX_TIMEOUT = "download_max_timeout"
+# directory truncated or interrupted downloads are kept in to be resumed with a Range request, see PartialDownloads
+PARTIAL_DIR = "download_partial_dir"
+# set by the handler on a request resuming a kept partial download, the bytes of it already on disk
+RESUMED_FROM = "download_resumed_from"
+
+# the handler builds on scrapy internals that older releases don't have (ScrapyAgent crawler argument added in 2.5,
+# _ResponseReader._finish_response), without them every request is downloaded by the plain HTTP11DownloadHandler
+STREAMING_SUPPORTED = (
+    "crawler" in inspect.signature(ScrapyAgent.__init__).parameters and hasattr(_ResponseReader, "_finish_response")
+)
+
+# mkstemp creates files only the owner can read, downloads get the permissions open() would have given them
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class BytesInFlight:
+    """Bytes received by streaming downloads and not yet written to disk, across every download of a handler"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.total = 0
+        self.max_total = 0
+
+    def add(self, size: int) -> None:
+        self.total += size
+        self.max_total = max(self.max_total, self.total)
+
+    def remove(self, size: int) -> None:
+        self.total -= size
+
+    @property
+    def over_limit(self) -> bool:
+        return self.total > self.limit
+
+
+class PartialDownloads:
+    """Downloads cut short, kept by url in root with the validators a Range request resuming them is sent with
+
+    Only bodies of known size from servers accepting byte ranges, with an ETag or Last-Modified, are kept,
+    so If-Range makes sure the rest of the body belongs to the same version of the file.
+    """
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def _paths(self, url: str) -> Tuple[Path, Path]:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.root / key, self.root / f"{key}.json"
+
+    def get(self, url: str) -> Optional[dict]:
+        """The kept download of url, with its size on disk, None if there is none"""
+        data_path, info_path = self._paths(url)
+        try:
+            with open(info_path) as f:
+                info = json.load(f)
+            info["size"] = data_path.stat().st_size
+        except (OSError, ValueError):
+            return None
+
+        if info.get("url") != url or not 0 < info["size"] < info.get("total", 0):
+            self.discard(url)
+            return None
+        return info
+
+    def keep(self, url: str, path: Union[str, Path], total: int, etag: Optional[str], last_modified: Optional[str]) -> None:
+        """Moves the partial body at path into the store"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        data_path, info_path = self._paths(url)
+        os.replace(path, data_path)
+        with open(info_path, "w") as f:
+            json.dump({"url": url, "total": total, "etag": etag, "last_modified": last_modified}, f)
+
+    def take(self, url: str, path: Union[str, Path]) -> None:
+        """Moves the kept partial body of url to path, to append the rest of the body to"""
+        data_path, info_path = self._paths(url)
+        os.replace(data_path, path)
+        info_path.unlink()
+
+    def discard(self, url: str) -> None:
+        for path in self._paths(url):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def get_content_encoding(txresponse) -> Optional[bytes]:
+    """The Content-Encoding of txresponse, None if it has none or identity"""
+    encoding = b",".join(txresponse.headers.getRawHeaders(b"content-encoding", [])).strip().lower()
+    return encoding if encoding and encoding != b"identity" else None
+
+
+def get_resume_validators(txresponse) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """(ETag, Last-Modified) a body of txresponse can be resumed with, None if the server doesn't allow resuming it"""
+    headers = txresponse.headers
+    accept_ranges = b",".join(headers.getRawHeaders(b"accept-ranges", [])).lower()
+    if txresponse.code != 206 and b"bytes" not in accept_ranges:
+        return None
+
+    etag = (headers.getRawHeaders(b"etag") or [None])[-1]
+    last_modified = (headers.getRawHeaders(b"last-modified") or [None])[-1]
+    # weak etags can't be used in If-Range
+    if etag and etag.startswith(b"W/"):
+        etag = None
+    if not etag and not last_modified:
+        return None
+    return tuple(value.decode("latin-1") if value else None for value in (etag, last_modified))
+
+
+_CONTENT_RANGE_RE = re.compile(rb"bytes\s+(\d+)-(\d+)/(\d+)")
+
+
+def get_content_range(txresponse) -> Optional[Tuple[int, int]]:
+    """(first byte, total size) from the Content-Range of a 206 response, None if it has none or an unknown total"""
+    content_range = (txresponse.headers.getRawHeaders(b"content-range") or [b""])[-1]
+    match = _CONTENT_RANGE_RE.match(content_range.strip())
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(3))
+
+
+class _FileResponseReader(_ResponseReader):
+    """_ResponseReader that buffers at most chunk_size bytes before appending them to a temp file, hashing them on the way
+
+    Buffers are also flushed whenever the handler's bytes in flight go over their limit, so memory stays flat.
+    The size written is checked against expected_total, a body cut short is kept in partials to be resumed if given.
+    """
+
+    def __init__(
+        self,
+        *args,
+        stream_dir: str,
+        chunk_size: int,
+        in_flight: BytesInFlight,
+        expected_total: Optional[int] = None,
+        partials: Optional[PartialDownloads] = None,
+        resume_validators: Tuple[Optional[str], Optional[str]] = (None, None),
+        resumed_from: int = 0,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        fd, self.temp_path = tempfile.mkstemp(dir=stream_dir, prefix=".", suffix=".part")
+        os.chmod(self.temp_path, 0o666 & ~_UMASK)
+        self._file = os.fdopen(fd, "wb")
+        self._chunk_size = chunk_size
+        self._in_flight = in_flight
+        self._buffered = 0
+        self._expected_total = expected_total
+        self._partials = partials
+        self._resume_validators = resume_validators
+        self._resumed_from = resumed_from
+        self._sha256 = hashlib.sha256()
+        if resumed_from:
+            # the rest of the body is appended to the kept partial body, hashed later from disk if need be
+            self._file.close()
+            partials.take(self._request.url, self.temp_path)
+            self._file = open(self.temp_path, "ab")
+            self._sha256 = None
+        # cancelled, timed out or lost the connection, the body so far is kept if it can be resumed
+        self._finished.addErrback(self._keep_or_remove_temp_file)
+
+    @property
+    def size(self) -> int:
+        """Bytes of the body on disk, including those of a resumed partial download"""
+        return self._resumed_from + self._bytes_received
+
+    def _keep_or_remove_temp_file(self, failure=None):
+        self.close()
+        over_maxsize = self._maxsize and self.size > self._maxsize
+        if self._partials is not None and self._expected_total and self.size and not over_maxsize:
+            try:
+                self._partials.keep(self._request.url, self.temp_path, self._expected_total, *self._resume_validators)
+                return failure
+            except OSError as e:
+                print("Failed to keep partial download of", self._request.url, e)
+        self.close(remove=True)
+        return failure
+
+    def _flush(self) -> None:
+        if self._buffered:
+            self._file.write(self._bodybuf.getvalue())
+            self._bodybuf.seek(0)
+            self._bodybuf.truncate()
+            self._in_flight.remove(self._buffered)
+            self._buffered = 0
+
+    def close(self, remove: bool = False) -> None:
+        if not self._file.closed:
+            self._flush()
+            self._file.close()
+        if remove and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def dataReceived(self, bodyBytes):
+        if self._finished.called:
+            return
+
+        super().dataReceived(bodyBytes)
+        # the parent cancels the download when it goes over maxsize, the temp file is removed by then
+        if self._finished.called:
+            return
+
+        if self._sha256:
+            self._sha256.update(bodyBytes)
+        self._buffered += len(bodyBytes)
+        self._in_flight.add(len(bodyBytes))
+        if self._buffered >= self._chunk_size or self._in_flight.over_limit:
+            self._flush()
+
+    def _finish_response(self, flags=None, failure=None):
+        self.close()
+        self._request.meta[STREAMED_BYTES] = self.size
+        flags = list(flags or [])
+        if self._expected_total is not None and self.size != self._expected_total:
+            # cut short, there is no file for the response, only a partial download to resume if it could be kept
+            self._keep_or_remove_temp_file()
+            self._request.meta.pop(STREAMED_PATH, None)
+            self._request.meta.pop(STREAMED_SHA256, None)
+            if "dataloss" not in flags:
+                flags.append("dataloss")
+        else:
+            self._request.meta[STREAMED_PATH] = self.temp_path
+            self._request.meta[STREAMED_SHA256] = self._sha256.hexdigest() if self._sha256 else None
+            flags.append("streamed")
+
+        self._finished.callback({
+            "txresponse": self._txresponse,
+            "body": b"",
+            "flags": flags,
+            "certificate": self._certificate,
+            "ip_address": self._ip_address,
+            "failure": failure,
+        })
+
+
+class StreamingScrapyAgent(ScrapyAgent):
+    def __init__(self, *args, chunk_size: int, in_flight: BytesInFlight, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._chunk_size = chunk_size
+        self._in_flight = in_flight
+
+    def _extend_timeout(self, txresponse, request) -> None:
+        """Gives a body of known size MIN_BYTES_PER_SECOND to arrive in, rather than the timeout for small pages"""
+        min_bytes_per_second = request.meta.get(MIN_BYTES_PER_SECOND)
+        timeout_call = getattr(self, "_timeout_cl", None)
+        if not min_bytes_per_second or not isinstance(txresponse.length, int):
+            return
+        if not timeout_call or not timeout_call.active():
+            return
+
+        wanted = txresponse.length / min_bytes_per_second
+        max_timeout = request.meta.get(DOWNLOAD_MAX_TIMEOUT)
+        if max_timeout:
+            wanted = min(wanted, max_timeout)
+        if wanted > timeout_call.getTime() - timeout_call.seconds():
+            timeout_call.reset(wanted)
+
+    def _cb_bodyready(self, txresponse, request):
+        self._extend_timeout(txresponse, request)
+        stream_dir: Optional[str] = request.meta.get(STREAM_TO_DIR)
+        partials = PartialDownloads(request.meta[PARTIAL_DIR]) if request.meta.get(PARTIAL_DIR) else None
+        resumed_from = request.meta.get(RESUMED_FROM, 0)
+        if resumed_from and txresponse.code != 206:
+            # the whole body is coming, the file changed since (If-Range didn't match) or ranges aren't served anymore
+            partials.discard(request.url)
+            resumed_from = request.meta[RESUMED_FROM] = 0
+
+        # only successful bodies are worth keeping, redirects and errors are small and handled as usual
+        if not stream_dir or not 200 <= txresponse.code < 300 or txresponse.length == 0:
+            return super()._cb_bodyready(txresponse, request)
+
+        # compressed bodies are buffered for HttpCompressionMiddleware to decode, on disk they'd stay compressed
+        if get_content_encoding(txresponse):
+            if resumed_from:
+                partials.discard(request.url)
+                txresponse._transport._producer.loseConnection()
+                raise defer.CancelledError(
+                    f"Cancelling download of {request.url}: range of a {get_content_encoding(txresponse)} encoded body"
+                )
+            return super()._cb_bodyready(txresponse, request)
+
+        expected_total = txresponse.length if isinstance(txresponse.length, int) else None
+        if resumed_from:
+            content_range = get_content_range(txresponse)
+            if not content_range or content_range[0] != resumed_from:
+                partials.discard(request.url)
+                txresponse._transport._producer.loseConnection()
+                raise defer.CancelledError(
+                    f"Cancelling download of {request.url}: range {content_range} doesn't resume at {resumed_from}"
+                )
+            expected_total = content_range[1]
+
+        maxsize = request.meta.get("download_maxsize", self._maxsize)
+        warnsize = request.meta.get("download_warnsize", self._warnsize)
+        fail_on_dataloss = request.meta.get("download_fail_on_dataloss", self._fail_on_dataloss)
+        expected_size = expected_total if expected_total is not None else -1
+        if maxsize and expected_size > maxsize:
+            txresponse._transport._producer.loseConnection()
+            raise defer.CancelledError(
+                f"Cancelling download of {request.url}: expected response size ({expected_size}) "
+                f"larger than download max size ({maxsize})."
+            )
+
+        def _cancel(_):
+            txresponse._transport._producer.abortConnection()
+
+        d = defer.Deferred(_cancel)
+        reader_kwargs = dict(
+            finished=d,
+            txresponse=txresponse,
+            request=request,
+            maxsize=maxsize,
+            warnsize=warnsize,
+            fail_on_dataloss=fail_on_dataloss,
+            crawler=self._crawler,
+            stream_dir=stream_dir,
+            chunk_size=self._chunk_size,
+            in_flight=self._in_flight,
+            expected_total=expected_total,
+        )
+        resume_validators = get_resume_validators(txresponse) if partials and expected_total else None
+        if resume_validators:
+            reader_kwargs.update(partials=partials, resume_validators=resume_validators, resumed_from=resumed_from)
+        reader = _FileResponseReader(**reader_kwargs)
+        txresponse.deliverBody(reader)
+
+        # save response for timeouts
+        self._txresponse = txresponse
+
+        return d
+
+
+class StreamingDownloadHandler(HTTP11DownloadHandler):
+    """HTTP11DownloadHandler streaming the bodies of requests with STREAM_TO_DIR in meta to disk
+
+    DOWNLOAD_STREAM_CHUNK_SIZE bytes are buffered per download before they're written,
+    DOWNLOAD_STREAM_MAX_BYTES_IN_FLIGHT caps the bytes buffered across all downloads.
+    Requests with PARTIAL_DIR in meta resume a download kept there from an earlier try with a Range request.
+    Bodies sent with a Content-Encoding are buffered as usual. On scrapy releases without the internals it builds on,
+    see STREAMING_SUPPORTED, it downloads like HTTP11DownloadHandler.
+    """
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        if not STREAMING_SUPPORTED:
+            print("StreamingDownloadHandler: this scrapy version can't stream downloads, bodies are buffered in memory")
+        self._chunk_size = settings.getint("DOWNLOAD_STREAM_CHUNK_SIZE", 2**20)
+        self._in_flight = BytesInFlight(settings.getint("DOWNLOAD_STREAM_MAX_BYTES_IN_FLIGHT", 16 * 2**20))
+
+    def download_request(self, request, spider):
+        if not STREAMING_SUPPORTED:
+            return super().download_request(request, spider)
+
+        agent = StreamingScrapyAgent(
+            contextFactory=self._contextFactory,
+            pool=self._pool,
+            maxsize=getattr(spider, "download_maxsize", self._default_maxsize),
+            warnsize=getattr(spider, "download_warnsize", self._default_warnsize),
+            fail_on_dataloss=self._fail_on_dataloss,
+            crawler=self._crawler,
+            chunk_size=self._chunk_size,
+            in_flight=self._in_flight,
+        )
+        request.meta[DOWNLOAD_STARTED] = monotonic()
+        if request.meta.get(STREAM_TO_DIR) and request.meta.get(PARTIAL_DIR):
+            self._add_range_headers(request, PartialDownloads(request.meta[PARTIAL_DIR]))
+        d = agent.download_request(request)
+        if request.meta.get(STREAM_TO_DIR):
+            d.addCallback(self._record_stats, request, spider)
+        return d
+
+    @staticmethod
+    def _add_range_headers(request, partials: PartialDownloads) -> None:
+        """Asks for the rest of the body if part of it was kept from an earlier try"""
+        # a retry of a resumed request carries its headers, whose partial download may be gone by now
+        request.headers.pop("Range", None)
+        request.headers.pop("If-Range", None)
+        request.meta.pop(RESUMED_FROM, None)
+        partial = partials.get(request.url)
+        if not partial:
+            return
+
+        request.headers["Range"] = f"bytes={partial['size']}-"
+        request.headers["If-Range"] = partial["etag"] or partial["last_modified"]
+        # kept bodies are never encoded, the range has to be of the unencoded body too
+        request.headers["Accept-Encoding"] = "identity"
+        request.meta[RESUMED_FROM] = partial["size"]
+
+    def _record_stats(self, response, request, spider):
+        if not self._crawler:
+            return response
+
+        stats = self._crawler.stats
+        if "streamed" in response.flags:
+            stats.inc_value("streaming_download/response_count", spider=spider)
+            stats.inc_value("streaming_download/response_bytes", request.meta[STREAMED_BYTES], spider=spider)
+            stats.max_value("streaming_download/max_bytes_in_flight", self._in_flight.max_total, spider=spider)
+        if "dataloss" in response.flags:
+            stats.inc_value("streaming_download/truncated_count", spider=spider)
+        if request.meta.get(RESUMED_FROM) and response.status == 206:
+            stats.inc_value("streaming_download/resumed_count", spider=spider)
+            stats.inc_value("streaming_download/resumed_bytes", request.meta[RESUMED_FROM], spider=spider)
+        return response
@@ -5,7 +5,7 @@ gc_crawler.utils
 Various gc_crawler util functions/classes used in other modules
 """
 from pathlib import Path
-from typing import Union, List, Any, Dict, Generator, Iterable
+from typing import Union, List, Any, Callable, Dict, Generator, Iterable, Set
 import zipfile
 import copy
 import tempfile
@@ -143,6 +143,20 @@ def iter_all_files(dir_path: Union[Path, str], recursive: bool = True) -> Iterab
             yield file
 
 
+def get_shard(items: Iterable[Any], shard_index: int, shard_count: int) -> List[Any]:
+    """Deterministically partitions items round robin and returns the ones assigned to the given shard
+    :param items: ordered items to partition
+    :param shard_index: 0 based index of the shard, must be less than shard_count
+    :param shard_count: total number of shards
+
+    :returns: items assigned to the shard, in their original order
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {shard_index}/{shard_count}")
+
+    return list(items)[shard_index::shard_count]
+
+
 def unzip_all(zip_file: Union[Path, str], output_dir: str) -> List[Path]:
     """Unzip all items in the input file and place them inside output_dir
     :param zip_file: path to zip file
@@ -227,38 +241,124 @@ def extract_title_42_subfile_names(filename: str, parent_filename: str) -> str:
     return output_filename
 
 
-def unzip_docs_as_needed(input_dir: Union[Path, str], output_dir: Union[Path, str], doc_type: str) -> List[Path]:
+class ZipLimitExceeded(RuntimeError):
+    """An archive nests deeper or unpacks to more bytes than extract_zip_members allows"""
+
+
+class AvailablePathIndex:
+    """Hands out paths that don't overwrite existing files or each other, like get_available_path
+
+    Paths handed out are remembered, and the next _dupN counter of each desired path is kept, so a name colliding many
+    times doesn't probe the filesystem from _dup1 every time.
+    """
+
+    def __init__(self):
+        self.claimed: Set[Path] = set()
+        self.next_dup: Dict[Path, int] = {}
+
+    def claim(self, desired_path: Union[str, Path]) -> Path:
+        desired_path = Path(desired_path).resolve()
+        candidate = desired_path
+        while candidate in self.claimed or candidate.exists():
+            counter = self.next_dup.get(desired_path, 1)
+            self.next_dup[desired_path] = counter + 1
+            candidate = desired_path.with_name(f"{desired_path.stem}_dup{counter}{desired_path.suffix}")
+
+        self.claimed.add(candidate)
+        return candidate
+
+
+def extract_zip_members(
+    zip_file: Union[Path, str, t.IO[bytes]],
+    doc_type: str,
+    destination_for: Callable[[str], Path],
+    max_depth: int = 5,
+    max_bytes: int = 10 * 2**30,
+    spool_max_memory: int = 64 * 2**20,
+    path_index: t.Optional[AvailablePathIndex] = None,
+    _depth: int = 0,
+    _extracted: t.Optional[List[int]] = None,
+) -> List[Path]:
+    """Streams the members of a zip with the doc_type extension straight to their destination, other members are
+    never written. Nested zips are read through a spooled temp file, in memory up to spool_max_memory bytes.
+
+    :param zip_file: path or seekable file object of the zip
+    :param doc_type: extension of the members to extract, e.g. "pdf"
+    :param destination_for: member file name (without its dirs) -> desired path, made collision free with path_index
+    :param max_depth: levels of nested zips to open, deeper ones raise ZipLimitExceeded
+    :param max_bytes: uncompressed bytes to extract in total, going over raises ZipLimitExceeded
+    :param spool_max_memory: nested zips larger than this are spooled to disk
+    :param path_index: index of paths handed out, shared across the nested zips
+
+    :returns: paths of the extracted files, in member name order with nested zips expanded in place
+    """
+    path_index = path_index or AvailablePathIndex()
+    extracted_bytes = _extracted if _extracted is not None else [0]
+    extracted = []
+
+    with zipfile.ZipFile(zip_file) as zip_ref:
+        for info in sorted(zip_ref.infolist(), key=lambda i: i.filename):
+            if info.is_dir():
+                continue
+
+            member_name = Path(info.filename).name
+            suffix = Path(member_name).suffix.lower()
+            if suffix == ".zip":
+                if _depth + 1 > max_depth:
+                    raise ZipLimitExceeded(f"{info.filename} is nested more than {max_depth} zips deep")
+
+                with zip_ref.open(info) as src, tempfile.SpooledTemporaryFile(max_size=spool_max_memory) as nested:
+                    shutil.copyfileobj(src, nested, 2**20)
+                    nested.seek(0)
+                    extracted.extend(extract_zip_members(
+                        nested, doc_type, destination_for, max_depth, max_bytes, spool_max_memory,
+                        path_index, _depth + 1, extracted_bytes,
+                    ))
+
+            elif suffix[1:] == doc_type:
+                extracted_bytes[0] += info.file_size
+                if extracted_bytes[0] > max_bytes:
+                    raise ZipLimitExceeded(f"Extracting {info.filename} goes over {max_bytes} uncompressed bytes")
+
+                output_path = path_index.claim(destination_for(member_name))
+                with zip_ref.open(info) as src, open(output_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, 2**20)
+                extracted.append(output_path)
+
+    return extracted
+
+
+def unzip_docs_as_needed(
+    input_dir: Union[Path, str],
+    output_dir: Union[Path, str],
+    doc_type: str,
+    max_depth: int = 5,
+    max_bytes: int = 10 * 2**30,
+) -> List[Path]:
     """Handles zipped/packaged download artifacts by expanding them into their individual components
 
     :param input_dir: Path of the zip file
     :param output_dir: Directory where files, unzipped or not, should be placed
     :param doc_type: Document file type, e.g. "pdf", "html", "txt"
+    :param max_depth: levels of nested zips to open
+    :param max_bytes: uncompressed bytes to extract in total
     :return: iterable of Downloaded documents, len > 1 for bundles
     """
+    input_dir = Path(input_dir)
+    output_dir = Path(output_dir)
+
+    def destination_for(member_name: str) -> Path:
+        if member_name.startswith("usc42"):
+            return output_dir.parent / extract_title_42_subfile_names(member_name, input_dir.name)
+        return Path(output_dir, member_name) if output_dir.is_dir() else output_dir
 
     # TODO: create set of recursive unzip methods for other archive types and a dispatcher
     try:
-        # unzip & move
-        temp_dir = tempfile.TemporaryDirectory()
-        unzipped_files = unzip_all(zip_file=input_dir, output_dir=temp_dir.name)
-        unzipped_files = [f for f in unzipped_files if f.suffix.lower()[1:] == doc_type]
-        if not unzipped_files:
+        # only members of the doc type are written, straight to where they end up
+        final_ddocs = extract_zip_members(input_dir, doc_type, destination_for, max_depth, max_bytes)
+        if not final_ddocs:
             raise RuntimeError(f"Tried to unzip {input_dir}, but could not find any expected files inside")
-        final_ddocs = []
-
-        # TODO: Add capibility to unzip multiple zips and add corresponding metadata for each
-        # do just the first iteration to unzip only the first file
-        unzipped_files.sort()  # TODO: this doesnt work ->> messy solution. sorting to make sure we grab the first in us_code
-        for pdf_file in unzipped_files:
-            if pdf_file.name.startswith("usc42"):
-                output_filename = extract_title_42_subfile_names(pdf_file.name, input_dir.name)
-                output_dir = output_dir.parent / output_filename
-            new_ddoc = copy.deepcopy(output_dir)
-            safe_move_file(file_path=pdf_file, output_path=output_dir)
-            final_ddocs.append(new_ddoc)
     finally:
-        temp_dir.cleanup()
-
         # remove zip. check in case a bad input was put in
         if input_dir.is_file() and input_dir.suffix.lower() == ".zip":
             os.remove(input_dir)
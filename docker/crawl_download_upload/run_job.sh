@@ -25,6 +25,16 @@ function setup_local_vars_and_dirs() {
   LOCAL_JOB_LOG_PATH="$LOCAL_DOWNLOAD_DIRECTORY_PATH/job.log"
   LOCAL_PREVIOUS_MANIFEST_LOCATION="${LOCAL_PREVIOUS_MANIFEST_LOCATION:-$SCRIPT_PARENT_DIR/previous-manifest.json}"
   LOCAL_NEW_MANIFEST_PATH="$LOCAL_DOWNLOAD_DIRECTORY_PATH/manifest.json"
+  # optional, kept across runs: downloaded files by sha256, uploaded once to s3://$BUCKET/$S3_BLOB_STORE_PATH
+  LOCAL_BLOB_STORE_DIR="${LOCAL_BLOB_STORE_DIR:-}"
+  S3_BLOB_STORE_PATH="${S3_BLOB_STORE_PATH:-blobs}"
+  LOCAL_BLOB_DUPLICATES_PATH="$LOCAL_DOWNLOAD_DIRECTORY_PATH/blob_duplicates.txt"
+  # optional, yes uploads each downloaded file as soon as it's written and removes it locally once uploaded
+  PIPELINED_UPLOAD="${PIPELINED_UPLOAD:-no}"
+  # optional, S3 compatible store (eg minio) to upload to instead of AWS
+  S3_ENDPOINT_URL="${S3_ENDPOINT_URL:-}"
+  # optional, sidecar, bundle or both, see --metadata-sink
+  METADATA_SINK="${METADATA_SINK:-}"
 
   if [[ ! -d "$LOCAL_DOWNLOAD_DIRECTORY_PATH" ]]; then
     mkdir -p "$LOCAL_DOWNLOAD_DIRECTORY_PATH"
@@ -50,12 +60,26 @@ function run_crawler() {
 
   set +o pipefail
 
+  local upload_args=()
+  if [[ "$PIPELINED_UPLOAD" == "yes" ]]; then
+    # files left after the crawl (manifest, crawler output, failed uploads) are put by run_upload
+    upload_args+=(
+      "--upload-bucket=$BUCKET"
+      "--upload-prefix=${S3_UPLOAD_BASE_PATH#/}"
+      "--delete-after-upload=true"
+      ${S3_ENDPOINT_URL:+ "--upload-endpoint-url=$S3_ENDPOINT_URL"}
+    )
+  fi
+
   "$PYTHON_CMD" -m dataPipelines.gc_scrapy crawl \
   --download-output-dir=$LOCAL_DOWNLOAD_DIRECTORY_PATH \
   --crawler-output-location=$LOCAL_CRAWLER_OUTPUT_FILE_PATH \
   --previous-manifest-location=$LOCAL_PREVIOUS_MANIFEST_LOCATION \
   --slack-hook-channel-id=$SLACK_HOOK_CHANNEL_ID \
   --slack-hook-url=$SLACK_HOOK_URL \
+  ${LOCAL_BLOB_STORE_DIR:+ "--blob-store-dir=$LOCAL_BLOB_STORE_DIR"} \
+  ${upload_args[@]+"${upload_args[@]}"} \
+  ${METADATA_SINK:+ "--metadata-sink=$METADATA_SINK"} \
   ${LOCAL_SPIDER_LIST_FILE:+ "--spiders-file-location=$LOCAL_SPIDER_LIST_FILE"}
 
   set -o pipefail
@@ -66,15 +90,46 @@ function run_upload() {
   S3_UPLOAD_BASE_PATH="${S3_UPLOAD_BASE_PATH#/}"
   S3_UPLOAD_BASE_PATH="${S3_UPLOAD_BASE_PATH%/}"
   S3FULLPATH="s3://${BUCKET}/${S3_UPLOAD_BASE_PATH}"
-  aws s3 cp "${LOCAL_DOWNLOAD_DIRECTORY_PATH}" "${S3FULLPATH}" --recursive && rc=$? || rc=$?
+
+  # files whose bytes are already in the blob store aren't uploaded again, their manifest rows and metadata reference
+  # the blob by sha256. They're only hardlinks to the store, so they're unlinked rather than passed as --exclude
+  # patterns, which are globs, matched against every file and can overflow the command line
+  if [[ -n "$LOCAL_BLOB_STORE_DIR" && -f "$LOCAL_BLOB_DUPLICATES_PATH" ]]; then
+    while IFS= read -r duplicate; do
+      rm -f -- "${LOCAL_DOWNLOAD_DIRECTORY_PATH%/}/$duplicate"
+    done < "$LOCAL_BLOB_DUPLICATES_PATH"
+  fi
+
+  aws s3 cp "${LOCAL_DOWNLOAD_DIRECTORY_PATH}" "${S3FULLPATH}" --recursive \
+    ${S3_ENDPOINT_URL:+ --endpoint-url "$S3_ENDPOINT_URL"} && rc=$? || rc=$?
 
   if [[ "$rc" -ne 0 ]]; then
     >&2 echo -e "\n[ERROR] FAILED TO UPLOAD DOCS\n"
     exit 11
   fi
+
+  if [[ -n "$LOCAL_BLOB_STORE_DIR" ]]; then
+    run_blob_store_upload
+  fi
+}
+
+function run_blob_store_upload() {
+  # sync only puts blobs that aren't in the bucket yet, ie the ones new this run
+  aws s3 sync "${LOCAL_BLOB_STORE_DIR}" "s3://${BUCKET}/${S3_BLOB_STORE_PATH}" \
+    ${S3_ENDPOINT_URL:+ --endpoint-url "$S3_ENDPOINT_URL"} && rc=$? || rc=$?
+
+  if [[ "$rc" -ne 0 ]]; then
+    >&2 echo -e "\n[ERROR] FAILED TO UPLOAD BLOB STORE\n"
+    exit 12
+  fi
 }
 
 function create_cumulative_manifest() {
+  if [[ "$LOCAL_PREVIOUS_MANIFEST_LOCATION" == *.db ]]; then
+    create_cumulative_manifest_store
+    return 0
+  fi
+
   local cumulative_manifest="$LOCAL_DOWNLOAD_DIRECTORY_PATH/cumulative-manifest.json"
   if [[ -f "$LOCAL_PREVIOUS_MANIFEST_LOCATION" ]]; then
     cat "$LOCAL_PREVIOUS_MANIFEST_LOCATION" > "$cumulative_manifest"
@@ -83,6 +138,16 @@ function create_cumulative_manifest() {
   cat "$LOCAL_NEW_MANIFEST_PATH" >> "$cumulative_manifest"
 }
 
+function create_cumulative_manifest_store() {
+  # sqlite manifest store, only the latest row per doc is kept instead of appending forever
+  local cumulative_manifest_store="$LOCAL_DOWNLOAD_DIRECTORY_PATH/cumulative-manifest.db"
+  cp "$LOCAL_PREVIOUS_MANIFEST_LOCATION" "$cumulative_manifest_store"
+  "$PYTHON_CMD" -m dataPipelines.gc_scrapy import-manifest \
+  --store="$cumulative_manifest_store" \
+  --manifest="$LOCAL_NEW_MANIFEST_PATH" \
+  --compact=true
+}
+
 
 ## Commenting out logging of job_log/crawler_output in manifest since it's not necessary.
 
@@ -0,0 +1,35 @@
+from dataPipelines.gc_scrapy.gc_scrapy.adaptive_concurrency import SlotController
+
+
+def test_concurrency_and_timeout_follow_the_slot():
+    controller = SlotController(4, 3.5, max_concurrency=6, min_timeout=1.0, max_timeout=10.0, window=10)
+
+    # fast and healthy, concurrency climbs to its ceiling and the timeout tightens
+    for _ in range(40):
+        controller.record_response(0.2, size=2**20, elapsed=0.5)
+    assert controller.concurrency == 6
+    assert controller.timeout == 1.0
+    assert controller.bytes_per_second == 2**21
+
+    # slow, one request less per window
+    for _ in range(10):
+        controller.record_response(3.0)
+    assert controller.concurrency == 5
+    assert controller.timeout == 10.0
+
+    # timing out, concurrency halves and the timeout doubles up to its ceiling
+    for _ in range(5):
+        controller.record_response(0.2)
+    for _ in range(5):
+        assert controller.record_error(timeout=True) == (_ == 4)
+    assert controller.concurrency == 2
+    assert controller.timeout == 10.0
+    assert controller.last_window["error_rate"] == 0.5
+
+
+def test_media_throughput_floor_follows_slow_slots():
+    controller = SlotController(1, 3.5, window=100)
+    assert controller.media_bytes_per_second(64 * 2**10) == 64 * 2**10
+
+    controller.record_response(0.5, size=40 * 2**10, elapsed=1.0)
+    assert controller.media_bytes_per_second(64 * 2**10) == 10 * 2**10
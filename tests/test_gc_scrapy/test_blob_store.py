@@ -0,0 +1,27 @@
+import hashlib
+from pathlib import Path
+
+from dataPipelines.gc_scrapy.gc_scrapy.blob_store import BlobStore, file_sha256_hex_digest
+
+
+def test_identical_files_are_stored_once_and_linked(tmp_path: Path):
+    store = BlobStore(tmp_path / "blobs")
+    downloads = tmp_path / "downloads"
+    downloads.mkdir()
+    body = b"%PDF-1.4 same document"
+    digest = hashlib.sha256(body).hexdigest()
+
+    added = []
+    for doc_name in ("DoDI 1000.01.pdf", "Coronavirus DoDI 1000.01.pdf"):
+        doc_path = downloads / doc_name
+        doc_path.write_bytes(body)
+        assert file_sha256_hex_digest(doc_path) == digest
+
+        added.append(store.add_file(doc_path, digest))
+        store.link(digest, doc_path)
+
+    assert added == [True, False]
+    assert store.contains(digest)
+    assert [p.name for p in (tmp_path / "blobs").rglob("*") if p.is_file()] == [digest]
+    inodes = {(downloads / name).stat().st_ino for name in ("DoDI 1000.01.pdf", "Coronavirus DoDI 1000.01.pdf")}
+    assert inodes == {store.path_for(digest).stat().st_ino}
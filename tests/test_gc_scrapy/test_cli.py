@@ -0,0 +1,157 @@
+import importlib
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import scrapy
+from click.testing import CliRunner
+from scrapy.settings import Settings
+from twisted.internet import defer
+
+from dataPipelines.gc_scrapy.cli import (
+    cli, get_shard_spiders, parse_shard, queue_spiders_concurrently, run_spiders_in_worker_pool,
+)
+
+cli_module = importlib.import_module("dataPipelines.gc_scrapy.cli")
+
+
+class FakeSpider:
+    shard_start_urls = False
+    start_urls = []
+
+    def __init__(self, name, start_urls=None):
+        self.name = name
+        if start_urls is not None:
+            self.shard_start_urls = True
+            self.start_urls = start_urls
+
+
+class StubSpider(scrapy.Spider):
+    """Crawls a data: url, so worker processes run a real crawl without the network"""
+    name = "stub_a"
+    start_urls = ["data:,stub"]
+    # read back by crawl_in_worker, like GCSpider.stats
+    stats = {}
+
+    def parse(self, response):
+        yield {"doc_name": self.name, "body": response.text}
+
+    def closed(self, reason):
+        Path(self.job_manifest_location).write_text(json.dumps({"doc_name": self.name}) + "\n")
+        self.stats[self.name] = {"Close Reason": reason}
+
+
+class OtherStubSpider(StubSpider):
+    name = "stub_b"
+
+
+class RecordingRunner:
+    """CrawlerRunner whose crawls finish when the test says so"""
+
+    def __init__(self):
+        self.settings = Settings()
+        self.crawling = {}
+        self.max_crawling = 0
+
+    def crawl(self, crawler, **kwargs):
+        d = defer.Deferred()
+        self.crawling[crawler.spidercls.name] = (crawler, d)
+        self.max_crawling = max(self.max_crawling, len(self.crawling))
+        return d
+
+    def finish(self, name: str) -> None:
+        crawler, d = self.crawling.pop(name)
+        Path(crawler.settings["FEED_URI"]).write_text(json.dumps({"doc_name": name}) + "\n")
+        d.callback(None)
+
+
+def test_parse_shard():
+    assert parse_shard(None) is None
+    assert parse_shard("1/3") == (1, 3)
+
+    with pytest.raises(Exception):
+        parse_shard("3/3")
+    with pytest.raises(Exception):
+        parse_shard("one")
+
+
+def test_get_shard_spiders_covers_every_spider_once():
+    spiders = [FakeSpider(f"spider_{i}") for i in range(7)]
+    url_spider = FakeSpider("air_force_pubs", start_urls=["a", "b"])
+    spiders.append(url_spider)
+
+    shards = [get_shard_spiders(spiders, i, 3) for i in range(3)]
+
+    whole = [s for shard in shards for s in shard if s is not url_spider]
+    assert sorted(s.name for s in whole) == sorted(s.name for s in spiders if s is not url_spider)
+    # only the shards that get a start url run the start url sharded spider
+    assert [url_spider in shard for shard in shards] == [True, True, False]
+    # same input, same partition
+    assert shards == [get_shard_spiders(spiders, i, 3) for i in range(3)]
+
+
+def test_merge_manifests(tmp_path: Path):
+    shard_dirs = []
+    for i in range(2):
+        shard_dir = tmp_path / f"shard_{i}"
+        shard_dir.mkdir()
+        (shard_dir / "manifest.json").write_text(json.dumps({"doc_name": f"doc {i}"}) + "\n")
+        (shard_dir / "crawler_output.json").write_text(json.dumps({"doc_name": f"doc {i}"}) + "\n")
+        shard_dirs.append(shard_dir)
+    (shard_dirs[1] / "dead_queue.json").write_text(json.dumps({"failure_reason": "HTTP Response Code 404"}) + "\n")
+
+    output_dir = tmp_path / "merged"
+    output_dir.mkdir()
+
+    args = ["merge-manifests", "--output-dir", str(output_dir)]
+    for shard_dir in shard_dirs:
+        args += ["--shard-dir", str(shard_dir)]
+    # running it again replaces the merged files rather than appending to them
+    for _ in range(2):
+        result = CliRunner().invoke(cli, args)
+        assert result.exit_code == 0, result.output
+
+    manifest = [json.loads(line) for line in (output_dir / "manifest.json").read_text().splitlines()]
+    assert manifest == [{"doc_name": "doc 0"}, {"doc_name": "doc 1"}]
+    assert len((output_dir / "crawler_output.json").read_text().splitlines()) == 2
+    assert len((output_dir / "dead_queue.json").read_text().splitlines()) == 1
+    # inputs are left alone
+    assert (shard_dirs[0] / "manifest.json").exists()
+
+
+def test_queue_spiders_concurrently_caps_spiders_in_flight_and_merges_feeds_in_order(tmp_path: Path, monkeypatch):
+    stopped = []
+    monkeypatch.setattr(cli_module, "reactor", SimpleNamespace(stop=lambda: stopped.append(True)))
+    spiders = [type(f"Spider{i}", (scrapy.Spider,), {"name": f"spider_{i}"}) for i in range(3)]
+    output = tmp_path / "crawler_output.json"
+    runner = RecordingRunner()
+
+    done = queue_spiders_concurrently(runner, spiders, {"output": str(output)}, max_parallel_spiders=2)
+    assert sorted(runner.crawling) == ["spider_0", "spider_1"]
+
+    # finishing out of order starts the next spider, never more than 2 at once
+    runner.finish("spider_1")
+    assert sorted(runner.crawling) == ["spider_0", "spider_2"]
+    runner.finish("spider_2")
+    runner.finish("spider_0")
+
+    assert done.called and stopped == [True] and runner.max_crawling == 2
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [row["doc_name"] for row in rows] == ["spider_0", "spider_1", "spider_2"]
+    assert list(tmp_path.glob("*.part")) == []
+
+
+def test_run_spiders_in_worker_pool_merges_worker_shards(tmp_path: Path):
+    settings = Settings({"FEED_FORMAT": "jsonlines", "LOG_ENABLED": False, "TELNETCONSOLE_ENABLED": False})
+    output = tmp_path / "crawler_output.json"
+    crawl_kwargs = {"output": str(output), "download_output_dir": str(tmp_path)}
+
+    all_stats = run_spiders_in_worker_pool(settings, [StubSpider, OtherStubSpider], crawl_kwargs, workers=2)
+
+    assert all_stats == {"stub_a": {"Close Reason": "finished"}, "stub_b": {"Close Reason": "finished"}}
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    assert rows == [{"doc_name": "stub_a", "body": "stub"}, {"doc_name": "stub_b", "body": "stub"}]
+    manifest = [json.loads(line) for line in (tmp_path / "manifest.json").read_text().splitlines()]
+    assert manifest == [{"doc_name": "stub_a"}, {"doc_name": "stub_b"}]
+    assert list(tmp_path.glob("*.part")) == []
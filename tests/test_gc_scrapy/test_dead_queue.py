@@ -0,0 +1,49 @@
+import json
+from pathlib import Path
+
+from scrapy.http import Response
+from twisted.python.failure import Failure
+
+from dataPipelines.gc_scrapy.gc_scrapy.dead_queue import read_dead_queue
+from dataPipelines.gc_scrapy.gc_scrapy.pipelines import FileDownloadPipeline
+
+
+def write_dead_queue(path: Path, rows: list) -> Path:
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows) + "not json\n")
+    return path
+
+
+def test_dead_queue_documents_are_read_once_per_crawler_and_doc(tmp_path: Path):
+    def row(crawler, doc_name, title):
+        return {"document": {"crawler_used": crawler, "doc_name": doc_name, "doc_title": title}, "failure_reason": "x"}
+
+    older = write_dead_queue(tmp_path / "older.json", [row("dod_issuances", "DoDI 1", "old"), row("army_pubs", "DoDI 1", "army")])
+    newer = write_dead_queue(tmp_path / "newer.json", [row("dod_issuances", "DoDI 1", "new"), row("dod_issuances", "DoDI 2", "2")])
+
+    documents = read_dead_queue([older, newer])
+
+    assert [(d["crawler_used"], d["doc_name"], d["doc_title"]) for d in documents] == [
+        ("dod_issuances", "DoDI 1", "new"),
+        ("army_pubs", "DoDI 1", "army"),
+        ("dod_issuances", "DoDI 2", "2"),
+    ]
+
+
+def test_only_retryable_failures_wait_for_a_retry_pass():
+    pipeline = FileDownloadPipeline()
+    pipeline.retry_queue = []
+    pipeline.retry_times = 1
+    pipeline.retry_http_codes = {503}
+    dead = []
+    pipeline.add_to_dead_queue = lambda item, reason: dead.append(item["doc_name"])
+
+    pipeline.handle_failed_download({"doc_name": "a"}, Response("https://a.example.com", status=503), 503)
+    pipeline.handle_failed_download({"doc_name": "b"}, Failure(ConnectionError()), "Pipeline Media Request Failed")
+    pipeline.handle_failed_download({"doc_name": "c"}, Response("https://a.example.com", status=404), 404)
+    assert [item["doc_name"] for item, _ in pipeline.retry_queue] == ["a", "b"]
+    assert dead == ["c"]
+
+    # the last pass is running, its failures are final
+    pipeline.retry_passes = 1
+    pipeline.handle_failed_download({"doc_name": "a"}, Response("https://a.example.com", status=503), 503)
+    assert dead == ["c", "a"]
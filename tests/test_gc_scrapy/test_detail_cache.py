@@ -0,0 +1,55 @@
+import copy
+from pathlib import Path
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from dataPipelines.gc_scrapy.gc_scrapy.items import DocItem
+from dataPipelines.gc_scrapy.gc_scrapy.spider_middlewares import DetailCacheMiddleware
+from dataPipelines.gc_scrapy.gc_scrapy.spiders.sasc_spider import SASCSpider
+
+
+def run_callback(spider, middleware, request, body=b"<html></html>"):
+    response = HtmlResponse(request.url, body=body, request=request)
+    return list(middleware.process_spider_output(response, request.callback(response), spider))
+
+
+def test_follow_detail_page_reuses_items_of_unchanged_rows(tmp_path: Path):
+    spider = SASCSpider(detail_cache_location=str(tmp_path / "detail_cache.db"))
+    middleware = DetailCacheMiddleware()
+    doc = spider.populate_doc_item({
+        "doc_name": "SASC Hearing - Nominations - Testimony",
+        "doc_num": " ",
+        "doc_title": "Nominations",
+        "doc_type": "SASC Hearing Testimony",
+        "display_doc_type": "Testimony",
+        "cac_login_required": False,
+        "download_url": "https://example.com/witness",
+        "source_page_url": "https://example.com/hearing",
+        "downloadable_items": [{"doc_type": "pdf", "download_url": "https://example.com/witness", "compression_type": None}],
+        "publication_date": "2022-01-01",
+    })
+
+    def follow():
+        request = Request("https://example.com/witness", callback=spider.follow_pdf_redirect, meta={"doc": copy.deepcopy(doc)})
+        return list(spider.follow_detail_page(request, doc["version_hash_raw_data"]))
+
+    # first crawl follows the redirect page, then the pdf, and caches the finished item
+    [redirect_request] = follow()
+    [pdf_request] = run_callback(
+        spider, middleware, redirect_request, b'<p><a href="https://example.com/final.pdf">pdf</a></p>'
+    )
+    assert pdf_request.meta["detail_cache_key"] == redirect_request.meta["detail_cache_key"]
+    [crawled_item] = run_callback(spider, middleware, pdf_request)
+    assert crawled_item["download_url"] == "https://example.com/final.pdf"
+
+    # unchanged listing row, no requests
+    [cached_item] = follow()
+    assert isinstance(cached_item, DocItem)
+    assert dict(cached_item) == dict(crawled_item)
+    assert spider.stats[spider.name]["Detail Cache Hits"] == 1
+    assert spider.stats[spider.name]["Detail Cache Misses"] == 1
+
+    # changed listing row follows the detail page again
+    doc["version_hash_raw_data"]["publication_date"] = "2022-02-01"
+    assert isinstance(follow()[0], Request)
@@ -0,0 +1,65 @@
+from scrapy import Request, Spider
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+from twisted.internet.task import Clock
+
+from dataPipelines.gc_scrapy.gc_scrapy.adaptive_concurrency import MEDIA_DOWNLOAD
+from dataPipelines.gc_scrapy.gc_scrapy.downloader_middlewares import AdaptiveConcurrencyMiddleware, BanEvasionMiddleware
+from dataPipelines.gc_scrapy.gc_scrapy.runspider_settings import general_settings
+from dataPipelines.gc_scrapy.gc_scrapy.streaming_download import DOWNLOAD_STARTED, MIN_BYTES_PER_SECOND
+
+
+class DelayedSpider(Spider):
+    name = "delayed"
+    rotate_user_agent = True
+    randomly_delay_request = [2]
+
+
+def test_random_delays_only_hold_back_their_own_slot():
+    clock = Clock()
+    middleware = BanEvasionMiddleware(clock=clock)
+    spider = DelayedSpider()
+    sent = []
+
+    for url in ("https://a.example.com/1", "https://a.example.com/2", "https://b.example.com/1"):
+        middleware.process_request(Request(url), spider).addCallback(lambda _, url=url: sent.append(url))
+
+    clock.advance(2)
+    assert sent == ["https://a.example.com/1", "https://b.example.com/1"]
+    clock.advance(2)
+    assert sent[-1] == "https://a.example.com/2"
+
+    # skip_delay requests go straight through
+    assert middleware.process_request(Request("https://a.example.com/3", meta={"skip_delay": True}), spider) is None
+
+
+def test_adaptive_concurrency_sets_timeouts_and_slot_concurrency():
+    crawler = get_crawler(Spider, {**general_settings, "ADAPTIVE_WINDOW": 2, "CONCURRENT_REQUESTS_PER_DOMAIN": 3})
+    spider = Spider("adaptive")
+    middleware = AdaptiveConcurrencyMiddleware.from_crawler(crawler)
+    assert middleware.controller_kwargs["max_concurrency"] == 3
+
+    page = Request("https://a.example.com/page")
+    document = Request("https://a.example.com/doc.pdf", meta={MEDIA_DOWNLOAD: True})
+    for request in (page, document):
+        middleware.process_request(request, spider)
+        assert request.meta["download_timeout"] == general_settings["DOWNLOAD_TIMEOUT"]
+    assert MIN_BYTES_PER_SECOND not in page.meta
+    assert document.meta[MIN_BYTES_PER_SECOND] == general_settings["ADAPTIVE_MEDIA_MIN_BYTES_PER_SECOND"]
+
+    for request in (page, document):
+        request.meta.update({DOWNLOAD_STARTED: 0.0, "download_latency": 0.1})
+        middleware.process_response(request, Response(request.url, status=503, request=request), spider)
+
+    assert crawler.stats.get_value("adaptive_concurrency/a.example.com/concurrency") == 1
+    assert crawler.stats.get_value("adaptive_concurrency/a.example.com/error_rate") == 1.0
+
+
+def test_adaptive_concurrency_keeps_the_spider_download_timeout_as_the_floor():
+    middleware = AdaptiveConcurrencyMiddleware.from_crawler(get_crawler(Spider, general_settings))
+    assert middleware.controller_kwargs["max_concurrency"] == 8
+    assert middleware.controller_kwargs["min_timeout"] == general_settings["DOWNLOAD_TIMEOUT"]
+
+    slow_site = get_crawler(Spider, {**general_settings, "DOWNLOAD_TIMEOUT": 7.0})
+    middleware = AdaptiveConcurrencyMiddleware.from_crawler(slow_site)
+    assert middleware.controller_kwargs["min_timeout"] == 7.0
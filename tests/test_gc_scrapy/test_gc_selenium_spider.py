@@ -0,0 +1,149 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+from twisted.internet import defer
+from scrapy.utils.test import get_crawler
+from selenium.common.exceptions import StaleElementReferenceException
+
+from dataPipelines.gc_scrapy.gc_scrapy.GCSeleniumSpider import DATATABLE_ROWS_SCRIPT, GCSeleniumSpider, driver_callback
+from dataPipelines.gc_scrapy.gc_scrapy.selenium_pool import SELENIUM_DRIVER_LEASE
+
+
+class DataTablesDriver:
+    def __init__(self, rows):
+        self.rows = rows
+        self.scripts = 0
+
+    def execute_script(self, script, *args):
+        self.scripts += 1
+        return "pending" if self.scripts == 1 else json.dumps(self.rows)
+
+
+class Row:
+    def __init__(self, driver):
+        self.driver = driver
+        self.page = driver.page
+
+    def is_enabled(self):
+        if self.page != self.driver.page:
+            raise StaleElementReferenceException()
+        return True
+
+
+class PagedDriver:
+    """Server paged table of two pages, without DataTables"""
+
+    def __init__(self):
+        self.page = 1
+
+    def execute_script(self, script, *args):
+        if script == "arguments[0].click();":
+            self.page += 1
+            return None
+        return "unavailable"
+
+    @property
+    def page_source(self):
+        return f"<table class='grid'><tbody><tr><td>page {self.page}</td></tr></tbody></table>"
+
+    def find_elements(self, by, selector):
+        if selector == "a.next":
+            return ["next link"] if self.page == 1 else []
+        return [self]
+
+    def find_element(self, by, selector):
+        return Row(self)
+
+
+class ServerSideDriver(PagedDriver):
+    """DataTables table with serverSide processing, its api only holds the rows of the page drawn"""
+
+    def execute_script(self, script, *args):
+        if script == DATATABLE_ROWS_SCRIPT:
+            if "oFeatures.bServerSide" in script:
+                return "unavailable"
+            return json.dumps([[f"page {self.page}"]])
+        return super().execute_script(script, *args)
+
+
+def test_datatable_rows_come_from_one_script_call():
+    rows = [['<a href="/a.pdf">AFI 1</a>', "Title &amp; more"], ["AFI 2", ""]]
+    driver = DataTablesDriver(rows)
+    found = list(GCSeleniumSpider(name="t").iter_table_rows(driver, "table.dataTable", next_page="a.next"))
+    assert driver.scripts == 2  # polled once while the table was still loading
+    assert found[0].css("td:nth-child(1) a::attr(href)").get() == "/a.pdf"
+    assert found[0].css("td:nth-child(2)::text").get() == "Title & more"
+    assert [row.css("td:nth-child(1)::text").get() for row in found[1:]] == ["AFI 2"]
+
+
+def test_tables_without_datatables_are_paged():
+    found = list(GCSeleniumSpider(name="t").iter_table_rows(PagedDriver(), "table.grid", next_page="a.next"))
+    assert [row.css("td::text").get() for row in found] == ["page 1", "page 2"]
+
+
+def test_server_side_datatables_are_paged():
+    found = list(GCSeleniumSpider(name="t").iter_table_rows(ServerSideDriver(), "table.grid", next_page="a.next"))
+    assert [row.css("td::text").get() for row in found] == ["page 1", "page 2"]
+
+
+class LoadingDriver:
+    """Page whose list grows for a few polls, with requests finishing meanwhile"""
+
+    def __init__(self):
+        self.polls = 0
+
+    def execute_script(self, script, *args):
+        self.polls += 1
+        loaded = min(self.polls, 4)
+        if "querySelectorAll(arguments[0]).length" in script:
+            return loaded
+        return ["complete" if loaded > 1 else "interactive", 0, loaded, loaded * 10.0]
+
+
+def test_waits_return_once_the_page_settles_and_are_counted():
+    crawler = get_crawler(GCSeleniumSpider)
+    spider = GCSeleniumSpider.from_crawler(crawler, name="t")
+    crawler.stats.open_spider(spider)
+
+    assert spider.wait_for_network_idle(LoadingDriver(), idle_seconds=0.05, poll=0.01)
+    driver = LoadingDriver()
+    assert spider.wait_for_element_count_stable(driver, "ul li a", stable_seconds=0.05, poll=0.01) == 4
+    assert driver.polls > 4
+    assert not spider.wait_for_network_idle(LoadingDriver(), idle_seconds=5, wait=0.1, poll=0.01)
+
+    stats = crawler.stats.get_stats(spider)
+    assert stats["selenium_wait/network_idle_waits"] == 2 and stats["selenium_wait/element_count_waits"] == 1
+    assert stats["selenium_wait/seconds"] == pytest.approx(
+        stats["selenium_wait/network_idle_seconds"] + stats["selenium_wait/element_count_seconds"]
+    )
+
+
+class DriverSpider(GCSeleniumSpider):
+    name = "driver_spider"
+
+    @driver_callback
+    def parse(self, response):
+        yield {"url": response.meta["driver"].current_url}
+
+
+def test_driver_callbacks_run_in_the_driver_pool():
+    ran_in_pool = []
+
+    def run(func):
+        ran_in_pool.append(func)
+        return defer.maybeDeferred(func)
+
+    driver = SimpleNamespace(current_url="https://www.e-publishing.af.mil/")
+    lease = SimpleNamespace(pool=SimpleNamespace(run=run))
+    meta = {"driver": driver, SELENIUM_DRIVER_LEASE: lease}
+    response = HtmlResponse(driver.current_url, body=b"", request=Request(driver.current_url, meta=meta))
+
+    output = []
+    DriverSpider().parse(response).addCallback(output.extend)
+    assert len(ran_in_pool) == 1 and output == [{"url": driver.current_url}]
+
+    # no pooled driver, runs as a plain generator callback
+    without_lease = HtmlResponse(driver.current_url, body=b"", request=Request(driver.current_url, meta={"driver": driver}))
+    assert list(DriverSpider().parse(without_lease))[0]["url"] == driver.current_url
@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from dataPipelines.gc_scrapy.gc_scrapy.jsonl_writer import (
+    JsonLinesWriter,
+    get_jsonl_writer,
+    release_jsonl_writer,
+)
+
+
+def read_rows(path: Path) -> list:
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_rows_are_buffered_until_a_flush_is_due(tmp_path: Path):
+    path = tmp_path / "manifest.json"
+    writer = JsonLinesWriter(path, flush_rows=3, flush_seconds=3600, fsync="never")
+
+    writer.write({"doc_name": "a"})
+    writer.write({"doc_name": "b"})
+    assert read_rows(path) == []
+
+    writer.write({"doc_name": "c"})
+    assert [row["doc_name"] for row in read_rows(path)] == ["a", "b", "c"]
+
+    writer.write({"doc_name": "d"})
+    writer.close()
+    assert len(read_rows(path)) == 4
+
+    with pytest.raises(ValueError):
+        writer.write({"doc_name": "e"})
+
+
+def test_writers_are_shared_by_path_and_closed_by_the_last_user(tmp_path: Path):
+    path = tmp_path / "dead_queue.json"
+    first = get_jsonl_writer(path, flush_rows=100)
+    second = get_jsonl_writer(tmp_path / "." / "dead_queue.json", flush_rows=100)
+    assert first is second
+
+    first.write({"failure_reason": "HTTP Response Code 404"})
+    release_jsonl_writer(first)
+    assert not second.closed
+    second.write({"failure_reason": "HTTP Response Code 500"})
+    release_jsonl_writer(second)
+
+    assert second.closed
+    assert len(read_rows(path)) == 2
+    assert get_jsonl_writer(path) is not first
+
+
+def test_files_are_only_created_by_a_row(tmp_path: Path):
+    path = tmp_path / "dead_queue.json"
+    JsonLinesWriter(path).close()
+    assert not path.exists()
@@ -0,0 +1,104 @@
+import json
+from pathlib import Path
+
+from dataPipelines.gc_scrapy.gc_scrapy.manifest import PreviousManifest, ValidatorIndex, get_previous_manifest
+
+
+def write_manifest(path: Path, rows: list) -> None:
+    with path.open("w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+        # cumulative manifests are cat'd together and can have blank lines
+        f.write("\n")
+
+
+def test_previous_manifest_partitions_hashes_by_crawler(tmp_path: Path):
+    manifest_path = tmp_path / "prev_manifest.json"
+    write_manifest(manifest_path, [
+        {"version_hash": "a", "crawler_used": "us_code"},
+        {"version_hash": "b", "crawler_used": "dod_issuances"},
+        {"version_hash": "c"},
+    ])
+
+    manifest = PreviousManifest.load(manifest_path)
+
+    assert manifest.line_count == 3
+    assert manifest.contains("us_code", "a")
+    assert not manifest.contains("us_code", "b")
+    # rows without crawler info are filtered for every crawler
+    assert manifest.contains("us_code", "c")
+    assert manifest.contains("dod_issuances", "c")
+    assert manifest.count_for("us_code") == 2
+
+
+def test_get_previous_manifest_loads_once(tmp_path: Path):
+    manifest_path = tmp_path / "prev_manifest.json"
+    write_manifest(manifest_path, [{"version_hash": "a", "crawler_used": "us_code"}])
+
+    first = get_previous_manifest(manifest_path)
+    second = get_previous_manifest(str(manifest_path))
+
+    assert first is second
+
+
+def test_previous_manifest_hash_index(tmp_path: Path):
+    manifest_path = tmp_path / "prev_manifest.json"
+    hex_hash = "00" * 31 + "ff"
+    # digests ending in a null byte are a numpy S dtype edge case
+    null_ending_hash = "ff" * 31 + "00"
+    write_manifest(manifest_path, [
+        {"version_hash": hex_hash, "crawler_used": "us_code"},
+        {"version_hash": null_ending_hash, "crawler_used": "us_code"},
+        {"version_hash": "not a hex digest"},
+    ])
+
+    manifest = PreviousManifest.load(manifest_path, index_dir=tmp_path / "index", use_bloom=True)
+
+    assert (tmp_path / "index" / "us_code.idx").stat().st_size == 64
+    assert manifest.contains("us_code", hex_hash)
+    assert manifest.contains("us_code", null_ending_hash)
+    assert manifest.contains("dod_issuances", "not a hex digest")
+    assert not manifest.contains("dod_issuances", hex_hash)
+    assert manifest.count_for("us_code") == 3
+
+
+def test_previous_manifest_keeps_latest_validators_per_doc(tmp_path: Path):
+    manifest_path = tmp_path / "prev_manifest.json"
+    url = "https://example.com/a.pdf"
+    write_manifest(manifest_path, [
+        {"version_hash": "a1", "doc_name": "A", "crawler_used": "us_code", "download_url": url, "etag": "\"1\""},
+        {"version_hash": "a2", "doc_name": "A", "crawler_used": "us_code", "download_url": url, "etag": "\"2\""},
+        {"version_hash": "b1", "doc_name": "B", "crawler_used": "us_code", "download_url": url, "etag": "\"1\""},
+        # downloaded again from a server that stopped sending validators
+        {"version_hash": "b2", "doc_name": "B", "crawler_used": "us_code"},
+    ])
+
+    manifest = PreviousManifest.load(manifest_path)
+
+    assert manifest.validators_for("us_code", "A")["etag"] == "\"2\""
+    assert manifest.validators_for("us_code", "B") is None
+
+    # kept in a temp sqlite file rather than in memory, removed once closed
+    validators_path = manifest.validators_by_doc.path
+    assert len(manifest.validators_by_doc) == 1 and validators_path.exists()
+    manifest.validators_by_doc.close()
+    assert not validators_path.exists()
+
+
+def test_indexed_manifest_keeps_validators_on_disk(tmp_path: Path):
+    manifest_path = tmp_path / "prev_manifest.json"
+    url = "https://example.com/a.pdf"
+    write_manifest(manifest_path, [
+        {"version_hash": "a1", "doc_name": "A", "crawler_used": "us_code", "download_url": url, "etag": "\"1\""},
+        {"version_hash": "a2", "doc_name": "A", "crawler_used": "us_code", "download_url": url, "etag": "\"2\""},
+        # legacy row without a crawler
+        {"version_hash": "c1", "doc_name": "C", "download_url": url, "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+    ])
+
+    manifest = PreviousManifest.load(manifest_path, index_dir=tmp_path / "index")
+
+    assert isinstance(manifest.validators_by_doc, ValidatorIndex)
+    assert (tmp_path / "index" / "validators.db").exists()
+    assert manifest.validators_for("us_code", "A")["etag"] == "\"2\""
+    assert manifest.validators_for("dod_issuances", "C")["last_modified"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert manifest.validators_for("dod_issuances", "A") is None
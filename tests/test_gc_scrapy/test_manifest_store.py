@@ -0,0 +1,57 @@
+import json
+from pathlib import Path
+
+from dataPipelines.gc_scrapy.gc_scrapy.manifest import get_previous_manifest
+from dataPipelines.gc_scrapy.gc_scrapy.manifest_store import ManifestStore
+
+
+ROWS = [
+    {"version_hash": "a1", "doc_name": "A", "crawler_used": "us_code", "access_timestamp": "2022-01-01T00:00:00"},
+    {"version_hash": "b1", "doc_name": "B", "crawler_used": "us_code", "access_timestamp": "2022-01-01T00:00:00"},
+    {"version_hash": "a2", "doc_name": "A", "crawler_used": "us_code", "access_timestamp": "2022-01-02T00:00:00"},
+    {"version_hash": "old", "entrypoint": "gc_downloader"},
+]
+
+
+def test_manifest_store_lookups_and_compaction(tmp_path: Path):
+    store = ManifestStore(tmp_path / "manifest.db")
+    store.add_many(ROWS)
+
+    assert store.contains("us_code", "a1")
+    assert not store.contains("dod_issuances", "a1")
+    # rows without crawler info are filtered for every crawler
+    assert store.contains("dod_issuances", "old")
+    assert store.count_for("us_code") == 4
+    assert store.latest_for_doc("us_code", "A")["version_hash"] == "a2"
+
+    plan = store.connection.execute(
+        "EXPLAIN QUERY PLAN SELECT 1 FROM manifest WHERE crawler_used = ? AND version_hash = ?", ("us_code", "a1")
+    ).fetchall()
+    assert "manifest_crawler_version_hash" in str(plan)
+
+    assert store.compact() == 1
+    assert not store.contains("us_code", "a1")
+    assert store.contains("us_code", "a2")
+    assert len(store) == 3
+
+
+def test_manifest_store_jsonl_round_trip(tmp_path: Path):
+    manifest_path = tmp_path / "cumulative-manifest.json"
+    with manifest_path.open("w") as f:
+        for row in ROWS:
+            f.write(json.dumps(row) + "\n\n")
+
+    store_path = tmp_path / "manifest.db"
+    store = ManifestStore(store_path)
+    assert store.import_jsonl(manifest_path, batch_size=2) == 4
+
+    exported_path = tmp_path / "exported.json"
+    assert store.export_jsonl(exported_path) == 4
+    exported = [json.loads(line) for line in exported_path.read_text().splitlines()]
+    assert [row["version_hash"] for row in exported] == ["a1", "b1", "a2", "old"]
+    assert exported[3]["entrypoint"] == "gc_downloader"
+    # legacy rows come back without the columns they never had
+    assert exported == ROWS
+
+    # a .db previous manifest location is queried in place
+    assert get_previous_manifest(store_path).contains("us_code", "b1")
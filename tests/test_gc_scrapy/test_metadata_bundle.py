@@ -0,0 +1,54 @@
+import gzip
+import json
+from pathlib import Path
+
+from dataPipelines.gc_scrapy.gc_scrapy.metadata_bundle import MetadataBundleIndex, MetadataBundleWriter
+from dataPipelines.gc_scrapy.gc_scrapy.pipelines import FileDownloadPipeline
+
+
+def test_rows_are_found_through_the_index_across_blocks_and_bundles(tmp_path: Path):
+    finished = []
+    writer = MetadataBundleWriter(
+        tmp_path, "army_pubs", block_rows=3, max_bundle_bytes=200, on_bundle_finished=finished.append
+    )
+    for i in range(10):
+        writer.write(f"AR {i}", f"AR {i}.pdf.metadata", {"doc_name": f"AR {i}", "doc_title": "x" * i})
+    writer.write("AR 1", "AR 1.pdf.metadata", {"doc_name": "AR 1", "doc_title": "again"})
+    remaining = writer.close()
+
+    bundles = sorted(tmp_path.glob("army_pubs-*.jsonl.gz"))
+    assert len(bundles) > 1 and finished == bundles[:len(finished)]
+    assert remaining == bundles[len(finished):] + [tmp_path / "army_pubs.index.jsonl"]
+    # plain multi member gzip files
+    rows = [json.loads(line) for bundle in bundles for line in gzip.open(bundle)]
+    assert [r["doc_name"] for r in rows] == [f"AR {i}" for i in range(10)] + ["AR 1"]
+
+    index = MetadataBundleIndex(tmp_path / "army_pubs.index.jsonl")
+    assert len(index) == 10 and "AR 10" not in index
+    assert index.get("AR 7") == {"doc_name": "AR 7", "doc_title": "xxxxxxx"}
+    assert index.get("AR 1")["doc_title"] == "again"
+    assert index.entries["AR 1"]["metadata_name"] == "AR 1.pdf.metadata"
+
+
+def test_metadata_sinks(tmp_path: Path):
+    pipeline = FileDownloadPipeline()
+    pipeline.output_dir = tmp_path
+    sidecar = tmp_path / "DoDI 1.pdf.metadata"
+    assert pipeline.write_metadata({"doc_name": "DoDI 1"}, str(sidecar)) == [sidecar]
+
+    pipeline.write_metadata_sidecars = False
+    pipeline.metadata_bundle = MetadataBundleWriter(tmp_path / "metadata", "dod_issuances")
+    assert pipeline.write_metadata({"doc_name": "DoDI 2"}, tmp_path / "DoDI 2.pdf.metadata") == []
+    pipeline.metadata_bundle.close()
+
+    assert not (tmp_path / "DoDI 2.pdf.metadata").exists()
+    assert MetadataBundleIndex(tmp_path / "metadata" / "dod_issuances.index.jsonl").get("DoDI 2") == {"doc_name": "DoDI 2"}
+
+
+def test_blob_digest_is_recorded_in_the_metadata(tmp_path: Path):
+    pipeline = FileDownloadPipeline()
+    pipeline.output_dir = tmp_path
+    sidecar = tmp_path / "DoDI 3.pdf.metadata"
+    pipeline.write_metadata({"doc_name": "DoDI 3"}, sidecar, sha256="ab" * 32)
+
+    assert json.loads(sidecar.read_text()) == {"doc_name": "DoDI 3", "sha256": "ab" * 32}
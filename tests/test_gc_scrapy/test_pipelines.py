@@ -0,0 +1,68 @@
+import threading
+from types import SimpleNamespace
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, threads
+
+from dataPipelines.gc_scrapy.gc_scrapy import pipelines
+from dataPipelines.gc_scrapy.gc_scrapy.pipelines import FileDownloadPipeline
+
+
+def test_items_with_uploads_complete_off_the_reactor_without_a_pool(monkeypatch):
+    deferred_to_thread = []
+
+    def defer_to_thread(func, *args):
+        deferred_to_thread.append(func)
+        return defer.maybeDeferred(func, *args)
+
+    monkeypatch.setattr(pipelines.threads, "deferToThread", defer_to_thread)
+    pipeline = FileDownloadPipeline()
+    pipeline.complete_item = lambda results, item, info: item
+    info = SimpleNamespace(downloaded={"url": b""})
+    item = {"doc_name": "DoDI 1"}
+
+    assert pipeline.item_completed([(True, None)], item, info) is item
+    assert deferred_to_thread == []
+
+    # S3Uploader.upload blocks while its queue is full
+    pipeline.uploader = object()
+    completed = []
+    pipeline.item_completed([(True, None)], item, info).addCallback(completed.append)
+    assert deferred_to_thread == [pipeline.complete_item] and completed == [item]
+
+
+def test_items_complete_in_the_pool_which_stops_with_the_spider(tmp_path, monkeypatch):
+    # results are handed back on the pool thread instead of through a running reactor
+    inline_reactor = SimpleNamespace(callFromThread=lambda f, *args, **kwargs: f(*args, **kwargs))
+    defer_to_thread_pool = threads.deferToThreadPool
+    monkeypatch.setattr(
+        pipelines.threads, "deferToThreadPool",
+        lambda reactor, pool, func, *args: defer_to_thread_pool(inline_reactor, pool, func, *args),
+    )
+    crawler = get_crawler(Spider, {"FILE_PIPELINE_POOL_SIZE": 2})
+    spider = Spider("pooled")
+    crawler.stats.open_spider(spider)
+    pipeline = FileDownloadPipeline()
+    pipeline.crawler = crawler
+    pipeline.pool = pipelines.ThreadPool(minthreads=1, maxthreads=2, name="pooled-FileDownloadPipeline")
+    pipeline.pool.start()
+    pool = pipeline.pool
+
+    completed_on = []
+    pipeline.complete_item = lambda results, item, info: completed_on.append(threading.current_thread()) or item
+    info = SimpleNamespace(downloaded={"url": b""}, spider=spider)
+    done = []
+    for i in range(3):
+        pipeline.item_completed([(True, None)], {"doc_name": f"DoDI {i}"}, info).addCallback(done.append)
+
+    pipeline.retry_queue = []
+    pipeline.remove_partial_downloads = False
+    pipeline.close_jsonl_writers = lambda spider: None
+    pipeline.close_spider(spider)
+
+    # stopping the pool waits for the queued items
+    assert [item["doc_name"] for item in sorted(done, key=lambda item: item["doc_name"])] == ["DoDI 0", "DoDI 1", "DoDI 2"]
+    assert completed_on and threading.main_thread() not in completed_on
+    assert pipeline.pool is None and not pool.started and not any(thread.is_alive() for thread in pool.threads)
+    assert crawler.stats.get_value("file_pipeline/pool_items", spider=spider) == 3
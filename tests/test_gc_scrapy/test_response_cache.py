@@ -0,0 +1,69 @@
+from pathlib import Path
+
+from scrapy import Request, Spider
+from scrapy.http import Response, TextResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from dataPipelines.gc_scrapy.gc_scrapy.downloader_middlewares import ResponseCacheMiddleware
+from dataPipelines.gc_scrapy.gc_scrapy.response_cache import ResponseCache
+
+
+class ListingSpider(Spider):
+    name = "listing"
+    http_cache_freshness = [(r"/static/", 60), (r"/listing", 0)]
+
+
+def get_middleware(tmp_path: Path):
+    stats = MemoryStatsCollector(get_crawler(ListingSpider))
+    return ResponseCacheMiddleware(ResponseCache(tmp_path / "responses.db"), stats), stats
+
+
+def test_fresh_responses_are_served_without_a_request(tmp_path: Path):
+    middleware, stats = get_middleware(tmp_path)
+    spider = ListingSpider()
+    url = "https://example.com/static/index.json"
+
+    request = Request(url)
+    assert middleware.process_request(request, spider) is None
+    middleware.process_response(request, TextResponse(url, body=b'{"a": 1}', encoding="utf-8"), spider)
+
+    cached = middleware.process_request(Request(url), spider)
+    assert cached.body == b'{"a": 1}'
+    assert "cached" in cached.flags
+    assert stats.get_value("response_cache/hit", spider=spider) == 1
+
+    # not matched by http_cache_freshness, never cached
+    assert middleware.process_request(Request("https://example.com/other"), spider) is None
+
+
+def test_stale_responses_are_revalidated(tmp_path: Path):
+    middleware, stats = get_middleware(tmp_path)
+    spider = ListingSpider()
+    url = "https://example.com/listing?page=1"
+
+    request = Request(url)
+    middleware.process_request(request, spider)
+    middleware.process_response(request, Response(url, body=b"rows", headers={"ETag": '"v1"'}), spider)
+
+    revalidation = Request(url)
+    assert middleware.process_request(revalidation, spider) is None
+    assert revalidation.headers["If-None-Match"] == b'"v1"'
+
+    response = middleware.process_response(revalidation, Response(url, status=304), spider)
+    assert response.status == 200
+    assert response.body == b"rows"
+    assert stats.get_value("response_cache/revalidated", spider=spider) == 1
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path: Path):
+    # 400 byte bodies are a little over 400 bytes stored uncompressed, three fit
+    cache = ResponseCache(tmp_path / "responses.db", max_bytes=1300, compression_level=0)
+    for i in range(3):
+        cache.put(str(i), f"https://example.com/{i}", 200, {}, bytes(400))
+    cache.get("0")
+    cache.put("3", "https://example.com/3", 200, {}, bytes(400))
+
+    assert cache.get("1") is None
+    assert all(cache.get(fingerprint) is not None for fingerprint in ("0", "2", "3"))
+    assert cache.total_bytes <= 1300
@@ -0,0 +1,71 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from dataPipelines.gc_scrapy.gc_scrapy.s3_upload import S3Uploader
+
+mock_s3 = getattr(moto, "mock_aws", None) or getattr(moto, "mock_s3")
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="crawls")
+        yield client
+
+
+def test_files_are_uploaded_under_their_download_dir_path_and_deleted(tmp_path: Path, s3_client):
+    big = tmp_path / "DoDI 1.pdf"
+    big.write_bytes(bytes(11 * 2**20))
+    metadata = tmp_path / "DoDI 1.pdf.metadata"
+    metadata.write_text("{}")
+    uploader = S3Uploader(
+        "crawls", tmp_path, prefix="/2022-06-01/", client=s3_client,
+        multipart_threshold=5 * 2**20, multipart_chunksize=5 * 2**20, delete_after_upload=True,
+    )
+
+    futures = [uploader.upload(big), uploader.upload(metadata), uploader.upload(tmp_path / "missing.pdf")]
+    uploader.close()
+
+    assert [f.result() for f in futures] == [True, True, False]
+    head = s3_client.head_object(Bucket="crawls", Key="2022-06-01/DoDI 1.pdf")
+    assert head["ContentLength"] == 11 * 2**20
+    assert head["ETag"].strip('"').endswith("-3")  # 3 multipart parts
+    assert s3_client.get_object(Bucket="crawls", Key="2022-06-01/DoDI 1.pdf.metadata")["Body"].read() == b"{}"
+    assert not big.exists() and not metadata.exists()
+    assert uploader.get_stats()["files"] == 2 and list(uploader.failures) == [str(tmp_path / "missing.pdf")]
+
+    uploader.download(big, tmp_path / "copy.pdf")
+    assert (tmp_path / "copy.pdf").stat().st_size == 11 * 2**20
+
+
+def test_upload_waits_while_max_pending_uploads_are_queued(tmp_path: Path, s3_client):
+    release = threading.Event()
+
+    class SlowClient:
+        def upload_file(self, *args, **kwargs):
+            release.wait(5)
+
+    uploader = S3Uploader("crawls", tmp_path, client=SlowClient(), max_workers=1, max_pending=2)
+    for name in "abc":
+        (tmp_path / name).write_text(name)
+    uploader.upload(tmp_path / "a")
+    uploader.upload(tmp_path / "b")
+
+    third = threading.Thread(target=uploader.upload, args=(tmp_path / "c",))
+    third.start()
+    third.join(0.2)
+    assert third.is_alive()
+
+    release.set()
+    third.join(5)
+    uploader.close()
+    assert uploader.get_stats()["files"] == 3 and uploader.get_stats()["wait_seconds"] > 0
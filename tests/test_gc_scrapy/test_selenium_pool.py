@@ -0,0 +1,151 @@
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from dataPipelines.gc_scrapy.gc_scrapy.downloader_middlewares import SeleniumMiddleware
+from dataPipelines.gc_scrapy.gc_scrapy.middleware_utils.selenium_request import SeleniumRequest
+from dataPipelines.gc_scrapy.gc_scrapy.runspider_settings import selenium_settings
+from dataPipelines.gc_scrapy.gc_scrapy.selenium_pool import (
+    SELENIUM_DRIVER_LEASE, WebDriverPool, close_webdriver_pools,
+)
+from dataPipelines.gc_scrapy.gc_scrapy.spider_middlewares import SeleniumDriverReleaseMiddleware
+
+
+class FakeDriver:
+    def __init__(self, *args, **kwargs):
+        self.current_url = None
+        self.quit_called = False
+        self.cdp_commands = []
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        self.cdp_commands.append((cmd, cmd_args))
+
+    def get(self, url):
+        self.current_url = url
+
+    @property
+    def page_source(self):
+        return f"<html><body>{self.current_url}</body></html>"
+
+    def quit(self):
+        self.quit_called = True
+
+
+def run_inline(pool: WebDriverPool) -> WebDriverPool:
+    # blocking calls run straight away instead of in the pool's threads, no reactor needed
+    pool.run = lambda func, *args, **kwargs: defer.maybeDeferred(func, *args, **kwargs)
+    return pool
+
+
+def results(*deferreds):
+    found = []
+    for d in deferreds:
+        d.addBoth(found.append)
+    return found
+
+
+def test_drivers_are_shared_up_to_size_and_replaced_after_max_pages():
+    pool = run_inline(WebDriverPool(FakeDriver, size=2, max_pages=2))
+
+    first, second = results(pool.acquire(), pool.acquire())
+    third = results(pool.acquire())
+    assert (first.number, second.number, third) == (1, 2, [])
+    assert pool.live == 2 and len(pool.waiting) == 1
+
+    first.pages = 1
+    first.release()
+    first.release()
+    (third,) = third
+    assert third.driver is first.driver and not third.released and not pool.waiting  # the waiting request got driver 1
+
+    third.pages = 2
+    third.release()  # loaded max_pages, quit and replaced on the next acquire
+    assert third.driver.quit_called and pool.live == 1
+    (replacement,) = results(pool.acquire())
+    assert replacement.number == 3 and pool.drivers_recycled == 1
+
+    pool.close()
+    assert second.driver.quit_called and replacement.driver.quit_called
+    assert pool.get_stats()["driver_1/pages"] == 2 and pool.get_stats()["drivers_started"] == 3
+
+
+def open_middleware(name: str, **settings):
+    crawler = get_crawler(Spider, {**selenium_settings, **settings})
+    spider = crawler._create_spider(name)
+    crawler.stats.open_spider(spider)
+    middleware = SeleniumMiddleware.from_crawler(crawler)
+    middleware.driver_pool.create_driver = FakeDriver
+    run_inline(middleware.driver_pool)
+    return crawler, spider, middleware
+
+
+def test_driver_is_held_until_the_callback_output_is_consumed():
+    crawler, spider, middleware = open_middleware("selenium", SELENIUM_DRIVER_POOL_SIZE=1)
+
+    first = SeleniumRequest(url="https://www.e-publishing.af.mil/")
+    second = SeleniumRequest(url="https://www.e-publishing.af.mil/Product-Index/")
+    (response,) = results(middleware.process_request(first, spider))
+    pending = results(middleware.process_request(second, spider))
+    assert response.url == first.url and b"e-publishing" in response.body
+    assert response.meta["driver"] is response.meta[SELENIUM_DRIVER_LEASE].driver
+    assert pending == []
+
+    output = SeleniumDriverReleaseMiddleware().process_spider_output(response, iter(["item", "item"]), spider)
+    next(output)
+    assert pending == []
+    list(output)
+    assert pending[0].url == second.url
+
+    middleware.spider_closed(spider)
+    assert crawler.stats.get_value("selenium_pool/driver_1/pages", spider=spider) == 2
+    assert crawler.stats.get_value("selenium_pool/requests", spider=spider) == 2
+    assert crawler.stats.get_value("selenium_wait/work_seconds", spider=spider) >= 0
+
+
+def test_warm_drivers_are_reset_for_the_next_spider():
+    first_crawler, first_spider, first = open_middleware("navy_med_pubs", SELENIUM_KEEP_DRIVERS_WARM=True)
+    (lease,) = results(first.process_request(SeleniumRequest(url="https://www.med.navy.mil/Directives/"), first_spider))
+    lease = lease.meta[SELENIUM_DRIVER_LEASE]
+    lease.release()
+    first.spider_closed(first_spider)
+    assert not lease.driver.quit_called and first.driver_pool.idle
+
+    second_crawler, second_spider, second = open_middleware("ic_policies", SELENIUM_KEEP_DRIVERS_WARM=True)
+    assert second.driver_pool is first.driver_pool
+    (response,) = results(second.process_request(SeleniumRequest(url="https://www.dni.gov/"), second_spider))
+    assert response.meta["driver"] is lease.driver and lease.driver.cdp_commands == [
+        ("Network.clearBrowserCookies", {}),
+        ("Storage.clearDataForOrigin", {"origin": "https://www.med.navy.mil", "storageTypes": "all"}),
+    ]
+    response.meta[SELENIUM_DRIVER_LEASE].release()
+    second.spider_closed(second_spider)
+
+    stats = second_crawler.stats.get_stats(second_spider)
+    assert stats["selenium_pool/warm_drivers_reused"] == 1 and stats["selenium_pool/drivers_started"] == 0
+    assert first_crawler.stats.get_value("selenium_pool/drivers_started", spider=first_spider) == 1
+
+    close_webdriver_pools()
+    assert lease.driver.quit_called
+
+
+def test_spiders_running_at_the_same_time_get_their_own_pools():
+    first_crawler, first_spider, first = open_middleware("navy_med_pubs", SELENIUM_KEEP_DRIVERS_WARM=True)
+    second_crawler, second_spider, second = open_middleware("ic_policies", SELENIUM_KEEP_DRIVERS_WARM=True)
+    assert second.driver_pool is not first.driver_pool
+
+    (first_response,) = results(first.process_request(SeleniumRequest(url="https://www.med.navy.mil/"), first_spider))
+    (second_response,) = results(second.process_request(SeleniumRequest(url="https://www.dni.gov/"), second_spider))
+    first_driver = first_response.meta["driver"]
+    assert second_response.meta["driver"] is not first_driver and first_driver.cdp_commands == []
+
+    first_response.meta[SELENIUM_DRIVER_LEASE].release()
+    first.spider_closed(first_spider)
+    # the closed spider's pool goes to the next spider, the running one keeps its own
+    third_crawler, third_spider, third = open_middleware("stig", SELENIUM_KEEP_DRIVERS_WARM=True)
+    assert third.driver_pool is first.driver_pool
+
+    second_response.meta[SELENIUM_DRIVER_LEASE].release()
+    for middleware, spider in ((second, second_spider), (third, third_spider)):
+        middleware.spider_closed(spider)
+    close_webdriver_pools()
+    assert first_driver.quit_called and second_response.meta["driver"].quit_called
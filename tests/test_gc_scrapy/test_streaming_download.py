@@ -0,0 +1,131 @@
+import gzip
+from pathlib import Path
+
+from scrapy import Request, Spider
+from scrapy.downloadermiddlewares.httpcompression import HttpCompressionMiddleware
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
+
+from dataPipelines.gc_scrapy.gc_scrapy.streaming_download import (
+    BytesInFlight,
+    PartialDownloads,
+    StreamingScrapyAgent,
+    _FileResponseReader,
+    STREAM_TO_DIR,
+    STREAMED_BYTES,
+    STREAMED_PATH,
+)
+
+
+class FakeTxResponse:
+    def __init__(self, body: bytes, headers: dict):
+        self.code = 200
+        self.length = len(body)
+        self.headers = Headers(headers)
+        self.body = body
+
+    def deliverBody(self, protocol):
+        protocol.dataReceived(self.body)
+        protocol.connectionLost(Failure(ResponseDone()))
+
+
+def get_reader(tmp_path: Path, in_flight: BytesInFlight, finished: defer.Deferred, request: Request, **kwargs):
+    crawler = get_crawler(Spider)
+    crawler.spider = Spider("streaming")
+    return _FileResponseReader(
+        finished=finished,
+        txresponse=None,
+        request=request,
+        maxsize=0,
+        warnsize=0,
+        fail_on_dataloss=False,
+        crawler=crawler,
+        stream_dir=str(tmp_path),
+        chunk_size=100,
+        in_flight=in_flight,
+        **kwargs,
+    )
+
+
+def test_bodies_are_written_to_disk_within_the_bytes_in_flight_cap(tmp_path: Path):
+    in_flight = BytesInFlight(limit=150)
+    requests = [Request(f"https://example.com/{i}.pdf") for i in range(2)]
+    finished = [defer.Deferred() for _ in requests]
+    readers = [get_reader(tmp_path, in_flight, d, r) for d, r in zip(finished, requests)]
+    results = []
+    for d in finished:
+        d.addCallback(results.append)
+
+    for _ in range(5):
+        for i, reader in enumerate(readers):
+            reader.dataReceived(bytes([i]) * 60)
+            assert in_flight.total <= in_flight.limit
+
+    for reader in readers:
+        reader.connectionLost(Failure(ResponseDone()))
+
+    assert in_flight.total == 0
+    assert all(result["body"] == b"" and "streamed" in result["flags"] for result in results)
+    for i, request in enumerate(requests):
+        assert request.meta[STREAMED_BYTES] == 300
+        assert Path(request.meta[STREAMED_PATH]).read_bytes() == bytes([i]) * 300
+
+
+def test_failed_downloads_leave_no_temp_file(tmp_path: Path):
+    finished = defer.Deferred()
+    reader = get_reader(tmp_path, BytesInFlight(limit=1000), finished, Request("https://example.com/a.pdf"))
+    reader.dataReceived(b"partial")
+    finished.cancel()
+    finished.addErrback(lambda _: None)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_truncated_bodies_are_kept_and_resumed(tmp_path: Path):
+    partials = PartialDownloads(tmp_path / ".partial")
+    request = Request("https://example.com/title10.zip")
+    resumable = {"expected_total": 10, "partials": partials, "resume_validators": ('"v1"', None)}
+    results = []
+
+    first = defer.Deferred().addCallback(results.append)
+    reader = get_reader(tmp_path, BytesInFlight(limit=1000), first, request, **resumable)
+    reader.dataReceived(b"01234")
+    reader.connectionLost(Failure(ResponseDone()))
+
+    assert "dataloss" in results[0]["flags"] and "streamed" not in results[0]["flags"]
+    assert STREAMED_PATH not in request.meta
+    assert partials.get(request.url) == {"url": request.url, "total": 10, "etag": '"v1"', "last_modified": None, "size": 5}
+
+    second = defer.Deferred().addCallback(results.append)
+    reader = get_reader(tmp_path, BytesInFlight(limit=1000), second, request, resumed_from=5, **resumable)
+    reader.dataReceived(b"56789")
+    reader.connectionLost(Failure(ResponseDone()))
+
+    assert "streamed" in results[1]["flags"]
+    assert request.meta[STREAMED_BYTES] == 10
+    assert Path(request.meta[STREAMED_PATH]).read_bytes() == b"0123456789"
+    assert partials.get(request.url) is None
+
+
+def test_encoded_bodies_are_buffered_for_decompression(tmp_path: Path):
+    crawler = get_crawler(Spider)
+    crawler.spider = Spider("streaming")
+    agent = StreamingScrapyAgent(crawler=crawler, chunk_size=100, in_flight=BytesInFlight(limit=1000))
+    body = b"<html><body>DoDI 5000.01</body></html>" * 50
+    url = "https://example.com/dodi.html"
+
+    results = []
+    identity = Request(url, meta={STREAM_TO_DIR: str(tmp_path)})
+    agent._cb_bodyready(FakeTxResponse(body, {b"Content-Encoding": [b"identity"]}), identity).addCallback(results.append)
+    assert "streamed" in results[0]["flags"] and Path(identity.meta[STREAMED_PATH]).read_bytes() == body
+
+    request = Request(url, meta={STREAM_TO_DIR: str(tmp_path)})
+    encoded = FakeTxResponse(gzip.compress(body), {b"Content-Encoding": [b"gzip"]})
+    agent._cb_bodyready(encoded, request).addCallback(results.append)
+    assert STREAMED_PATH not in request.meta and list(tmp_path.iterdir()) == [Path(identity.meta[STREAMED_PATH])]
+
+    response = agent._cb_bodydone(results[1], request, url)
+    assert HttpCompressionMiddleware().process_response(request, response, crawler.spider).body == body
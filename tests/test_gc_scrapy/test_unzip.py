@@ -0,0 +1,46 @@
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from dataPipelines.gc_scrapy.gc_scrapy.utils import ZipLimitExceeded, extract_zip_members, unzip_docs_as_needed
+
+
+def make_zip(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_ref:
+        for name, data in members.items():
+            zip_ref.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_only_matching_members_are_extracted_from_nested_zips(tmp_path: Path):
+    nested = make_zip({"inner/title.pdf": b"inner pdf", "title.htm": b"<html>"})
+    zip_path = tmp_path / "Title 10.zip"
+    zip_path.write_bytes(make_zip({"title.pdf": b"outer pdf", "notes.txt": b"notes", "parts.zip": nested}))
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+
+    extracted = unzip_docs_as_needed(zip_path, output_dir, "pdf")
+
+    assert [p.name for p in extracted] == ["title.pdf", "title_dup1.pdf"]
+    assert sorted(p.name for p in output_dir.iterdir()) == ["title.pdf", "title_dup1.pdf"]
+    assert Path(output_dir, "title.pdf").read_bytes() == b"inner pdf"
+    assert not zip_path.exists()
+
+
+def test_extraction_limits(tmp_path: Path):
+    too_deep = make_zip({"doc.pdf": b"pdf"})
+    for _ in range(3):
+        too_deep = make_zip({"nested.zip": too_deep})
+
+    def destination_for(name):
+        return tmp_path / name
+
+    with pytest.raises(ZipLimitExceeded):
+        extract_zip_members(io.BytesIO(too_deep), "pdf", destination_for, max_depth=2)
+    assert extract_zip_members(io.BytesIO(too_deep), "pdf", destination_for, max_depth=3) == [tmp_path / "doc.pdf"]
+
+    with pytest.raises(ZipLimitExceeded):
+        extract_zip_members(io.BytesIO(make_zip({"big.pdf": bytes(100)})), "pdf", destination_for, max_bytes=99)